@@ -0,0 +1,228 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Times `backtest()` and `trade()` end to end and per stage on synthetic
+panels of several sizes, with a mix of SecTypes and currencies, per-group
+commissions and slippage. The QuantRocket services are replaced by
+synthetic data, so the timings exclude network and database time.
+
+The end-to-end timings are of a run without profiling; the per-stage
+timings are of a second run with `profile=True`. Write the timings to a
+JSON file with --output and compare a later run against it with
+--baseline to spot regressions.
+
+To run: python3 -m benchmarks.bench_backtest [--scales 100x2500 3000x5000 500x250x390]
+        [--output timings.json] [--baseline timings.json]
+"""
+
+import argparse
+import gc
+import json
+import shutil
+import tempfile
+import time
+from collections import OrderedDict
+from unittest.mock import patch
+from moonshot import Moonshot
+from moonshot.commission import PercentageCommission
+from moonshot.commission.fut import DemoGlobexEquityEMiniFixedCommission
+from moonshot.commission.fx import SpotFXCommission
+from moonshot.commission.stk import DemoUSStockCommission
+from .panels import make_securities, make_prices, make_download_master_file, make_account_services
+
+# name: (sids, dates, intraday bars per day)
+SCALES = OrderedDict([
+    ("100x2500", (100, 2500, None)),
+    ("3000x5000", (3000, 5000, None)),
+    ("500x250x390", (500, 250, 390)),
+])
+
+# FX is valued in the base currency (from the Symbol)
+NLV = {"USD": 1000000, "EUR": 870000, "JPY": 110000000, "GBP": 780000,
+       "AUD": 1400000, "NZD": 1500000, "CHF": 990000}
+
+ALLOCATIONS = {"U12345": 0.5, "U55555": 0.5}
+
+class EuropeanStockCommission(PercentageCommission):
+    BROKER_COMMISSION_RATE = 0.0005
+    MIN_COMMISSION = 1.25
+
+class JapanStockCommission(PercentageCommission):
+    BROKER_COMMISSION_RATE = 0.0008
+    MIN_COMMISSION = 80
+
+class BenchmarkStrategy(Moonshot):
+    """
+    A long-short moving average strategy with a commission class per
+    (SecType, Exchange, Currency).
+    """
+    CODE = "bench"
+    DB = "bench-db"
+    DB_FIELDS = ["Close", "Volume"]
+    TIMEZONE = "America/New_York"
+    MAVG_WINDOW = 20
+    SLIPPAGE_BPS = 2
+    COMMISSION_CLASS = {
+        ("STK", "NYSE", "USD"): DemoUSStockCommission,
+        ("STK", "IBIS", "EUR"): EuropeanStockCommission,
+        ("STK", "TSEJ", "JPY"): JapanStockCommission,
+        ("FUT", "GLOBEX", "USD"): DemoGlobexEquityEMiniFixedCommission,
+        ("CASH", "IDEALPRO", "USD"): SpotFXCommission,
+    }
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        signals = (closes > mavgs).astype(int) - (closes < mavgs).astype(int)
+        return signals
+
+    def signals_to_target_weights(self, signals, prices):
+        return self.allocate_equal_weights(signals)
+
+    def target_weights_to_positions(self, weights, prices):
+        return weights.shift()
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        return closes.pct_change() * positions.shift()
+
+    def order_stubs_to_orders(self, orders, prices):
+        orders["Exchange"] = "SMART"
+        orders["OrderType"] = "MKT"
+        orders["Tif"] = "DAY"
+        return orders
+
+def _summarize_profile(profile):
+    """
+    Returns a dict of stage: {wall_time, cpu_time, peak_memory_delta} for
+    the stages of a profile, summing repeated stages.
+    """
+    stages = OrderedDict()
+    for record in profile.itertuples():
+        stage = stages.setdefault(
+            record.Stage, dict(wall_time=0.0, cpu_time=0.0, peak_memory_delta=0))
+        stage["wall_time"] += record.WallTime
+        stage["cpu_time"] += record.CpuTime
+        stage["peak_memory_delta"] = max(stage["peak_memory_delta"], record.PeakMemoryDelta or 0)
+    return stages
+
+def run_scale(n_sids, n_dates, n_times):
+    """
+    Returns a dict of timings for one scale.
+    """
+    start = time.time()
+    securities = make_securities(n_sids)
+    prices = make_prices(securities, n_dates, n_times=n_times)
+    generate_time = time.time() - start
+
+    last_date = prices.index.get_level_values("Date")[-1]
+    end_date = last_date.date().isoformat()
+    review_date = end_date
+    if n_times:
+        review_date = "{0} {1}".format(end_date, prices.index.get_level_values("Time")[-1])
+
+    account_services = make_account_services(securities)
+    tmpdir = tempfile.mkdtemp()
+    patchers = [
+        patch("moonshot.cache.TMP_DIR", new=tmpdir),
+        patch("moonshot.strategies.base.get_prices", return_value=prices),
+        patch("moonshot.strategies.base.download_master_file",
+              new=make_download_master_file(securities)),
+    ] + [
+        patch("moonshot.strategies.base.{0}".format(name), new=func)
+        for name, func in account_services.items()]
+
+    timings = OrderedDict(generate=generate_time)
+    for patcher in patchers:
+        patcher.start()
+    try:
+        for method in ("backtest", "trade"):
+            for profile in (False, True):
+                strategy = BenchmarkStrategy()
+                gc.collect()
+                start = time.time()
+                if method == "backtest":
+                    result = strategy.backtest(
+                        end_date=end_date, nlv=NLV, no_cache=True, profile=profile)
+                else:
+                    result = strategy.trade(ALLOCATIONS, review_date=review_date, profile=profile)
+                elapsed = time.time() - start
+                del result
+                if profile:
+                    timings[method + "_stages"] = _summarize_profile(strategy.profile)
+                else:
+                    timings[method] = elapsed
+    finally:
+        for patcher in patchers:
+            patcher.stop()
+        shutil.rmtree(tmpdir)
+
+    return timings
+
+def _format_change(value, baseline_value):
+    if not baseline_value:
+        return ""
+    return "{0:+.0%}".format(value / baseline_value - 1)
+
+def print_timings(name, timings, baseline=None):
+    baseline = baseline or {}
+    print("\n{0} (generated in {1:.1f}s)".format(name, timings["generate"]))
+    for method in ("backtest", "trade"):
+        print("{0:<32}{1:>10.3f}s {2:>8}".format(
+            method + " (end to end)", timings[method],
+            _format_change(timings[method], baseline.get(method))))
+        baseline_stages = baseline.get(method + "_stages", {})
+        for stage, stage_timings in timings[method + "_stages"].items():
+            print("  {0:<30}{1:>10.3f}s {2:>8} cpu {3:>8.3f}s  peak mem +{4:>7.1f} MB".format(
+                stage,
+                stage_timings["wall_time"],
+                _format_change(
+                    stage_timings["wall_time"],
+                    baseline_stages.get(stage, {}).get("wall_time")),
+                stage_timings["cpu_time"],
+                stage_timings["peak_memory_delta"] / 1024 / 1024))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="*", default=list(SCALES.keys()),
+                        help="scales to run, as <sids>x<dates> or <sids>x<dates>x<bars per day> "
+                        "(default: {0})".format(" ".join(SCALES.keys())))
+    parser.add_argument("--output", metavar="PATH", help="write the timings to this JSON file")
+    parser.add_argument("--baseline", metavar="PATH", help="compare with the timings in this JSON file")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    all_timings = OrderedDict()
+    for name in args.scales:
+        if name in SCALES:
+            n_sids, n_dates, n_times = SCALES[name]
+        else:
+            dims = [int(dim) for dim in name.split("x")]
+            n_sids, n_dates = dims[:2]
+            n_times = dims[2] if len(dims) > 2 else None
+        timings = run_scale(n_sids, n_dates, n_times)
+        print_timings(name, timings, baseline.get(name))
+        all_timings[name] = timings
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(all_timings, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the size and write/read time of a cached prices DataFrame with
+each compression codec. A fraction of the sids are listed partway through
+the period (NaN before listing), as is typical of price panels.
+
+To run: python3 -m benchmarks.bench_cache_compression [--sids 3000] [--dates 2500]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import time
+import numpy as np
+from unittest.mock import patch
+from moonshot.cache import Cache, lz4, zstandard
+from .bench_cache_formats import make_prices
+
+def make_listed_prices(n_sids, n_dates, seed=0):
+    """
+    Returns prices rounded to cents in which half the sids are NaN until a
+    random listing date.
+    """
+    prices = make_prices(n_sids, n_dates, seed=seed).round(2)
+    rng = np.random.default_rng(seed)
+    listing_dates = rng.integers(0, n_dates, n_sids)
+    listing_dates[:n_sids // 2] = 0
+    unlisted = np.arange(n_dates)[:, None] < listing_dates[None, :]
+    values = prices.values.copy()
+    values[np.tile(unlisted, (len(values) // n_dates, 1))] = np.nan
+    prices.loc[:, :] = values
+    return prices
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sids", type=int, default=3000)
+    parser.add_argument("--dates", type=int, default=2500)
+    args = parser.parse_args()
+
+    prices = make_listed_prices(args.sids, args.dates)
+    print("{0} sids x {1} dates, {2:.0%} NaN".format(
+        args.sids, args.dates, np.isnan(prices.values).mean()))
+
+    codecs = ["none", "gzip", "lzma"]
+    if lz4:
+        codecs.insert(1, "lz4")
+    if zstandard:
+        codecs.insert(2, "zstd")
+
+    tmpdir = tempfile.mkdtemp()
+    print("{0:<8}{1:>12}{2:>10}{3:>12}{4:>11}".format(
+        "codec", "size (MB)", "ratio", "write (s)", "read (s)"))
+    with patch("moonshot.cache.TMP_DIR", new=tmpdir):
+        with patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0):
+            for codec in codecs:
+                start = time.time()
+                Cache.set(codec, prices, prefix="bench", compression=codec)
+                write_seconds = time.time() - start
+
+                start = time.time()
+                Cache.get(codec, prefix="bench")
+                read_seconds = time.time() - start
+
+                size = os.path.getsize(Cache._get_filepath(codec, prefix="bench"))
+                if codec == "none":
+                    uncompressed_size = size
+                print("{0:<8}{1:>12.1f}{2:>10.1f}{3:>12.2f}{4:>11.2f}".format(
+                    codec, size / 1024**2, uncompressed_size / size,
+                    write_seconds, read_seconds))
+
+    shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
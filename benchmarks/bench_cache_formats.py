@@ -0,0 +1,142 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares load time and memory usage of the pickle, feather and mmap prices
+cache formats. Each load runs in a fresh subprocess so that peak RSS is not
+polluted by the writer. After loading, every value is read once so that
+memory-mapped pages are faulted in. Private RSS excludes file-backed pages,
+which are shared with other processes through the OS page cache.
+
+To run: python3 -m benchmarks.bench_cache_formats [--sids 3000] [--dates 2500]
+"""
+
+import argparse
+import json
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+FIELDS = ["Open", "High", "Low", "Close", "Volume"]
+
+def make_prices(n_sids, n_dates, seed=0):
+    """
+    Returns a (Field, Date) prices DataFrame of random walks.
+    """
+    rng = np.random.default_rng(seed)
+    dates = pd.bdate_range("2000-01-03", periods=n_dates, name="Date")
+    sids = pd.Index(["FI{0}".format(i) for i in range(n_sids)], name="Sid")
+    frames = []
+    for field in FIELDS:
+        values = 10 + rng.standard_normal((n_dates, n_sids)).cumsum(axis=0) * 0.1
+        if field == "Volume":
+            values = rng.integers(0, 1000000, (n_dates, n_sids)).astype(float)
+        frames.append(pd.DataFrame(values, index=dates, columns=sids))
+    return pd.concat(frames, keys=FIELDS, names=["Field"])
+
+def _proc_status_mb(key):
+    """
+    Returns a memory statistic of this process from /proc/self/status in MB,
+    or None if not available.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return None
+
+def _peak_rss_mb():
+    """
+    Returns the peak RSS of this process in MB. VmHWM is preferred over
+    ru_maxrss because the latter carries over the parent's RSS across exec.
+    """
+    peak_rss = _proc_status_mb("VmHWM")
+    if peak_rss is None:
+        # ru_maxrss is in kilobytes on Linux
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    return peak_rss
+
+def _load(format, fields, tmpdir):
+    """
+    Loads the cached prices and prints load time and peak RSS as JSON.
+    """
+    from unittest.mock import patch
+    from moonshot.cache import Cache
+
+    kwargs = dict(codes=["bench-db"], fields=fields)
+    rss_before = _peak_rss_mb()
+    private_rss_before = _proc_status_mb("RssAnon") or 0
+    start = time.time()
+    with patch("moonshot.cache.TMP_DIR", new=tmpdir):
+        prices = Cache.get_prices(kwargs, format=format)
+    elapsed = time.time() - start
+    assert prices is not None
+    prices.values.sum()
+    print(json.dumps({
+        "seconds": elapsed,
+        "peak_rss_mb": _peak_rss_mb() - rss_before,
+        "private_rss_mb": (_proc_status_mb("RssAnon") or 0) - private_rss_before}))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sids", type=int, default=3000)
+    parser.add_argument("--dates", type=int, default=2500)
+    parser.add_argument("--load", nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.load:
+        format, fields, tmpdir = args.load
+        _load(format, fields.split(",") if fields != "all" else None, tmpdir)
+        return
+
+    from unittest.mock import patch
+    from moonshot.cache import Cache
+
+    tmpdir = tempfile.mkdtemp()
+    prices = make_prices(args.sids, args.dates)
+    print("{0} sids x {1} dates x {2} fields".format(args.sids, args.dates, len(FIELDS)))
+
+    with patch("moonshot.cache.TMP_DIR", new=tmpdir):
+        for format in ("pickle", "feather", "mmap"):
+            Cache.set_prices(dict(codes=["bench-db"], fields=None), prices, format=format)
+    del prices
+
+    print("{0:<10}{1:<10}{2:>12}{3:>16}{4:>19}".format(
+        "format", "fields", "load (s)", "peak RSS (MB)", "private RSS (MB)"))
+    # a pickle can only be loaded in its entirety
+    for format, fields in (
+        ("pickle", "all"),
+        ("feather", "all"),
+        ("feather", "Close"),
+        ("mmap", "all")):
+        output = subprocess.check_output(
+            [sys.executable, "-m", "benchmarks.bench_cache_formats",
+             "--load", format, fields, tmpdir])
+        result = json.loads(output.decode().strip().splitlines()[-1])
+        print("{0:<10}{1:<10}{2:>12.2f}{3:>16.0f}{4:>19.0f}".format(
+            format, fields, result["seconds"], result["peak_rss_mb"],
+            result["private_rss_mb"]))
+
+    shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
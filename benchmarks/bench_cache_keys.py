@@ -0,0 +1,90 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the cost of building the `_features` cache key and its digest from
+the prices index and columns: converting them to lists and pickling them,
+versus fingerprinting the underlying arrays.
+
+To run: python3 -m benchmarks.bench_cache_keys [--sids 3000] [--dates 2500] [--times 1]
+"""
+
+import argparse
+import hashlib
+import pickle
+import time
+import pandas as pd
+from moonshot.cache import Cache
+from .bench_cache_formats import FIELDS
+
+def _time(func, repeat=3):
+    """
+    Returns the best of several timings of func, in seconds.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        timings.append(time.time() - start)
+    return min(timings)
+
+def make_index_and_columns(n_sids, n_dates, n_times=1):
+    """
+    Returns the index and columns of a (Field, Date[, Time]) prices DataFrame.
+    """
+    dates = pd.bdate_range("2000-01-03", periods=n_dates, name="Date")
+    if n_times > 1:
+        times = pd.Index(
+            [(pd.Timestamp("09:30") + pd.Timedelta(minutes=i)).strftime("%H:%M:%S")
+             for i in range(n_times)],
+            name="Time")
+        index = pd.MultiIndex.from_product([FIELDS, dates, times], names=["Field", "Date", "Time"])
+    else:
+        index = pd.MultiIndex.from_product([FIELDS, dates], names=["Field", "Date"])
+    columns = pd.Index(["FI{0}".format(i) for i in range(n_sids)], name="Sid")
+    return index, columns
+
+def tolist_key(index, columns):
+    """
+    Builds the cache key from lists and hashes its pickle.
+    """
+    cache_key = ["bench", index.tolist(), columns.tolist()]
+    return hashlib.sha224(pickle.dumps(cache_key)).hexdigest()
+
+def fingerprint_key(index, columns):
+    """
+    Builds the cache key from fingerprints and hashes it.
+    """
+    cache_key = ["bench", Cache.fingerprint(index), Cache.fingerprint(columns)]
+    return Cache._get_filepath(cache_key, prefix="_features")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sids", type=int, default=3000)
+    parser.add_argument("--dates", type=int, default=2500)
+    parser.add_argument("--times", type=int, default=1, help="intraday bars per day")
+    args = parser.parse_args()
+
+    index, columns = make_index_and_columns(args.sids, args.dates, args.times)
+    print("{0} sids x {1} dates x {2} times x {3} fields ({4} index rows)".format(
+        args.sids, args.dates, args.times, len(FIELDS), len(index)))
+
+    print("{0:<14}{1:>12}".format("key", "seconds"))
+    for name, func in (
+        ("tolist", tolist_key),
+        ("fingerprint", fingerprint_key)):
+        print("{0:<14}{1:>12.4f}".format(name, _time(lambda: func(index, columns))))
+
+if __name__ == "__main__":
+    main()
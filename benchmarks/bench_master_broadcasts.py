@@ -0,0 +1,86 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares broadcasting securities master fields across an intraday panel
+with a per-row `DataFrame.apply` (the former implementation of
+`_get_contract_values` and the NLV broadcasts) and with the column-aligned
+NumPy broadcasts Moonshot now uses, and checks that both give the same
+result.
+
+To run: python3 -m benchmarks.bench_master_broadcasts [--sids 500] [--dates 20] [--times 390]
+"""
+
+import argparse
+import time
+import pandas as pd
+from moonshot import Moonshot
+from .panels import make_securities, make_prices
+
+def _time(func, repeat=3):
+    """
+    Returns the result of func and the best of repeat timings.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def apply_contract_values(securities, prices):
+    closes = prices.loc["Close"]
+    if "CASH" in securities.SecType.values:
+        sec_types = closes.apply(lambda x: securities.SecType, axis=1)
+        closes = closes.where(sec_types != "CASH", 1)
+    price_magnifiers = closes.apply(lambda x: securities.PriceMagnifier.fillna(1), axis=1)
+    multipliers = closes.apply(lambda x: securities.Multiplier.fillna(1), axis=1)
+    return closes / price_magnifiers * multipliers
+
+def apply_nlvs(securities, contract_values):
+    return contract_values.apply(lambda x: securities.Nlv, axis=1)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sids", type=int, default=500)
+    parser.add_argument("--dates", type=int, default=20)
+    parser.add_argument("--times", type=int, default=390, help="intraday bars per day")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    securities = make_securities(args.sids)
+    securities["Nlv"] = 1000000
+    securities = securities.sort_index()
+    prices = make_prices(securities, args.dates, n_times=args.times, fields=("Close",))
+
+    strategy = Moonshot()
+    strategy._securities_master = securities
+
+    print("{0} sids x {1} bars".format(args.sids, args.dates * args.times))
+
+    expected, apply_time = _time(lambda: apply_contract_values(securities, prices), args.repeat)
+    result, numpy_time = _time(lambda: strategy._get_contract_values(prices), args.repeat)
+    pd.testing.assert_frame_equal(result, expected.astype(float), check_names=False)
+    print("{0:<20}apply {1:>8.3f}s  numpy {2:>8.3f}s  ({3:.0f}x)".format(
+        "contract values", apply_time, numpy_time, apply_time / numpy_time))
+
+    expected, apply_time = _time(lambda: apply_nlvs(securities, result), args.repeat)
+    nlvs, numpy_time = _time(lambda: strategy._broadcast_master_field("Nlv", result), args.repeat)
+    pd.testing.assert_frame_equal(nlvs, expected, check_names=False, check_dtype=False)
+    print("{0:<20}apply {1:>8.3f}s  numpy {2:>8.3f}s  ({3:.0f}x)".format(
+        "NLVs", apply_time, numpy_time, apply_time / numpy_time))
+
+if __name__ == "__main__":
+    main()
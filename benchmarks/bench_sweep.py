@@ -0,0 +1,114 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares a parameter sweep run as a loop of backtests (each loading the
+cached prices and master file) with `Moonshot.sweep` on 1 and more worker
+processes. The history and master services are replaced by synthetic data.
+
+To run: python3 -m benchmarks.bench_sweep [--sids 500] [--dates 2500] [--n-jobs 4]
+"""
+
+import argparse
+import multiprocessing
+import shutil
+import tempfile
+import time
+from unittest.mock import patch
+import pandas as pd
+from moonshot import Moonshot
+from .bench_cache_formats import make_prices
+
+class DualMovingAverageStrategy(Moonshot):
+
+    DB = "bench-db"
+    DB_FIELDS = ["Close"]
+    TIMEZONE = "America/New_York"
+    LMAVG_WINDOW = 300
+    SMAVG_WINDOW = 100
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        lmavgs = closes.rolling(self.LMAVG_WINDOW).mean()
+        smavgs = closes.rolling(self.SMAVG_WINDOW).mean()
+        signals = smavgs > lmavgs
+        return signals.astype(int)
+
+    def signals_to_target_weights(self, signals, prices):
+        daily_signal_counts = signals.abs().sum(axis=1)
+        weights = signals.div(daily_signal_counts, axis=0).fillna(0)
+        return weights
+
+    def target_weights_to_positions(self, weights, prices):
+        positions = weights.shift()
+        return positions
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        gross_returns = closes.pct_change() * positions.shift()
+        return gross_returns
+
+PARAM_GRID = {"LMAVG_WINDOW": [200, 250, 300], "SMAVG_WINDOW": [20, 50, 100]}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sids", type=int, default=500)
+    parser.add_argument("--dates", type=int, default=2500)
+    parser.add_argument("--n-jobs", type=int, default=multiprocessing.cpu_count())
+    args = parser.parse_args()
+
+    prices = make_prices(args.sids, args.dates).loc[["Close"]]
+    securities = pd.DataFrame(
+        {"Currency": "USD", "Multiplier": None, "PriceMagnifier": None,
+         "Exchange": "NYSE", "SecType": "STK", "Symbol": prices.columns,
+         "Timezone": "America/New_York"},
+        index=prices.columns)
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        with patch("moonshot.cache.TMP_DIR", new=tmpdir), \
+             patch("moonshot.strategies.base.get_prices", return_value=prices), \
+             patch.object(Moonshot, "_download_master_file", return_value=securities):
+
+            # pass an end_date so the cached prices aren't checked against
+            # the (unavailable) database service
+            end_date = prices.index.get_level_values("Date").max().date().isoformat()
+
+            # prime the cache
+            DualMovingAverageStrategy().backtest(end_date=end_date)
+
+            n_combinations = len(PARAM_GRID["LMAVG_WINDOW"]) * len(PARAM_GRID["SMAVG_WINDOW"])
+            print("{0} sids x {1} dates, {2} combinations".format(
+                args.sids, args.dates, n_combinations))
+            print("{0:<24}{1:>12}".format("method", "seconds"))
+
+            start = time.time()
+            for lmavg_window in PARAM_GRID["LMAVG_WINDOW"]:
+                for smavg_window in PARAM_GRID["SMAVG_WINDOW"]:
+                    strategy_class = type(
+                        "DualMovingAverageStrategy", (DualMovingAverageStrategy,),
+                        {"LMAVG_WINDOW": lmavg_window, "SMAVG_WINDOW": smavg_window})
+                    strategy_class().backtest(end_date=end_date)
+            print("{0:<24}{1:>12.2f}".format("backtest loop", time.time() - start))
+
+            for n_jobs in sorted({1, args.n_jobs}):
+                start = time.time()
+                DualMovingAverageStrategy.sweep(PARAM_GRID, end_date=end_date, n_jobs=n_jobs)
+                print("{0:<24}{1:>12.2f}".format(
+                    "sweep n_jobs={0}".format(n_jobs), time.time() - start))
+    finally:
+        shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    main()
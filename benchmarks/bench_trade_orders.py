@@ -0,0 +1,128 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the conversion of target weights to (sid x account) target
+quantities in `trade()` as formerly implemented (with per-sid `apply` and
+a merge of currency pairs) with the NumPy outer products and currency-pair
+rate lookup of `_get_target_quantities`, for several numbers of accounts,
+and checks that both give the same order stubs.
+
+To run: python3 -m benchmarks.bench_trade_orders [--sids 5000] [--accounts 1 5 30]
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from moonshot import Moonshot
+from .panels import make_securities, FX_BASE_CURRENCIES
+
+def _time(func, repeat=3):
+    """
+    Returns the result of func and the best of repeat timings.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+class LegacyTargetQuantities(Moonshot):
+
+    def _get_target_quantities(self, weights, allocations, contract_values,
+                               currencies, balances, exchange_rates):
+        weights = weights.apply(lambda x: x * allocations)
+        contract_values = allocations.apply(lambda x: contract_values).T
+
+        nlvs = balances.NetLiquidation.reindex(allocations.index)
+        nlvs = weights.apply(lambda x: nlvs, axis=1)
+
+        base_currencies = balances.Currency.reindex(allocations.index)
+        base_currencies = weights.apply(lambda x: base_currencies, axis=1)
+        trade_currencies = allocations.apply(lambda x: currencies).T
+
+        base_currencies = base_currencies.stack()
+        trade_currencies= trade_currencies.stack()
+        base_currencies.name = "BaseCurrency"
+        trade_currencies.name = "QuoteCurrency"
+        currencies = pd.concat((base_currencies,trade_currencies), axis=1)
+
+        exchange_rates = pd.merge(currencies, exchange_rates, how="left",
+                                  on=["BaseCurrency","QuoteCurrency"])
+        exchange_rates.index = currencies.index
+        exchange_rates.loc[(exchange_rates.BaseCurrency == exchange_rates.QuoteCurrency), "Rate"] = 1
+        exchange_rates = exchange_rates.Rate.unstack()
+
+        target_trade_values_in_base_currency = weights * nlvs
+        target_trade_values_in_trade_currency = target_trade_values_in_base_currency * exchange_rates
+        target_quantities = target_trade_values_in_trade_currency / contract_values.where(contract_values != 0).abs()
+        target_quantities = target_quantities.round().fillna(0).astype(int)
+        return target_quantities
+
+def make_inputs(n_sids, n_accounts, seed=0):
+    """
+    Returns the weights, allocations, contract values, currencies, balances
+    and exchange rates of a trade.
+    """
+    rng = np.random.default_rng(seed)
+    securities = make_securities(n_sids, seed=seed)
+    sids = securities.index
+
+    weights = pd.Series(rng.choice([-0.001, 0, 0.001], size=n_sids), index=sids)
+    contract_values = pd.Series(rng.uniform(1, 5000, size=n_sids), index=sids)
+    currencies = securities.Currency.where(
+        securities.SecType != "CASH", securities.Symbol.str.split(".").str[0])
+
+    accounts = pd.Index(["U{0:05d}".format(i) for i in range(n_accounts)], name="Account")
+    allocations = pd.Series(rng.uniform(0.1, 1, size=n_accounts), index=accounts)
+    base_currencies = ["USD", "EUR", "JPY"]
+    balances = pd.DataFrame(
+        dict(NetLiquidation=rng.uniform(1e5, 1e7, size=n_accounts),
+             Currency=[base_currencies[i % len(base_currencies)] for i in range(n_accounts)]),
+        index=accounts)
+
+    usd_rates = {"USD": 1.0, "EUR": 0.87, "GBP": 0.78, "AUD": 1.4, "NZD": 1.5,
+                 "CHF": 0.99, "JPY": 110.0}
+    quote_currencies = sorted(set(currencies) | set(FX_BASE_CURRENCIES))
+    exchange_rates = pd.DataFrame(
+        [dict(BaseCurrency=base, QuoteCurrency=quote, Rate=usd_rates[quote] / usd_rates[base])
+         for base in base_currencies for quote in quote_currencies])
+
+    return weights, allocations, contract_values, currencies, balances, exchange_rates
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sids", type=int, default=5000)
+    parser.add_argument("--accounts", type=int, nargs="*", default=[1, 5, 30])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    legacy = LegacyTargetQuantities()
+    strategy = Moonshot()
+
+    for n_accounts in args.accounts:
+        inputs = make_inputs(args.sids, n_accounts)
+        expected, legacy_time = _time(lambda: legacy._get_target_quantities(*inputs), args.repeat)
+        result, numpy_time = _time(lambda: strategy._get_target_quantities(*inputs), args.repeat)
+        pd.testing.assert_frame_equal(
+            strategy._quantities_to_order_stubs(result),
+            legacy._quantities_to_order_stubs(expected))
+        print("{0} sids x {1:<4} accounts  apply/merge {2:>8.3f}s  numpy {3:>8.3f}s  ({4:.0f}x)".format(
+            args.sids, n_accounts, legacy_time, numpy_time, legacy_time / numpy_time))
+
+if __name__ == "__main__":
+    main()
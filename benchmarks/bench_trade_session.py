@@ -0,0 +1,106 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares the latency of trading an intraday strategy at each new minute
+bar with `trade()` from scratch and with a warm `TradingSession`, and checks
+that both give the same orders. The prices query is replaced by a synthetic
+minute-bar panel ending today which gains a bar at each tick, and reports
+the number of bars queried as a proxy for the query time saved.
+
+To run: python3 -m benchmarks.bench_trade_session [--sids 500] [--dates 30] [--times 390] [--ticks 5]
+"""
+
+import argparse
+import time
+from unittest.mock import patch
+import pandas as pd
+from moonshot import TradingSession
+from .bench_trade_tail import IntradayMovingAverageStrategy, ALLOCATIONS
+from .panels import make_securities, make_prices, make_download_master_file, make_account_services
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sids", type=int, default=500)
+    parser.add_argument("--dates", type=int, default=30)
+    parser.add_argument("--times", type=int, default=390, help="intraday bars per day")
+    parser.add_argument("--ticks", type=int, default=5)
+    args = parser.parse_args()
+
+    today = pd.Timestamp.today().normalize()
+    securities = make_securities(args.sids)
+    prices = make_prices(securities, args.dates, n_times=args.times, fields=("Close",),
+                         end_date=today.date().isoformat())
+    all_dates = prices.index.get_level_values("Date")
+    all_times = prices.index.get_level_values("Time")
+    last_date = all_dates.max()
+    times = all_times.unique()
+
+    # start the day halfway through the session
+    now = dict(n_times=args.times // 2)
+    queried_bars = []
+
+    def get_prices(start_date=None, end_date=None, **kwargs):
+        is_queried = (all_dates < last_date) | (all_times <= times[now["n_times"] - 1])
+        if start_date:
+            is_queried &= all_dates >= pd.Timestamp(start_date)
+        if end_date:
+            is_queried &= all_dates <= pd.Timestamp(end_date)
+        queried = prices[is_queried]
+        queried_bars.append(len(queried.loc["Close"]))
+        return queried
+
+    patchers = [
+        patch("moonshot.strategies.base.get_prices", new=get_prices),
+        patch("moonshot.strategies.base.download_master_file",
+              new=make_download_master_file(securities)),
+    ] + [
+        patch("moonshot.strategies.base.{0}".format(name), new=func)
+        for name, func in make_account_services(securities).items()]
+
+    print("{0} sids x {1} dates x {2} bars".format(args.sids, args.dates, args.times))
+
+    for patcher in patchers:
+        patcher.start()
+    try:
+        start = time.time()
+        session = TradingSession(IntradayMovingAverageStrategy, ALLOCATIONS)
+        print("session start {0:>7.3f}s".format(time.time() - start))
+
+        for tick in range(args.ticks):
+            now["n_times"] += 1
+            # trade just after the new bar
+            review_date = "{0} {1}:30".format(last_date.date().isoformat(), times[now["n_times"] - 1][:5])
+
+            del queried_bars[:]
+            start = time.time()
+            expected_orders = IntradayMovingAverageStrategy().trade(ALLOCATIONS, review_date=review_date)
+            cold_time = time.time() - start
+            cold_bars = queried_bars[-1]
+
+            del queried_bars[:]
+            start = time.time()
+            orders = session.trade(review_date=review_date)
+            warm_time = time.time() - start
+            warm_bars = queried_bars[-1]
+
+            pd.testing.assert_frame_equal(orders, expected_orders)
+            print("tick {0:<3}trade {1:>7.3f}s ({2} bars)  session {3:>7.3f}s ({4} bars)".format(
+                tick + 1, cold_time, cold_bars, warm_time, warm_bars))
+    finally:
+        for patcher in patchers:
+            patcher.stop()
+
+if __name__ == "__main__":
+    main()
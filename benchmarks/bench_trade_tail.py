@@ -0,0 +1,138 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares `trade()` of an intraday strategy with and without
+TRADE_TAIL_ONLY, on the last date of a synthetic minute-bar panel (as in
+live trading) and on an earlier review date, and checks that both give the
+same orders. The prices query is replaced by a slice of the panel, so the
+timings exclude network and database time; the number of bars queried is
+reported as a proxy for the query time saved.
+
+To run: python3 -m benchmarks.bench_trade_tail [--sids 500] [--dates 60] [--times 390]
+"""
+
+import argparse
+import time
+from unittest.mock import patch
+import pandas as pd
+from moonshot import Moonshot
+from .panels import make_securities, make_prices, make_download_master_file, make_account_services
+
+ALLOCATIONS = {"U12345": 0.5, "U55555": 0.5}
+
+class IntradayMovingAverageStrategy(Moonshot):
+    """
+    A long-short strategy on a moving average of minute bars.
+    """
+    CODE = "bench-tail"
+    DB = "bench-db"
+    DB_FIELDS = ["Close"]
+    TIMEZONE = "America/New_York"
+    MAVG_WINDOW = 20
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        signals = (closes > mavgs).astype(int) - (closes < mavgs).astype(int)
+        return signals
+
+    def signals_to_target_weights(self, signals, prices):
+        return self.allocate_equal_weights(signals)
+
+    def order_stubs_to_orders(self, orders, prices):
+        orders["Exchange"] = "SMART"
+        orders["OrderType"] = "MKT"
+        orders["Tif"] = "DAY"
+        return orders
+
+class TailIntradayMovingAverageStrategy(IntradayMovingAverageStrategy):
+    TRADE_TAIL_ONLY = True
+
+def _time(func, repeat=3):
+    """
+    Returns the result of func and the best of repeat timings.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sids", type=int, default=500)
+    parser.add_argument("--dates", type=int, default=60)
+    parser.add_argument("--times", type=int, default=390, help="intraday bars per day")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    securities = make_securities(args.sids)
+    prices = make_prices(securities, args.dates, n_times=args.times, fields=("Close",))
+    all_dates = prices.index.get_level_values("Date")
+    last_time = prices.index.get_level_values("Time")[-1]
+
+    queried_bars = []
+
+    def get_prices(start_date=None, end_date=None, **kwargs):
+        queried = prices
+        dates = all_dates
+        if start_date:
+            queried = queried[dates >= pd.Timestamp(start_date)]
+            dates = queried.index.get_level_values("Date")
+        if end_date:
+            queried = queried[dates <= pd.Timestamp(end_date)]
+        queried_bars.append(len(queried.loc["Close"]))
+        return queried
+
+    patchers = [
+        patch("moonshot.strategies.base.get_prices", new=get_prices),
+        patch("moonshot.strategies.base.download_master_file",
+              new=make_download_master_file(securities)),
+    ] + [
+        patch("moonshot.strategies.base.{0}".format(name), new=func)
+        for name, func in make_account_services(securities).items()]
+
+    unique_dates = all_dates.unique()
+    review_dates = [
+        ("last date", unique_dates[-1]),
+        ("earlier date", unique_dates[len(unique_dates) // 2])]
+
+    print("{0} sids x {1} dates x {2} bars".format(args.sids, args.dates, args.times))
+
+    for patcher in patchers:
+        patcher.start()
+    try:
+        for name, date in review_dates:
+            review_date = "{0} {1}".format(date.date().isoformat(), last_time)
+            timings = []
+            for strategy_class in (IntradayMovingAverageStrategy, TailIntradayMovingAverageStrategy):
+                del queried_bars[:]
+                orders, elapsed = _time(
+                    lambda: strategy_class().trade(ALLOCATIONS, review_date=review_date),
+                    args.repeat)
+                timings.append((orders, elapsed, queried_bars[-1]))
+
+            (expected_orders, full_time, full_bars), (orders, tail_time, tail_bars) = timings
+            pd.testing.assert_frame_equal(orders, expected_orders)
+            print("{0:<14}full {1:>7.3f}s ({2} bars)  tail {3:>7.3f}s ({4} bars)  saved {5:>7.3f}s".format(
+                name, full_time, full_bars, tail_time, tail_bars, full_time - tail_time))
+    finally:
+        for patcher in patchers:
+            patcher.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Compares `allocate_fixed_weights_capped` and `neutralize_weights` as
+formerly implemented (copying the row sums into a DataFrame column by
+column) with the NumPy kernels and, if numba is installed, the numba
+kernels, and checks that they give the same weights.
+
+To run: python3 -m benchmarks.bench_weight_allocation [--sids 5000] [--dates 2500]
+"""
+
+import argparse
+import time
+import numpy as np
+import pandas as pd
+try:
+    import numba
+except ImportError:
+    numba = None
+from moonshot import Moonshot
+
+def _time(func, repeat=3):
+    """
+    Returns the result of func and the best of repeat timings.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+class LegacyWeights(Moonshot):
+
+    def allocate_fixed_weights_capped(self, signals, weight, cap=1.0):
+        equal_weighted = self.allocate_equal_weights(signals, cap=cap)
+        fixed_weighted = self.allocate_fixed_weights(signals, weight)
+        fixed_sum = fixed_weighted.abs().sum(axis=1)
+        fixed_sum = pd.DataFrame(dict(
+            [(column, fixed_sum.copy()) for column in signals.columns]),
+            columns=signals.columns, index=signals.index)
+        return pd.DataFrame(
+            np.where(fixed_sum > cap, equal_weighted, fixed_weighted),
+            index=signals.index, columns=signals.columns)
+
+    def neutralize_weights(self, weights):
+        long_weights = weights.where(weights > 0, 0)
+        short_weights = weights.where(weights < 0, 0)
+
+        total_long_weights = long_weights.sum(axis=1)
+        total_long_weights = pd.DataFrame(dict((column, total_long_weights.copy()) for column in weights.columns),
+                                          index=weights.index, columns=weights.columns)
+        total_short_weights = short_weights.abs().sum(axis=1)
+        total_short_weights = pd.DataFrame(dict((column, total_short_weights.copy()) for column in weights.columns),
+                                           index=weights.index, columns=weights.columns)
+
+        long_weights = long_weights.where(
+            total_long_weights <= total_short_weights,
+            long_weights * total_short_weights / total_long_weights.replace(0, 1))
+
+        short_weights = short_weights.where(
+            total_short_weights <= total_long_weights,
+            short_weights * total_long_weights / total_short_weights.replace(0, 1))
+
+        weights = long_weights.where(long_weights > 0, short_weights)
+        return weights
+
+class NumbaWeights(Moonshot):
+    WEIGHT_KERNELS = "numba"
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sids", type=int, default=5000)
+    parser.add_argument("--dates", type=int, default=2500)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(0)
+    signals = pd.DataFrame(
+        rng.choice([-1, 0, 1], size=(args.dates, args.sids), p=[0.2, 0.6, 0.2]),
+        index=pd.bdate_range(end="2018-12-31", periods=args.dates, name="Date"),
+        columns=["FI{0:06d}".format(i) for i in range(args.sids)])
+
+    strategies = [("legacy", LegacyWeights()), ("numpy", Moonshot())]
+    if numba is not None:
+        # compile the kernels before timing
+        NumbaWeights().allocate_market_neutral_fixed_weights_capped(signals.iloc[:2, :2], 0.01)
+        strategies.append(("numba", NumbaWeights()))
+
+    print("{0} sids x {1} dates".format(args.sids, args.dates))
+
+    expected_weights = None
+    expected_neutralized = None
+    for name, strategy in strategies:
+        weights, capped_time = _time(
+            lambda: strategy.allocate_fixed_weights_capped(signals, 0.001, cap=1.0), args.repeat)
+        neutralized, neutralize_time = _time(
+            lambda: strategy.neutralize_weights(weights), args.repeat)
+        if expected_weights is None:
+            expected_weights, expected_neutralized = weights, neutralized
+        else:
+            # the kernels sum in different orders, so compare up to rounding
+            pd.testing.assert_frame_equal(
+                weights, expected_weights, check_dtype=False, check_exact=False, rtol=1e-12, atol=1e-15)
+            pd.testing.assert_frame_equal(
+                neutralized, expected_neutralized, check_dtype=False, check_exact=False, rtol=1e-12, atol=1e-15)
+        print("{0:<8}allocate_fixed_weights_capped {1:>8.3f}s  neutralize_weights {2:>8.3f}s".format(
+            name, capped_time, neutralize_time))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Generates synthetic price panels and securities master files shaped like
+those returned by QuantRocket, for benchmarking.
+"""
+
+import numpy as np
+import pandas as pd
+
+# (SecType, Exchange, Currency, Timezone, share of sids, typical price,
+# Multiplier)
+SECURITY_GROUPS = [
+    ("STK", "NYSE", "USD", "America/New_York", 0.55, 50, None),
+    ("STK", "IBIS", "EUR", "Europe/Berlin", 0.15, 40, None),
+    ("STK", "TSEJ", "JPY", "Asia/Tokyo", 0.15, 3000, None),
+    ("FUT", "GLOBEX", "USD", "America/Chicago", 0.10, 2500, 50),
+    ("CASH", "IDEALPRO", "USD", "America/New_York", 0.05, 1.2, None),
+]
+
+FX_BASE_CURRENCIES = ["EUR", "GBP", "AUD", "NZD", "CHF"]
+
+def make_securities(n_sids, seed=0):
+    """
+    Returns a securities master DataFrame (indexed by Sid) with a mix of
+    SecTypes, exchanges and currencies, in the columns Moonshot loads.
+    """
+    rng = np.random.default_rng(seed)
+    # zero-pad the sids so they sort in numeric order, as QuantRocket
+    # returns sids in sorted order
+    sids = ["FI{0:06d}".format(i) for i in range(n_sids)]
+    weights = np.array([group[4] for group in SECURITY_GROUPS])
+    group_numbers = rng.choice(len(SECURITY_GROUPS), size=n_sids, p=weights / weights.sum())
+
+    records = []
+    for i, (sid, group_number) in enumerate(zip(sids, group_numbers)):
+        sec_type, exchange, currency, timezone, _, _, multiplier = SECURITY_GROUPS[group_number]
+        if sec_type == "CASH":
+            # the quote currency is the Currency, the base currency is in the
+            # Symbol
+            symbol = "{0}.{1}".format(FX_BASE_CURRENCIES[i % len(FX_BASE_CURRENCIES)], currency)
+        else:
+            symbol = "SYM{0}".format(i)
+        records.append(dict(
+            Sid=sid,
+            Symbol=symbol,
+            SecType=sec_type,
+            Exchange=exchange,
+            Currency=currency,
+            Timezone=timezone,
+            Multiplier=multiplier,
+            PriceMagnifier=None))
+
+    securities = pd.DataFrame.from_records(records, index="Sid")
+    return securities
+
+def make_prices(securities, n_dates, n_times=None, fields=("Close", "Volume"),
+                listing_gaps=0.2, end_date="2018-12-31", seed=0):
+    """
+    Returns a (Field, Date) or, if n_times is set, a (Field, Date, Time)
+    prices DataFrame for the sids in the securities master.
+
+    Prices are random walks scaled to each security group's typical price.
+    A fraction (listing_gaps) of the sids is listed after the first date or
+    delisted before the last date, and has NaNs outside its listed period.
+    """
+    rng = np.random.default_rng(seed)
+    sids = pd.Index(securities.index, name="Sid")
+    n_sids = len(sids)
+
+    dates = pd.bdate_range(end=end_date, periods=n_dates, name="Date")
+    if n_times:
+        times = pd.Index(
+            [(pd.Timestamp("09:30") + pd.Timedelta(minutes=i)).strftime("%H:%M:%S")
+             for i in range(n_times)],
+            name="Time")
+        idx = pd.MultiIndex.from_product([dates, times], names=["Date", "Time"])
+    else:
+        idx = dates
+    n_bars = len(idx)
+
+    group_prices = {(group[0], group[2]): group[5] for group in SECURITY_GROUPS}
+    typical_prices = np.array([
+        group_prices[(sec_type, currency)]
+        for sec_type, currency in zip(securities.SecType, securities.Currency)])
+
+    # daily volatility of about 2%, spread across the intraday bars
+    volatility = 0.02 / np.sqrt(n_times or 1)
+    returns = rng.standard_normal((n_bars, n_sids)).astype(np.float32) * volatility
+    closes = typical_prices * np.exp(np.cumsum(returns, axis=0, dtype=np.float64))
+    del returns
+
+    # listing gaps: some sids list late, some delist early
+    bar_numbers = np.arange(n_bars)[:, np.newaxis]
+    listed = np.ones((n_bars, n_sids), dtype=bool)
+    n_gapped = int(n_sids * listing_gaps)
+    if n_gapped:
+        gapped = rng.choice(n_sids, size=n_gapped, replace=False)
+        half = n_gapped // 2
+        listing_bars = rng.integers(1, n_bars, size=half)
+        delisting_bars = rng.integers(1, n_bars, size=n_gapped - half)
+        listed[:, gapped[:half]] = bar_numbers >= listing_bars
+        listed[:, gapped[half:]] = bar_numbers < delisting_bars
+
+    frames = []
+    for field in fields:
+        if field == "Volume":
+            values = rng.integers(100, 1000000, size=(n_bars, n_sids)).astype(np.float64)
+        elif field == "Close":
+            values = closes
+        else:
+            # Open/High/Low within 1% of the close
+            noise = 1 + rng.uniform(-0.01, 0.01, size=(n_bars, n_sids))
+            if field == "High":
+                noise = np.maximum(noise, 1)
+            elif field == "Low":
+                noise = np.minimum(noise, 1)
+            values = closes * noise
+        values = np.where(listed, values, np.nan)
+        frames.append(pd.DataFrame(values, index=idx, columns=sids))
+
+    prices = pd.concat(frames, keys=list(fields), names=["Field"])
+    return prices
+
+def make_download_master_file(securities):
+    """
+    Returns a function which mimics quantrocket.master.download_master_file
+    for the securities master.
+    """
+    def download_master_file(f, sids=None, fields=None, **kwargs):
+        master = securities
+        if sids is not None:
+            master = master.reindex(sids)
+        if fields is not None:
+            master = master[[field for field in fields if field in master.columns]]
+        master.to_csv(f, index=True, header=True)
+        f.seek(0)
+    return download_master_file
+
+def make_account_services(securities, accounts=("U12345", "U55555"),
+                          base_currencies=("USD", "EUR"), nlv=1000000):
+    """
+    Returns a dict of functions which mimic the quantrocket account and
+    blotter functions used by Moonshot.trade, keyed by function name.
+    """
+    currencies = sorted(set(securities.Currency) | set(
+        securities.Symbol[securities.SecType == "CASH"].str.split(".").str[0]))
+    usd_rates = {"USD": 1.0, "EUR": 0.87, "GBP": 0.78, "AUD": 1.4, "NZD": 1.5,
+                 "CHF": 0.99, "JPY": 110.0}
+
+    def download_account_balances(f, **kwargs):
+        balances = pd.DataFrame(dict(
+            Account=list(accounts),
+            NetLiquidation=nlv,
+            Currency=list(base_currencies)))
+        balances.to_csv(f, index=False)
+        f.seek(0)
+
+    def download_exchange_rates(f, **kwargs):
+        rates = pd.DataFrame(
+            [dict(BaseCurrency=base, QuoteCurrency=quote,
+                  Rate=usd_rates[quote] / usd_rates[base])
+             for base in base_currencies for quote in currencies])
+        rates.to_csv(f, index=False)
+        f.seek(0)
+
+    def list_positions(**kwargs):
+        return []
+
+    def download_order_statuses(f, **kwargs):
+        pass
+
+    return dict(
+        download_account_balances=download_account_balances,
+        download_exchange_rates=download_exchange_rates,
+        list_positions=list_positions,
+        download_order_statuses=download_order_statuses)
@@ -16,4 +16,5 @@ from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
 
-from .strategies import Moonshot, MoonshotML
\ No newline at end of file
+from .strategies import Moonshot, MoonshotML
+from .session import TradingSession
\ No newline at end of file
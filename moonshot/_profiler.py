@@ -0,0 +1,266 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import json
+import time
+import functools
+import threading
+import tracemalloc
+from contextlib import contextmanager
+import pandas as pd
+
+class Profiler(object):
+    """
+    Records the wall time, CPU time, peak memory delta and output shape of
+    nested stages.
+
+    The peak memory delta of a stage is the highest memory usage during the
+    stage (including its nested stages) minus the memory usage when the
+    stage started. On Linux, memory usage is the process's resident set size,
+    whose high-water mark can be reset between stages at no cost. Elsewhere,
+    memory usage is measured with tracemalloc, which sees allocations made by
+    Python and NumPy (and therefore pandas) but slows down code that
+    allocates many Python objects.
+
+    Stages can also be recorded from other threads (for example concurrent
+    downloads). They are nested one level below the stage that was open in
+    the starting thread, their CPU time is that of their thread, and their
+    memory usage isn't measured because it can't be told apart from the
+    other threads'.
+    """
+
+    def __init__(self):
+        self.records = []
+        self._memory_source = None
+        self._started_tracemalloc = False
+        self._origin = None
+        self._thread = threading.current_thread()
+        self._main_stack = []
+        self._local = threading.local()
+
+    @property
+    def _stack(self):
+        """
+        The open stages of the current thread.
+        """
+        if threading.current_thread() is self._thread:
+            return self._main_stack
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        return self._local.stack
+
+    def start(self):
+        """
+        Starts measuring memory usage.
+        """
+        self._origin = time.perf_counter()
+        if _reset_peak_rss():
+            self._memory_source = "rss"
+        else:
+            self._memory_source = "tracemalloc"
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+
+    def stop(self):
+        """
+        Stops measuring memory usage.
+        """
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        self._memory_source = None
+
+    def _get_memory(self):
+        """
+        Returns the current memory usage in bytes, or None if not measured.
+        """
+        if self._memory_source == "rss":
+            return _read_proc_status("VmRSS")
+        if self._memory_source == "tracemalloc" and tracemalloc.is_tracing():
+            return tracemalloc.get_traced_memory()[0]
+        return None
+
+    def _get_peak_memory(self):
+        """
+        Returns the peak memory usage in bytes since the last reset and
+        resets it, or None if not measured.
+        """
+        if self._memory_source == "rss":
+            peak = _read_proc_status("VmHWM")
+            _reset_peak_rss()
+            return peak
+        if self._memory_source == "tracemalloc" and tracemalloc.is_tracing():
+            peak = tracemalloc.get_traced_memory()[1]
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            return peak
+        return None
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Context manager which records a stage. Yields the stage's record, a
+        dict to which the caller can add the output shape.
+        """
+        in_main_thread = threading.current_thread() is self._thread
+        depth = len(self._stack)
+        if not in_main_thread:
+            depth += 1 if self._main_stack else 0
+        record = dict(
+            stage=name,
+            depth=depth,
+            start=time.perf_counter() - (self._origin or 0),
+            wall_time=None,
+            cpu_time=None,
+            peak_memory_delta=None,
+            shape=None,
+            thread=threading.get_ident())
+        self.records.append(record)
+
+        if not in_main_thread:
+            wall_start = time.perf_counter()
+            cpu_start = time.thread_time()
+            self._stack.append(None)
+            try:
+                yield record
+            finally:
+                record["cpu_time"] = time.thread_time() - cpu_start
+                record["wall_time"] = time.perf_counter() - wall_start
+                self._stack.pop()
+            return
+
+        # fold the peak so far into the enclosing stage before resetting it
+        peak = self._get_peak_memory()
+        if self._stack and peak is not None:
+            self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+
+        frame = dict(start_memory=self._get_memory(), peak=0)
+        self._stack.append(frame)
+
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            yield record
+        finally:
+            record["cpu_time"] = time.process_time() - cpu_start
+            record["wall_time"] = time.perf_counter() - wall_start
+
+            self._stack.pop()
+            peak = self._get_peak_memory()
+            if peak is not None and frame["start_memory"] is not None:
+                peak = max(frame["peak"], peak)
+                record["peak_memory_delta"] = max(peak - frame["start_memory"], 0)
+                if self._stack:
+                    self._stack[-1]["peak"] = max(self._stack[-1]["peak"], peak)
+
+    def wrap(self, name, func):
+        """
+        Returns a function which calls func in a stage and records the shape
+        of its return value.
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.stage(name) as record:
+                result = func(*args, **kwargs)
+                record["shape"] = _get_shape(result)
+            return result
+        return wrapper
+
+    def to_frame(self):
+        """
+        Returns a DataFrame of the recorded stages, in the order they started.
+        """
+        profile = pd.DataFrame(
+            self.records,
+            columns=["stage", "depth", "start", "wall_time", "cpu_time",
+                     "peak_memory_delta", "shape"])
+        profile = profile.rename(columns={
+            "stage": "Stage",
+            "depth": "Depth",
+            "start": "Start",
+            "wall_time": "WallTime",
+            "cpu_time": "CpuTime",
+            "peak_memory_delta": "PeakMemoryDelta",
+            "shape": "Shape"})
+        return profile
+
+    def to_trace(self):
+        """
+        Returns the recorded stages in the Trace Event Format, which can be
+        viewed in chrome://tracing or https://ui.perfetto.dev.
+        """
+        pid = os.getpid()
+        events = []
+        for record in self.records:
+            events.append(dict(
+                name=record["stage"],
+                ph="X",
+                ts=round(record["start"] * 1e6, 3),
+                dur=round((record["wall_time"] or 0) * 1e6, 3),
+                pid=pid,
+                tid=record["thread"],
+                args=dict(
+                    cpu_time=record["cpu_time"],
+                    peak_memory_delta=record["peak_memory_delta"],
+                    shape=record["shape"])))
+        return dict(traceEvents=events, displayTimeUnit="ms")
+
+    def write_trace(self, filepath):
+        """
+        Writes the JSON trace to filepath.
+        """
+        with open(filepath, "w") as f:
+            json.dump(self.to_trace(), f)
+
+def _get_shape(obj):
+    """
+    Returns the shape of a DataFrame, Series or array, a list of shapes for a
+    tuple or list containing any, or None.
+    """
+    shape = getattr(obj, "shape", None)
+    if isinstance(shape, tuple):
+        return list(shape)
+    if isinstance(obj, (tuple, list)):
+        shapes = [_get_shape(item) for item in obj]
+        if any(shape is not None for shape in shapes):
+            return shapes
+    return None
+
+def _read_proc_status(key):
+    """
+    Returns a memory statistic (in bytes) of this process from
+    /proc/self/status, or None if not available.
+    """
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    return None
+
+def _reset_peak_rss():
+    """
+    Resets the peak RSS (VmHWM) of this process to the current RSS. Returns
+    False if not supported (Linux 4.0+ only).
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except (IOError, OSError):
+        return False
+    return _read_proc_status("VmHWM") is not None
@@ -13,17 +13,114 @@
 # limitations under the License.
 
 import os
+import re
+import gzip
+import lzma
+import glob
+import shutil
 import hashlib
 import pickle
 import time
 import six
 import inspect
 import itertools
+import uuid
+import json
+import contextlib
+import copy
+from collections import Counter, OrderedDict
 import pandas as pd
+import numpy as np
+try:
+    import pyarrow.feather
+except ImportError:
+    pyarrow = None
+try:
+    import fcntl
+except ImportError:
+    # not available on Windows
+    fcntl = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 from quantrocket.db import list_databases
+from moonshot.exceptions import MoonshotParameterError
 
 TMP_DIR = os.environ.get("MOONSHOT_CACHE_DIR", "/tmp")
 
+# On-disk format for cached price histories (the `_history` cache). "pickle"
+# stores the entire prices DataFrame in a single pickle; "feather" stores one
+# Arrow/Feather file per Field so that only the requested fields are loaded;
+# "mmap" stores a raw NumPy array which is memory-mapped read-only so that
+# concurrent processes share one copy of the prices.
+PRICES_CACHE_FORMAT = os.environ.get("MOONSHOT_PRICES_CACHE_FORMAT", "pickle")
+
+# If true, when an open-ended backtest (no end_date) finds that the cached
+# price history has expired because the db was modified, only the dates
+# since the last cached date are queried and appended to the cached history,
+# instead of querying the entire history again. Off by default because
+# retroactive changes to older data (for example split adjustments) are not
+# picked up until the cache is cleared.
+INCREMENTAL_HISTORY = os.environ.get(
+    "MOONSHOT_CACHE_INCREMENTAL_HISTORY", "false").lower() in ("true", "1", "yes")
+
+# Number of seconds to remember the last modified time of dbs reported by
+# list_databases when checking if cached objects have expired
+# (unless_dbs_modified), so that many cache lookups in quick succession
+# (for example a parameter sweep) make one list_databases call. 0 disables
+# it. If DBS_MODIFIED_SHARED is true, the last modified times are also
+# shared with other processes through a file in the cache directory.
+DBS_MODIFIED_TTL = float(os.environ.get("MOONSHOT_CACHE_DBS_MODIFIED_TTL", 0))
+DBS_MODIFIED_SHARED = os.environ.get(
+    "MOONSHOT_CACHE_DBS_MODIFIED_SHARED", "false").lower() in ("true", "1", "yes")
+
+# Reuse of cached price histories for other date ranges of the same query.
+# "slice" serves a request from cached prices whose date range contains the
+# requested date range; "merge" also merges cached prices with overlapping or
+# adjacent date ranges into a single entry when caching. "none" disables it.
+HISTORY_REUSE = os.environ.get("MOONSHOT_CACHE_HISTORY_REUSE", "none")
+
+# Limits on the cache directory, enforced each time an object is cached.
+# MAX_BYTES is the maximum total size in bytes of all cached objects (least
+# recently used objects are evicted first); MAX_AGE is a pandas Timedelta
+# string (for example "7D") after which cached objects are evicted.
+MAX_BYTES = os.environ.get("MOONSHOT_CACHE_MAX_BYTES", None)
+MAX_AGE = os.environ.get("MOONSHOT_CACHE_MAX_AGE", None)
+
+# Memory budget in bytes for the in-process cache tier, which keeps recently
+# used objects in memory in front of the cache directory so that repeat
+# lookups in the same session don't unpickle the object again. 0 disables it.
+MEMORY_CACHE_BYTES = int(os.environ.get("MOONSHOT_MEMORY_CACHE_BYTES", 0))
+
+# Compression codec for cached objects: "lz4", "zstd", "lzma", "gzip", or
+# "none", either for all prefixes (for example "zstd") or per prefix (for
+# example "_history:zstd,_features:lz4,none"; an entry without a prefix
+# applies to all other prefixes). lz4 and zstd fall back to gzip if the lz4
+# or zstandard package isn't installed.
+COMPRESSION = os.environ.get("MOONSHOT_CACHE_COMPRESSION", None)
+
+COMPRESSION_CODECS = ("lz4", "zstd", "lzma", "gzip")
+
+# magic numbers identifying compressed cache files
+COMPRESSION_MAGIC = {
+    b"\x04\x22\x4d\x18": "lz4",
+    b"\x28\xb5\x2f\xfd": "zstd",
+    b"\xfd\x37\x7a\x58\x5a\x00": "lzma",
+    b"\x1f\x8b": "gzip",
+}
+
+# matches moonshot_<prefix>_<digest>.<ext>
+CACHE_ENTRY_REGEX = re.compile(r"^moonshot_(?P<prefix>.*)_(?P<digest>[0-9a-f]{56})\.(?P<ext>\w+)$")
+
+# temporary files and directories older than this many seconds were left
+# behind by interrupted writes and are removed when the cache is pruned
+STALE_TMP_SECONDS = 60 * 60
+
 class Cache:
     """
     Pickle-based cache for caching arbitrary objects (typically DataFrames)
@@ -45,7 +142,7 @@ class Cache:
     >>>
     >>>         if self.is_backtest:
     >>>             # try to load from cache
-    >>>             cache_key = [prices.index.tolist(), prices.columns.tolist()]
+    >>>             cache_key = [Cache.fingerprint(prices.index), Cache.fingerprint(prices.columns)]
     >>>             my_dataframe = Cache.get(cache_key, prefix="my_df", unless_file_modified=self)
     >>>
     >>>         if my_dataframe is None:
@@ -53,20 +150,272 @@ class Cache:
     >>>             my_dataframe = expensive_calculations()
     >>>             if self.is_backtest:
     >>>                 Cache.set(cache_key, my_dataframe, prefix="my_df")
+
+    Limit the cache directory to 10 GB and 7 days, evicting the least recently
+    used objects first, by setting environment variables (before importing
+    moonshot):
+
+    >>> os.environ["MOONSHOT_CACHE_MAX_BYTES"] = str(10 * 1024**3)
+    >>> os.environ["MOONSHOT_CACHE_MAX_AGE"] = "7D"
+
+    Keep up to 2 GB of recently used objects in memory, in front of the cache
+    directory, so that repeated backtests in the same session don't reload them
+    from disk. Objects are copied into and out of memory, so callers can
+    modify them without affecting the cache:
+
+    >>> os.environ["MOONSHOT_MEMORY_CACHE_BYTES"] = str(2 * 1024**3)
+
+    Compress cached price histories with zstd and other cached objects with
+    lz4:
+
+    >>> os.environ["MOONSHOT_CACHE_COMPRESSION"] = "_history:zstd,lz4"
+
+    Inspect and prune the cache:
+
+    >>> Cache.stats()
+    >>> Cache.prune(max_bytes=1024**3)
     """
 
+    # in-process hit/miss/eviction counts by prefix
+    _hits = Counter()
+    _misses = Counter()
+    _evictions = Counter()
+    _evicted_bytes = Counter()
+    _memory_hits = Counter()
+
+    # last modified times of dbs: {list_databases kwargs (JSON): (time
+    # queried, last modified time)}
+    _dbs_last_modified = {}
+
+    # in-process memory tier: {key: (obj, nbytes, mtime_ns)}, ordered from
+    # least to most recently used
+    _memory = OrderedDict()
+
     @classmethod
-    def _get_filepath(cls, key_obj, prefix=None):
+    def _get_filepath(cls, key_obj, prefix=None, ext="pkl"):
         """
         Returns a filepath to use for caching a pickle. The filename contains
         a hex digest of the key_obj, ensuring that the cache won't be used if
         the key_obj changes.
         """
-        digest = hashlib.sha224(pickle.dumps(key_obj)).hexdigest()
-        filepath = "{tmpdir}/moonshot_{prefix}_{digest}.pkl".format(
-            tmpdir=TMP_DIR, prefix=prefix, digest=digest)
+        digest = hashlib.sha224(pickle.dumps(cls._fingerprint_key(key_obj))).hexdigest()
+        filepath = "{tmpdir}/moonshot_{prefix}_{digest}.{ext}".format(
+            tmpdir=TMP_DIR, prefix=prefix, digest=digest, ext=ext)
         return filepath
 
+    @classmethod
+    def _fingerprint_key(cls, key_obj):
+        """
+        Returns the key_obj with any pandas objects or NumPy arrays it contains
+        (directly or nested in lists, tuples, or dicts) replaced by their
+        fingerprint, so that they needn't be pickled to compute the digest.
+        """
+        if isinstance(key_obj, (pd.Index, pd.Series, pd.DataFrame, np.ndarray)):
+            return ("fingerprint", cls.fingerprint(key_obj))
+        if isinstance(key_obj, list):
+            return [cls._fingerprint_key(obj) for obj in key_obj]
+        if type(key_obj) is tuple:
+            return tuple(cls._fingerprint_key(obj) for obj in key_obj)
+        if isinstance(key_obj, dict):
+            return {k: cls._fingerprint_key(v) for k, v in key_obj.items()}
+        return key_obj
+
+    @classmethod
+    def _update_fingerprint(cls, hasher, obj):
+        """
+        Feeds a pandas object or NumPy array into a hasher.
+        """
+        if isinstance(obj, pd.MultiIndex):
+            # hash the (small) levels and the integer codes rather than
+            # materializing the tuples
+            hasher.update(pickle.dumps(("MultiIndex", list(obj.names))))
+            for level, codes in zip(obj.levels, obj.codes):
+                cls._update_fingerprint(hasher, level)
+                cls._update_fingerprint(hasher, np.asarray(codes))
+
+        elif isinstance(obj, pd.Index):
+            hasher.update(pickle.dumps((type(obj).__name__, obj.name, str(obj.dtype))))
+            if isinstance(obj, (pd.DatetimeIndex, pd.TimedeltaIndex, pd.PeriodIndex)):
+                cls._update_fingerprint(hasher, obj.asi8)
+            else:
+                cls._update_fingerprint(hasher, obj.to_numpy())
+
+        elif isinstance(obj, pd.Series):
+            hasher.update(pickle.dumps(("Series", obj.name, str(obj.dtype))))
+            cls._update_fingerprint(hasher, obj.index)
+            cls._update_fingerprint(hasher, obj.to_numpy())
+
+        elif isinstance(obj, pd.DataFrame):
+            hasher.update(pickle.dumps(("DataFrame", [str(dtype) for dtype in obj.dtypes])))
+            cls._update_fingerprint(hasher, obj.index)
+            cls._update_fingerprint(hasher, obj.columns)
+            if len(obj.dtypes.unique()) == 1:
+                cls._update_fingerprint(hasher, obj.to_numpy())
+            else:
+                for _, column in obj.items():
+                    cls._update_fingerprint(hasher, column.to_numpy())
+
+        else:
+            values = np.asarray(obj)
+            hasher.update(pickle.dumps(("ndarray", str(values.dtype), values.shape)))
+            if values.dtype.kind == "O":
+                # hash the objects (typically strings) to uint64s
+                values = pd.util.hash_array(values.ravel(order="F"))
+            # hash the raw bytes, in column order (pandas' internal layout
+            # for DataFrame values) to avoid copying
+            hasher.update(np.asfortranarray(values).ravel(order="F").view(np.uint8))
+
+    @classmethod
+    def fingerprint(cls, obj):
+        """
+        Returns a stable hex digest of a DataFrame, Series, Index, or NumPy
+        array, suitable for use in a cache key.
+
+        The fingerprint is computed from the underlying arrays (for a
+        MultiIndex, the levels and integer codes) together with the shape,
+        dtypes and names, which is much faster than converting a large index
+        to a list and pickling it. The fingerprint is the same in any process
+        for the same object or one constructed the same way. Equal objects
+        with different internal representations (for example a MultiIndex
+        whose levels are ordered differently) may have different fingerprints,
+        which only results in a cache miss.
+
+        Pandas objects and arrays in keys passed to `get` and `set` are
+        fingerprinted automatically.
+
+        Parameters
+        ----------
+        obj : DataFrame, Series, Index, or array, required
+            the object to fingerprint
+
+        Returns
+        -------
+        str
+            hex digest
+
+        Examples
+        --------
+        Build a cache key from the prices index and columns:
+
+        >>> cache_key = [Cache.fingerprint(prices.index), Cache.fingerprint(prices.columns)]
+        """
+        hasher = hashlib.sha224()
+        cls._update_fingerprint(hasher, obj)
+        return hasher.hexdigest()
+
+    @classmethod
+    def _is_expired(cls, filepath, unless_file_modified=None, unless_dbs_modified=None):
+        """
+        Returns True if the cached file is older than the watched file or dbs.
+        """
+        cache_last_modified = os.path.getmtime(filepath)
+
+        if unless_file_modified is not None:
+
+            if not isinstance(unless_file_modified, six.string_types):
+
+                if hasattr(unless_file_modified, "__module__"):
+                    unless_file_modified = inspect.getmodule(unless_file_modified)
+                elif hasattr(unless_file_modified, "__class__"):
+                    unless_file_modified = unless_file_modified.__class__
+
+                unless_file_modified = inspect.getfile(unless_file_modified)
+
+            watch_file_last_modified = os.path.getmtime(unless_file_modified)
+
+            if watch_file_last_modified > cache_last_modified:
+                return True
+
+        if unless_dbs_modified:
+            db_last_modified = cls._get_dbs_last_modified(unless_dbs_modified)
+            if db_last_modified is not None and db_last_modified > cache_last_modified:
+                return True
+
+        return False
+
+    @classmethod
+    def _get_dbs_last_modified(cls, unless_dbs_modified):
+        """
+        Returns the last modified time (as a Unix timestamp) of the dbs
+        matching the list_databases kwargs, or None if not known. Results are
+        remembered for DBS_MODIFIED_TTL seconds.
+        """
+        memo_key = json.dumps(unless_dbs_modified, sort_keys=True, default=str)
+        now = time.time()
+
+        if DBS_MODIFIED_TTL:
+            memo = cls._dbs_last_modified
+            if DBS_MODIFIED_SHARED:
+                memo = dict(memo, **cls._read_shared_dbs_last_modified())
+            if memo_key in memo:
+                queried_at, db_last_modified = memo[memo_key]
+                if now - queried_at < DBS_MODIFIED_TTL:
+                    return db_last_modified
+
+        databases = list_databases(**dict(unless_dbs_modified, detail=True))
+        databases = pd.DataFrame.from_records(
+            itertools.chain(databases["sqlite"], databases["postgres"]))
+        db_last_modified = None
+        # databases might be empty if testing with a real-time aggregate
+        # database because list_databases doesn't report on aggregate
+        # databases, only tick databases. Ideally we should translate the
+        # aggregate code to the corresponding tick db code and pass that
+        # to list_databases, but that is not implemented.
+        if not databases.empty:
+            db_last_modified = databases.last_modified.dropna().max()
+            if not pd.isnull(db_last_modified):
+                db_last_modified = time.mktime(pd.Timestamp(db_last_modified).timetuple())
+            else:
+                db_last_modified = None
+
+        if DBS_MODIFIED_TTL:
+            cls._dbs_last_modified[memo_key] = (now, db_last_modified)
+            if DBS_MODIFIED_SHARED:
+                cls._write_shared_dbs_last_modified(memo_key, (now, db_last_modified))
+
+        return db_last_modified
+
+    @classmethod
+    def _get_shared_dbs_last_modified_filepath(cls):
+        """
+        Returns the path of the file for sharing db last modified times.
+        """
+        return os.path.join(TMP_DIR, ".moonshot_dbs_last_modified.json")
+
+    @classmethod
+    def _read_shared_dbs_last_modified(cls):
+        """
+        Returns the db last modified times shared by other processes.
+        """
+        try:
+            with open(cls._get_shared_dbs_last_modified_filepath()) as f:
+                return {k: tuple(v) for k, v in json.load(f).items()}
+        except (IOError, OSError, ValueError):
+            return {}
+
+    @classmethod
+    def _write_shared_dbs_last_modified(cls, memo_key, value):
+        """
+        Shares a db last modified time with other processes. Expired entries
+        are dropped.
+        """
+        now = time.time()
+        memo = {
+            k: v for k, v in cls._read_shared_dbs_last_modified().items()
+            if now - v[0] < DBS_MODIFIED_TTL}
+        memo[memo_key] = value
+
+        filepath = cls._get_shared_dbs_last_modified_filepath()
+        tmp_filepath = cls._get_tmp_path(filepath)
+        try:
+            with open(tmp_filepath, "w") as f:
+                json.dump(memo, f)
+            os.replace(tmp_filepath, filepath)
+        except (IOError, OSError):
+            # the memo is only an optimization
+            if os.path.exists(tmp_filepath):
+                os.remove(tmp_filepath)
+
     @classmethod
     def get(cls, key_obj, prefix=None, unless_file_modified=None, unless_dbs_modified=None):
         """
@@ -105,53 +454,56 @@ class Cache:
         """
 
         filepath = cls._get_filepath(key_obj, prefix=prefix)
-        if not os.path.exists(filepath):
-            return None
-
-        cache_last_modified = os.path.getmtime(filepath)
-
-        if unless_file_modified is not None:
-
-            if not isinstance(unless_file_modified, six.string_types):
+        obj = cls._load(
+            filepath, prefix=prefix, unless_file_modified=unless_file_modified,
+            unless_dbs_modified=unless_dbs_modified)
+        cls._record_lookup(prefix, obj)
+        return obj
 
-                if hasattr(unless_file_modified, "__module__"):
-                    unless_file_modified = inspect.getmodule(unless_file_modified)
-                elif hasattr(unless_file_modified, "__class__"):
-                    unless_file_modified = unless_file_modified.__class__
+    @classmethod
+    def _record_lookup(cls, prefix, obj):
+        """
+        Records a cache hit or miss.
+        """
+        if obj is None:
+            cls._misses[prefix] += 1
+        else:
+            cls._hits[prefix] += 1
 
-                unless_file_modified = inspect.getfile(unless_file_modified)
+    @classmethod
+    def _load(cls, filepath, prefix=None, unless_file_modified=None, unless_dbs_modified=None):
+        """
+        Returns the object cached in the file, or None if it is not available
+        or expired.
+        """
+        if not os.path.exists(filepath):
+            return None
 
-            watch_file_last_modified = os.path.getmtime(unless_file_modified)
+        if cls._is_expired(
+            filepath,
+            unless_file_modified=unless_file_modified,
+            unless_dbs_modified=unless_dbs_modified):
+            return None
 
-            if watch_file_last_modified > cache_last_modified:
+        obj = cls._get_from_memory(filepath, filepath)
+        if obj is not None:
+            cls._memory_hits[prefix] += 1
+        else:
+            f = cls._open_for_read(filepath)
+            if f is None:
+                # compressed with a codec that isn't installed
                 return None
+            with f:
+                obj = pickle.load(f)
+            cls._set_in_memory(filepath, filepath, obj)
 
-        if unless_dbs_modified:
-            unless_dbs_modified["detail"] = True
-            databases = list_databases(**unless_dbs_modified)
-            databases = pd.DataFrame.from_records(
-                itertools.chain(databases["sqlite"], databases["postgres"]))
-            # databases might be empty if testing with a real-time aggregate
-            # database because list_databases doesn't report on aggregate
-            # databases, only tick databases. Ideally we should translate the
-            # aggregate code to the corresponding tick db code and pass that
-            # to list_databases, but that is not implemented.
-            if not databases.empty:
-                db_last_modified = databases.last_modified.dropna().max()
-                if not pd.isnull(db_last_modified):
-                    db_last_modified = time.mktime(pd.Timestamp(db_last_modified).timetuple())
-                    if db_last_modified > cache_last_modified:
-                        return None
-
-        with open(filepath, "rb") as f:
-            obj = pickle.load(f)
-
+        cls._touch(filepath)
         return obj
 
     @classmethod
-    def set(cls, key_obj, obj_to_cache, prefix=None):
+    def set(cls, key_obj, obj_to_cache, prefix=None, compression=None):
         """
-        Caches an arbitrary object using pickle.
+        Caches an arbitrary object using pickle, optionally compressed.
 
         Parameters
         ----------
@@ -166,6 +518,11 @@ class Cache:
             a prefix to use for the cache key (in case the key_obj is used for
             caching multiple objects)
 
+        compression : str, optional
+            compression codec: "lz4", "zstd", "lzma", "gzip", or "none".
+            Defaults to the MOONSHOT_CACHE_COMPRESSION environment variable,
+            or no compression
+
         Returns
         -------
         None
@@ -175,5 +532,1122 @@ class Cache:
         See class docstring for typical usage.
         """
         filepath = cls._get_filepath(key_obj, prefix=prefix)
-        with open(filepath, "wb") as f:
-            pickle.dump(obj_to_cache, f)
+        compression = cls._get_compression(prefix, compression=compression)
+
+        # write to a temporary file and rename it into place, so that
+        # concurrent readers never see a partially written file
+        tmp_filepath = cls._get_tmp_path(filepath)
+        try:
+            with cls._open_for_write(tmp_filepath, compression) as f:
+                pickle.dump(obj_to_cache, f)
+            os.replace(tmp_filepath, filepath)
+        except Exception:
+            # the temporary file may not have been created
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp_filepath)
+            raise
+
+        cls._set_in_memory(filepath, filepath, obj_to_cache)
+        cls._prune_after_set(filepath)
+
+    @classmethod
+    def _get_tmp_path(cls, path, suffix=".tmp"):
+        """
+        Returns a unique hidden path in the cache directory for writing a
+        file or directory before renaming it to path. (Unlike tempfile, the
+        file is created with the usual permissions.)
+        """
+        return os.path.join(TMP_DIR, ".{0}.{1}.{2}{3}".format(
+            os.path.basename(path), os.getpid(), uuid.uuid4().hex, suffix))
+
+    @classmethod
+    @contextlib.contextmanager
+    def lock(cls, key_obj, prefix=None):
+        """
+        Context manager which holds an exclusive lock on a cache key, across
+        processes, for example to let only one of many parallel backtests
+        compute or query an object while the others wait and then load it
+        from cache.
+
+        The lock is a file lock on a hidden file in the cache directory. On
+        platforms without fcntl (Windows), no lock is taken.
+
+        Parameters
+        ----------
+        key_obj : obj, required
+            the cache key to lock
+
+        prefix : str, optional
+            the prefix of the cache key, if any
+
+        Returns
+        -------
+        context manager
+
+        Examples
+        --------
+        Compute an expensive DataFrame once, even if several backtests start
+        at the same time:
+
+        >>> my_dataframe = Cache.get(cache_key, prefix="my_df")
+        >>> if my_dataframe is None:
+        >>>     with Cache.lock(cache_key, prefix="my_df"):
+        >>>         # another process may have cached it while we waited
+        >>>         my_dataframe = Cache.get(cache_key, prefix="my_df")
+        >>>         if my_dataframe is None:
+        >>>             my_dataframe = expensive_calculations()
+        >>>             Cache.set(cache_key, my_dataframe, prefix="my_df")
+        """
+        if fcntl is None:
+            yield
+            return
+
+        with open(cls._get_lockpath(key_obj, prefix=prefix), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @classmethod
+    @contextlib.contextmanager
+    def _try_lock(cls, key_obj, prefix=None):
+        """
+        Context manager which takes the lock on a cache key if it is free,
+        without waiting. Yields True if the lock was taken (or if locking is
+        unsupported), or False if another process (or another lock in this
+        process) holds it.
+        """
+        if fcntl is None:
+            yield True
+            return
+
+        with open(cls._get_lockpath(key_obj, prefix=prefix), "a") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    @classmethod
+    def _get_lockpath(cls, key_obj, prefix=None):
+        """
+        Returns the path of the hidden lock file for a cache key.
+        """
+        filepath = cls._get_filepath(key_obj, prefix=prefix, ext="lock")
+        return os.path.join(
+            os.path.dirname(filepath), ".{0}".format(os.path.basename(filepath)))
+
+    @classmethod
+    def _get_compression(cls, prefix, compression=None):
+        """
+        Returns the compression codec to use for the prefix, or None for no
+        compression.
+        """
+        if compression is None:
+            compression = COMPRESSION
+
+        if not compression:
+            return None
+
+        codecs = {}
+        for codec in compression.split(","):
+            codec_prefix, _, codec = codec.strip().rpartition(":")
+            codecs[codec_prefix or None] = codec
+
+        codec = codecs.get(prefix, codecs.get(None))
+        if not codec or codec == "none":
+            return None
+
+        if codec not in COMPRESSION_CODECS:
+            raise MoonshotParameterError(
+                "invalid compression codec: {0} (choices are {1})".format(
+                    codec, ", ".join(COMPRESSION_CODECS + ("none",))))
+
+        if (codec == "lz4" and lz4 is None) or (codec == "zstd" and zstandard is None):
+            codec = "gzip"
+
+        return codec
+
+    @classmethod
+    def _open_for_write(cls, filepath, compression=None):
+        """
+        Returns a file object for writing the cached file, which compresses
+        the stream with the codec, if any.
+        """
+        if compression == "lz4":
+            return lz4.frame.open(filepath, "wb")
+        if compression == "zstd":
+            return zstandard.open(filepath, "wb")
+        # favor speed over ratio for the stdlib codecs, whose default levels
+        # are very slow on large DataFrames
+        if compression == "lzma":
+            return lzma.open(filepath, "wb", preset=1)
+        if compression == "gzip":
+            return gzip.open(filepath, "wb", compresslevel=1)
+        return open(filepath, "wb")
+
+    @classmethod
+    def _open_for_read(cls, filepath):
+        """
+        Returns a file object for reading the cached file, which decompresses
+        the stream if the file is compressed, or None if the file was
+        compressed with a codec whose package isn't installed.
+        """
+        with open(filepath, "rb") as f:
+            header = f.read(6)
+
+        compression = None
+        for magic, codec in COMPRESSION_MAGIC.items():
+            if header.startswith(magic):
+                compression = codec
+                break
+
+        if compression == "lz4":
+            return lz4.frame.open(filepath, "rb") if lz4 else None
+        if compression == "zstd":
+            return zstandard.open(filepath, "rb") if zstandard else None
+        if compression == "lzma":
+            return lzma.open(filepath, "rb")
+        if compression == "gzip":
+            return gzip.open(filepath, "rb")
+        return open(filepath, "rb")
+
+    @classmethod
+    def _get_from_memory(cls, key, filepath):
+        """
+        Returns an object from the in-process memory tier, or None if it is
+        not in memory or the cached file it was loaded from has since been
+        modified or removed.
+        """
+        if key not in cls._memory:
+            return None
+
+        obj, _, mtime_ns = cls._memory[key]
+        try:
+            is_current = os.stat(filepath).st_mtime_ns == mtime_ns
+        except OSError:
+            is_current = False
+
+        if not is_current:
+            del cls._memory[key]
+            return None
+
+        cls._memory.move_to_end(key)
+        return cls._copy(obj)
+
+    @classmethod
+    def _set_in_memory(cls, key, filepath, obj):
+        """
+        Stores an object in the in-process memory tier, evicting the least
+        recently used objects as needed to stay within MEMORY_CACHE_BYTES.
+        Objects larger than the budget are not stored.
+        """
+        cls._memory.pop(key, None)
+
+        if not MEMORY_CACHE_BYTES:
+            return
+
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            nbytes = int(np.sum(obj.memory_usage(deep=True)))
+        else:
+            nbytes = os.path.getsize(filepath)
+
+        if nbytes > MEMORY_CACHE_BYTES:
+            return
+
+        used_bytes = sum(nbytes for _, nbytes, _ in cls._memory.values())
+        while cls._memory and used_bytes + nbytes > MEMORY_CACHE_BYTES:
+            _, (_, evicted_nbytes, _) = cls._memory.popitem(last=False)
+            used_bytes -= evicted_nbytes
+
+        cls._memory[key] = (cls._copy(obj), nbytes, os.stat(filepath).st_mtime_ns)
+
+    @classmethod
+    def _copy(cls, obj):
+        """
+        Returns a copy of an object stored in or returned from the memory
+        tier, so that callers who modify an object after caching or getting
+        it don't modify the cached object. Read-only (memory-mapped) prices
+        are copied shallowly, since their values can't be modified in place
+        and are shared through the OS page cache.
+        """
+        if isinstance(obj, (pd.DataFrame, pd.Series)):
+            values = obj.values if obj.ndim == 1 or obj.dtypes.nunique() == 1 else None
+            is_read_only = isinstance(values, np.ndarray) and not values.flags.writeable
+            return obj.copy(deep=not is_read_only)
+        return copy.deepcopy(obj)
+
+    @classmethod
+    def clear_memory(cls):
+        """
+        Empties the in-process memory tier. The cache directory is not
+        affected.
+
+        Returns
+        -------
+        None
+        """
+        cls._memory.clear()
+
+    @classmethod
+    def _touch(cls, filepath):
+        """
+        Records an access to a cached file by updating its access time. The
+        modification time, which is used to check expiration, is preserved.
+        """
+        try:
+            stat = os.stat(filepath)
+            os.utime(filepath, ns=(time.time_ns(), stat.st_mtime_ns))
+        except OSError:
+            pass
+
+    @classmethod
+    def _list_entries(cls):
+        """
+        Returns a list of dicts describing each cached object in the cache
+        directory.
+        """
+        entries = []
+        for path in glob.glob(os.path.join(TMP_DIR, "moonshot_*")):
+            match = CACHE_ENTRY_REGEX.match(os.path.basename(path))
+            if not match:
+                continue
+            # columnar price caches are directories; the metadata file
+            # records the access and modification times
+            metapath = os.path.join(path, "_meta.pkl")
+            try:
+                stat = os.stat(metapath if os.path.exists(metapath) else path)
+            except OSError:
+                # removed by another process
+                continue
+            entries.append({
+                "path": path,
+                "prefix": match.group("prefix"),
+                "bytes": cls._get_entry_bytes(path),
+                "last_accessed": max(stat.st_atime, stat.st_mtime),
+                "last_modified": stat.st_mtime})
+        return entries
+
+    @classmethod
+    def _remove_entry(cls, path):
+        """
+        Removes a cached file or directory.
+        """
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except OSError:
+            # removed by another process
+            pass
+
+    @classmethod
+    def prune(cls, max_bytes=None, max_age=None, exclude=None):
+        """
+        Evicts cached objects older than max_age, then evicts the least
+        recently used cached objects until the cache directory is no larger
+        than max_bytes.
+
+        Pruning also removes temporary files left behind by interrupted
+        writes, and catalogs of cached price date ranges (or catalog entries)
+        whose prices have been evicted. Lock files are kept: they are empty,
+        and removing a lock file while another process has it open would let
+        two processes hold the same lock.
+
+        Parameters
+        ----------
+        max_bytes : int, optional
+            the maximum total size of the cache directory in bytes. Defaults
+            to the MOONSHOT_CACHE_MAX_BYTES environment variable, if set
+
+        max_age : str, optional
+            evict objects cached longer ago than this pandas Timedelta string
+            (for example "7D"). Defaults to the MOONSHOT_CACHE_MAX_AGE
+            environment variable, if set
+
+        exclude : list of str, optional
+            don't evict these paths
+
+        Returns
+        -------
+        DataFrame
+            the evicted objects, with columns Path, Prefix, Bytes, LastAccessed,
+            Reason
+
+        Examples
+        --------
+        Evict everything older than 1 day:
+
+        >>> Cache.prune(max_age="1D")
+        """
+        max_bytes = max_bytes if max_bytes is not None else MAX_BYTES
+        max_age = max_age if max_age is not None else MAX_AGE
+        exclude = exclude or []
+
+        entries = [entry for entry in cls._list_entries() if entry["path"] not in exclude]
+        evicted = []
+
+        if max_age is not None:
+            oldest_allowed = time.time() - pd.Timedelta(max_age).total_seconds()
+            for entry in list(entries):
+                if entry["last_modified"] < oldest_allowed:
+                    entry["reason"] = "max_age"
+                    evicted.append(entry)
+                    entries.remove(entry)
+
+        if max_bytes is not None:
+            max_bytes = int(max_bytes)
+            total_bytes = sum(entry["bytes"] for entry in entries)
+            total_bytes += sum(
+                cls._get_entry_bytes(path) for path in exclude)
+            # least recently accessed first
+            for entry in sorted(entries, key=lambda entry: entry["last_accessed"]):
+                if total_bytes <= max_bytes:
+                    break
+                entry["reason"] = "max_bytes"
+                evicted.append(entry)
+                total_bytes -= entry["bytes"]
+
+        for entry in evicted:
+            cls._remove_entry(entry["path"])
+            cls._evictions[entry["prefix"]] += 1
+            cls._evicted_bytes[entry["prefix"]] += entry["bytes"]
+
+        cls._remove_stale_tmp_paths()
+        if evicted:
+            cls._prune_catalogs()
+
+        evicted = pd.DataFrame.from_records(
+            evicted, columns=["path", "prefix", "bytes", "last_accessed", "reason"])
+        evicted["last_accessed"] = pd.to_datetime(evicted["last_accessed"], unit="s")
+        evicted.columns = ["Path", "Prefix", "Bytes", "LastAccessed", "Reason"]
+        return evicted
+
+    @classmethod
+    def _remove_stale_tmp_paths(cls):
+        """
+        Removes temporary files and directories left behind by interrupted
+        writes.
+        """
+        oldest_allowed = time.time() - STALE_TMP_SECONDS
+        for pattern in (".moonshot_*.tmp", ".moonshot_*.old"):
+            for path in glob.glob(os.path.join(TMP_DIR, pattern)):
+                try:
+                    is_stale = os.stat(path).st_mtime < oldest_allowed
+                except OSError:
+                    # renamed into place by another process
+                    continue
+                if is_stale:
+                    cls._remove_entry(path)
+
+    @classmethod
+    def _prune_catalogs(cls):
+        """
+        Removes the catalog entries of evicted prices, and catalogs with no
+        remaining entries. Catalogs which are being updated are skipped (the
+        update may itself be pruning the cache) and pruned next time.
+        """
+        for catalog_filepath in glob.glob(os.path.join(TMP_DIR, ".moonshot_*.catalog.json")):
+            with cls._try_lock(catalog_filepath, prefix="_catalog") as is_locked:
+                if not is_locked:
+                    continue
+                try:
+                    with open(catalog_filepath) as f:
+                        num_entries = len(json.load(f))
+                except (IOError, OSError, ValueError):
+                    num_entries = None
+
+                entries = cls._read_catalog(catalog_filepath)
+                if not entries:
+                    cls._remove_entry(catalog_filepath)
+                elif len(entries) != num_entries:
+                    cls._write_catalog(catalog_filepath, entries)
+
+    @classmethod
+    def _get_entry_bytes(cls, path):
+        """
+        Returns the size in bytes of a cached file or directory.
+        """
+        try:
+            if os.path.isdir(path):
+                return sum(
+                    os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+            return os.path.getsize(path)
+        except OSError:
+            return 0
+
+    @classmethod
+    def _prune_after_set(cls, path):
+        """
+        Prunes the cache directory after caching an object, if limits are
+        configured. The newly cached object is never evicted.
+        """
+        if MAX_BYTES is None and MAX_AGE is None:
+            return
+        cls.prune(exclude=[path])
+
+    @classmethod
+    def stats(cls):
+        """
+        Returns statistics about the cache: the number of hits, misses and
+        evictions in the current process, and the number and total size of
+        cached objects in the cache directory, by prefix.
+
+        Returns
+        -------
+        DataFrame
+            DataFrame indexed by Prefix with columns Hits, Misses, MemoryHits
+            (the subset of hits served from the in-process memory tier),
+            Entries, Bytes, Evictions, EvictedBytes
+
+        Examples
+        --------
+        >>> Cache.stats()
+                  Hits  Misses  MemoryHits  Entries     Bytes  Evictions  EvictedBytes
+        Prefix
+        _history     3       1           2        1  30000762          0             0
+        _master      3       1           2        1      1093          0             0
+        """
+        entries = Counter()
+        total_bytes = Counter()
+        for entry in cls._list_entries():
+            entries[entry["prefix"]] += 1
+            total_bytes[entry["prefix"]] += entry["bytes"]
+
+        stats = pd.DataFrame({
+            "Hits": pd.Series(cls._hits, dtype=int),
+            "Misses": pd.Series(cls._misses, dtype=int),
+            "MemoryHits": pd.Series(cls._memory_hits, dtype=int),
+            "Entries": pd.Series(entries, dtype=int),
+            "Bytes": pd.Series(total_bytes, dtype=int),
+            "Evictions": pd.Series(cls._evictions, dtype=int),
+            "EvictedBytes": pd.Series(cls._evicted_bytes, dtype=int),
+        }).fillna(0).astype(int)
+        stats.index.name = "Prefix"
+        return stats
+
+    @classmethod
+    def _get_prices_format(cls, format=None):
+        """
+        Returns the validated prices cache format.
+        """
+        format = format or PRICES_CACHE_FORMAT
+        if format not in ("pickle", "feather", "mmap"):
+            raise MoonshotParameterError(
+                "invalid prices cache format: {0} (choices are pickle, feather, mmap)".format(format))
+        if format == "feather" and pyarrow is None:
+            raise MoonshotParameterError(
+                "the feather prices cache format requires pyarrow, please install it")
+        return format
+
+    @classmethod
+    def _get_prices_dirpath(cls, kwargs, prefix="_history", format="feather"):
+        """
+        Returns the directory in which a columnar price history is cached.
+        The fields are excluded from the key so that an entry can serve any
+        subset of the fields it contains. An entry can only serve a query for
+        all fields (fields=None) if it was cached from such a query.
+        """
+        key_obj = dict((k, v) for k, v in kwargs.items() if k != "fields")
+        return cls._get_filepath(key_obj, prefix=prefix, ext=format)
+
+    @classmethod
+    def get_prices(cls, kwargs, prefix="_history", unless_dbs_modified=None, format=None):
+        """
+        Returns a prices DataFrame from cache, or None if it is not available
+        or expired.
+
+        With the feather format, each Field is stored in its own file and only
+        the fields requested in kwargs are loaded.
+
+        With the mmap format, the prices are stored as a single raw NumPy
+        array which is memory-mapped read-only, so that processes loading the
+        same prices share a single copy through the OS page cache. The
+        returned DataFrame is read-only and must not be modified in place.
+
+        Parameters
+        ----------
+        kwargs : dict, required
+            the kwargs that were passed to get_prices (used as the cache key)
+
+        prefix : str, optional
+            the prefix that was used the cache key (default "_history")
+
+        unless_dbs_modified : dict, optional
+            don't return cached prices if any of these dbs were modified
+            after the prices were cached. Pass a dict of kwargs to pass
+            to list_databases
+
+        format : str, optional
+            "pickle", "feather", or "mmap". Defaults to MOONSHOT_PRICES_CACHE_FORMAT
+            environment variable, or "pickle"
+
+        Returns
+        -------
+        DataFrame or None
+            the cached prices
+        """
+        format = cls._get_prices_format(format)
+
+        prices = cls._load_prices(
+            cls._get_prices_path(kwargs, prefix=prefix, format=format),
+            fields=kwargs.get("fields"), prefix=prefix,
+            unless_dbs_modified=unless_dbs_modified)
+
+        if prices is None and HISTORY_REUSE in ("slice", "merge"):
+            prices = cls._load_prices_from_catalog(
+                kwargs, prefix=prefix, unless_dbs_modified=unless_dbs_modified)
+
+        cls._record_lookup(prefix, prices)
+        return prices
+
+    @classmethod
+    def _get_prices_path(cls, kwargs, prefix="_history", format="pickle"):
+        """
+        Returns the path of the cached prices file (pickle format) or
+        directory (columnar formats).
+        """
+        if format == "pickle":
+            return cls._get_filepath(kwargs, prefix=prefix)
+        return cls._get_prices_dirpath(kwargs, prefix=prefix, format=format)
+
+    @classmethod
+    def _load_prices(cls, path, fields=None, prefix="_history", unless_dbs_modified=None):
+        """
+        Returns the prices cached in the file or directory, or None if they
+        are not available or expired or don't include the requested fields.
+        """
+        if not os.path.isdir(path):
+            return cls._load(path, prefix=prefix, unless_dbs_modified=unless_dbs_modified)
+
+        dirpath = path
+        format = os.path.splitext(dirpath)[1][1:]
+        # the metadata file is written last, so its presence indicates a
+        # complete entry
+        metapath = os.path.join(dirpath, "_meta.pkl")
+        if not os.path.exists(metapath):
+            return None
+
+        if cls._is_expired(metapath, unless_dbs_modified=unless_dbs_modified):
+            return None
+
+        try:
+            with open(metapath, "rb") as f:
+                meta_inode = os.fstat(f.fileno()).st_ino
+                meta = pickle.load(f)
+        except (IOError, OSError, EOFError):
+            # replaced by another process
+            return None
+
+        if fields is None:
+            # prices cached for a subset of fields can't serve a query
+            # for all fields
+            if not meta.get("all_fields", False):
+                return None
+            fields = meta["fields"]
+        else:
+            if isinstance(fields, six.string_types):
+                fields = [fields]
+            if set(fields) - set(meta["fields"]):
+                return None
+            # preserve the originally cached field order
+            fields = [field for field in meta["fields"] if field in fields]
+
+        memory_key = (dirpath, tuple(fields))
+        prices = cls._get_from_memory(memory_key, metapath)
+        if prices is not None:
+            cls._touch(metapath)
+            cls._memory_hits[prefix] += 1
+            return prices
+
+        try:
+            prices = cls._load_columnar_prices(dirpath, meta, fields, format)
+            # make sure the entry wasn't replaced by another process while
+            # loading, which could mix old and new files
+            is_consistent = os.stat(metapath).st_ino == meta_inode
+        except (IOError, OSError, ValueError):
+            is_consistent = False
+
+        if not is_consistent:
+            return None
+
+        cls._set_in_memory(memory_key, metapath, prices)
+
+        cls._touch(metapath)
+        return prices
+
+    @classmethod
+    def _load_columnar_prices(cls, dirpath, meta, fields, format):
+        """
+        Loads the requested fields from a columnar (feather or mmap) prices
+        cache and returns a prices DataFrame.
+        """
+        index = meta["index"]
+        columns = meta["columns"]
+
+        if format == "mmap":
+            # The array is stored in pandas' internal (columns x rows) block
+            # layout, so that its transpose can be wrapped in a DataFrame
+            # without a copy
+            block = np.load(os.path.join(dirpath, "values.npy"), mmap_mode="r")
+            if fields == meta["fields"]:
+                values = block.T
+            else:
+                rows = np.concatenate([
+                    np.arange(len(index)) + meta["fields"].index(field) * len(index)
+                    for field in fields])
+                values = np.ascontiguousarray(block[:, rows]).T
+
+        else:
+            # Copy each column of each field into its slice of a single
+            # preallocated block rather than concatenating per-field
+            # DataFrames, which would temporarily double the memory footprint.
+            # Fortran order matches pandas' internal (transposed) block layout.
+            values = np.empty(
+                (len(fields) * len(index), len(columns)), dtype=meta["dtype"], order="F")
+
+            for i, field in enumerate(fields):
+                filepath = os.path.join(
+                    dirpath, "{0}.feather".format(meta["fields"].index(field)))
+                table = pyarrow.feather.read_table(filepath, memory_map=True)
+                for j, column in enumerate(table.columns):
+                    values[i*len(index):(i+1)*len(index), j] = column.to_numpy()
+                del table
+
+        index = pd.MultiIndex(
+            levels=[pd.Index(fields)] + list(index.levels),
+            codes=[np.repeat(np.arange(len(fields)), len(index))]
+            + [np.tile(codes, len(fields)) for codes in index.codes],
+            names=["Field"] + list(index.names))
+
+        prices = pd.DataFrame(values, index=index, columns=columns, copy=False)
+        return prices
+
+    @classmethod
+    def set_prices(cls, kwargs, prices, prefix="_history", format=None, compression=None):
+        """
+        Caches a prices DataFrame.
+
+        Parameters
+        ----------
+        kwargs : dict, required
+            the kwargs that were passed to get_prices (used as the cache key)
+
+        prices : DataFrame, required
+            multiindex (Field, Date) or (Field, Date, Time) DataFrame of
+            price/market data
+
+        prefix : str, optional
+            a prefix to use for the cache key (default "_history")
+
+        format : str, optional
+            "pickle", "feather", or "mmap". Defaults to MOONSHOT_PRICES_CACHE_FORMAT
+            environment variable, or "pickle"
+
+        compression : str, optional
+            compression codec: "lz4", "zstd", "lzma", "gzip", or "none".
+            Defaults to the MOONSHOT_CACHE_COMPRESSION environment variable,
+            or no compression. The feather format supports lz4 and zstd
+            (other codecs are ignored), and the mmap format is never
+            compressed
+
+        Returns
+        -------
+        None
+        """
+        format = cls._get_prices_format(format)
+
+        path = cls._set_prices(
+            kwargs, prices, prefix=prefix, format=format, compression=compression)
+
+        if HISTORY_REUSE in ("slice", "merge"):
+            cls._add_to_catalog(
+                kwargs, path, prices, prefix=prefix, format=format, compression=compression)
+
+    @classmethod
+    def _set_prices(cls, kwargs, prices, prefix="_history", format="pickle", compression=None):
+        """
+        Caches a prices DataFrame and returns the path of the cached file or
+        directory.
+        """
+        if format == "pickle":
+            cls.set(kwargs, prices, prefix=prefix, compression=compression)
+            return cls._get_filepath(kwargs, prefix=prefix)
+
+        fields = list(prices.index.get_level_values("Field").unique())
+        dtypes = prices.dtypes.unique()
+        num_rows = len(prices.index) // len(fields)
+        index = prices.index[:num_rows].droplevel("Field")
+
+        # The columnar formats require a homogeneous numeric dtype and the
+        # same (Date[, Time]) index for every field, which is what get_prices
+        # returns; anything else is pickled
+        is_columnar = (
+            len(dtypes) == 1
+            and dtypes[0].kind in "fiub"
+            and len(prices.index) == len(fields) * num_rows)
+        for i, field in enumerate(fields):
+            if not is_columnar:
+                break
+            field_index = prices.index[i*num_rows:(i+1)*num_rows]
+            is_columnar = (
+                (field_index.get_level_values("Field") == field).all()
+                and field_index.droplevel("Field").equals(index))
+
+        if not is_columnar:
+            cls.set(kwargs, prices, prefix=prefix, compression=compression)
+            return cls._get_filepath(kwargs, prefix=prefix)
+
+        if not isinstance(index, pd.MultiIndex):
+            index = pd.MultiIndex.from_arrays([index])
+
+        dirpath = cls._get_prices_dirpath(kwargs, prefix=prefix, format=format)
+
+        # write to a temporary directory and rename it into place, so that
+        # concurrent readers never see a partially written entry
+        tmp_dirpath = cls._get_tmp_path(dirpath)
+        os.makedirs(tmp_dirpath)
+        try:
+            cls._write_columnar_prices(
+                tmp_dirpath, prices, fields, index, num_rows, dtypes[0], prefix,
+                format, compression, all_fields=kwargs.get("fields") is None)
+            cls._replace_dir(tmp_dirpath, dirpath)
+        except Exception:
+            shutil.rmtree(tmp_dirpath, ignore_errors=True)
+            raise
+
+        cls._prune_after_set(dirpath)
+        return dirpath
+
+    @classmethod
+    def _replace_dir(cls, src, dst):
+        """
+        Replaces the dst directory, if any, with the src directory. A
+        directory can't be atomically renamed over a non-empty directory, so
+        the old directory is first renamed aside. Readers in the meantime
+        see no entry (a cache miss) rather than a partial one.
+        """
+        old_dirpath = None
+        if os.path.exists(dst):
+            old_dirpath = cls._get_tmp_path(dst, suffix=".old")
+            try:
+                os.replace(dst, old_dirpath)
+            except OSError:
+                # already moved aside by another process
+                pass
+
+        try:
+            os.rename(src, dst)
+        except OSError:
+            # another process won the race to write the same entry
+            shutil.rmtree(src, ignore_errors=True)
+
+        if old_dirpath:
+            shutil.rmtree(old_dirpath, ignore_errors=True)
+
+    @classmethod
+    def _write_columnar_prices(cls, dirpath, prices, fields, index, num_rows,
+                               dtype, prefix, format, compression, all_fields=True):
+        """
+        Writes a prices DataFrame to a directory in a columnar (feather or
+        mmap) format. all_fields indicates whether the prices were queried
+        for all fields.
+        """
+        metapath = os.path.join(dirpath, "_meta.pkl")
+
+        if format == "mmap":
+            np.save(
+                os.path.join(dirpath, "values.npy"),
+                np.ascontiguousarray(prices.values.T))
+        else:
+            # Feather supports lz4 and zstd natively
+            compression = cls._get_compression(prefix, compression=compression)
+            if compression not in ("lz4", "zstd"):
+                compression = "uncompressed"
+
+            for i, field in enumerate(fields):
+                # Feather requires string column names and no index; the
+                # original index and columns are restored from the metadata file
+                frame = pd.DataFrame(
+                    prices.values[i*num_rows:(i+1)*num_rows],
+                    columns=prices.columns.astype(str))
+                pyarrow.feather.write_feather(
+                    frame,
+                    os.path.join(dirpath, "{0}.feather".format(i)),
+                    compression=compression)
+
+        with open(metapath, "wb") as f:
+            pickle.dump({
+                "fields": fields,
+                "all_fields": all_fields,
+                "index": index,
+                "columns": prices.columns,
+                "dtype": dtype}, f)
+
+    @classmethod
+    def _get_catalog_filepath(cls, kwargs, prefix="_history"):
+        """
+        Returns the path of the catalog of cached date ranges for the
+        get_prices kwargs, which is keyed on all kwargs except the date range
+        and fields.
+        """
+        key_obj = dict(
+            (k, v) for k, v in kwargs.items()
+            if k not in ("start_date", "end_date", "fields"))
+        filepath = cls._get_filepath(key_obj, prefix=prefix, ext="catalog.json")
+        return os.path.join(
+            os.path.dirname(filepath), ".{0}".format(os.path.basename(filepath)))
+
+    @classmethod
+    def _read_catalog(cls, catalog_filepath):
+        """
+        Returns the catalog entries whose cached prices still exist.
+        """
+        try:
+            with open(catalog_filepath) as f:
+                entries = json.load(f)
+        except (IOError, OSError, ValueError):
+            return []
+
+        return [
+            entry for entry in entries
+            if os.path.exists(os.path.join(TMP_DIR, entry["path"]))]
+
+    @classmethod
+    def _write_catalog(cls, catalog_filepath, entries):
+        """
+        Atomically writes the catalog entries.
+        """
+        tmp_filepath = cls._get_tmp_path(catalog_filepath)
+        with open(tmp_filepath, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_filepath, catalog_filepath)
+
+    @classmethod
+    def _get_catalog_entry(cls, kwargs, path):
+        """
+        Returns a catalog entry for prices cached at path.
+        """
+        start_date, end_date = cls._get_date_range(kwargs)
+
+        return {
+            "path": os.path.basename(path),
+            "fields": cls._get_fields_list(kwargs),
+            "start_date": start_date.isoformat() if start_date is not None else None,
+            "end_date": end_date.isoformat() if end_date is not None else None}
+
+    @classmethod
+    def _get_fields_list(cls, kwargs):
+        """
+        Returns the fields in the kwargs as a list, or None for all fields.
+        """
+        fields = kwargs.get("fields")
+        if isinstance(fields, six.string_types):
+            fields = [fields]
+        return list(fields) if fields is not None else None
+
+    @classmethod
+    def _get_date_range(cls, kwargs):
+        """
+        Returns the start and end date in the kwargs or catalog entry, as
+        Timestamps or None.
+        """
+        start_date = kwargs.get("start_date")
+        end_date = kwargs.get("end_date")
+        return (
+            pd.Timestamp(start_date) if start_date is not None else None,
+            pd.Timestamp(end_date) if end_date is not None else None)
+
+    @classmethod
+    def _contains_date_range(cls, entry, start_date, end_date):
+        """
+        Returns True if the cached prices in the catalog entry contain the
+        date range.
+        """
+        entry_start_date, entry_end_date = cls._get_date_range(entry)
+        try:
+            if entry_start_date is not None and (start_date is None or start_date < entry_start_date):
+                return False
+
+            if end_date is None:
+                return entry_end_date is None
+
+            if entry_end_date is None:
+                # Prices cached without an end date contain the data that was
+                # available when they were cached; that day may be incomplete
+                cached_date = pd.Timestamp.fromtimestamp(
+                    os.path.getmtime(os.path.join(TMP_DIR, entry["path"]))).normalize()
+                return end_date < cached_date
+
+            return end_date <= entry_end_date
+
+        except TypeError:
+            # can't compare tz-naive and tz-aware dates
+            return False
+
+    @classmethod
+    def _load_prices_from_catalog(cls, kwargs, prefix="_history", unless_dbs_modified=None):
+        """
+        Returns prices for the kwargs by slicing cached prices whose date
+        range contains the requested date range, or None if there are none.
+        """
+        start_date, end_date = cls._get_date_range(kwargs)
+        fields = cls._get_fields_list(kwargs)
+
+        candidates = []
+        for entry in cls._read_catalog(cls._get_catalog_filepath(kwargs, prefix=prefix)):
+            path = os.path.join(TMP_DIR, entry["path"])
+            # pickled prices contain exactly the fields that were queried;
+            # columnar prices can serve any subset of their fields, but only
+            # prices queried for all fields can serve a query for all fields
+            if entry["fields"] != fields and (fields is None or not os.path.isdir(path)):
+                continue
+            if cls._contains_date_range(entry, start_date, end_date):
+                candidates.append((entry, path))
+
+        # prefer the narrowest date range, which is the least to load
+        def get_span(candidate):
+            entry_start_date, entry_end_date = cls._get_date_range(candidate[0])
+            return (
+                (entry_end_date.value if entry_end_date is not None else np.iinfo(np.int64).max)
+                - (entry_start_date.value if entry_start_date is not None else np.iinfo(np.int64).min))
+
+        for entry, path in sorted(candidates, key=get_span):
+            prices = cls._load_prices(
+                path, fields=kwargs.get("fields"), prefix=prefix,
+                unless_dbs_modified=unless_dbs_modified)
+            if prices is not None:
+                return cls._slice_prices(prices, start_date, end_date)
+
+        return None
+
+    @classmethod
+    def _slice_prices(cls, prices, start_date=None, end_date=None):
+        """
+        Returns the prices between the start and end date (inclusive),
+        dropping sids with no prices in that period (which the db wouldn't
+        return).
+        """
+        dates = prices.index.get_level_values("Date")
+        tz = getattr(dates, "tz", None)
+        in_range = np.ones(len(dates), dtype=bool)
+
+        for date, is_start in ((start_date, True), (end_date, False)):
+            if date is None:
+                continue
+            if tz is not None and date.tzinfo is None:
+                date = date.tz_localize(tz)
+            in_range &= (dates >= date) if is_start else (dates <= date)
+
+        if in_range.all():
+            return prices
+
+        prices = prices[in_range]
+        prices = prices.loc[:, prices.notnull().any()]
+        prices.index = prices.index.remove_unused_levels()
+        return prices
+
+    @classmethod
+    def _add_to_catalog(cls, kwargs, path, prices, prefix="_history", format="pickle",
+                        compression=None):
+        """
+        Adds newly cached prices to the catalog of cached date ranges. If
+        HISTORY_REUSE is "merge", cached prices with an overlapping or
+        adjacent date range are merged with the new prices into a single
+        entry.
+        """
+        catalog_filepath = cls._get_catalog_filepath(kwargs, prefix=prefix)
+        entry = cls._get_catalog_entry(kwargs, path)
+
+        with cls.lock(catalog_filepath, prefix="_catalog"):
+
+            entries = [
+                other_entry for other_entry in cls._read_catalog(catalog_filepath)
+                if other_entry["path"] != entry["path"]]
+
+            if HISTORY_REUSE == "merge" and entry["end_date"] is not None:
+                neighbors = []
+                frames = []
+                for other_entry in entries:
+                    if not cls._is_mergeable(entry, other_entry):
+                        continue
+                    other_prices = cls._load_prices(
+                        os.path.join(TMP_DIR, other_entry["path"]),
+                        fields=other_entry["fields"], prefix=prefix)
+                    if other_prices is not None:
+                        neighbors.append(other_entry)
+                        frames.append(other_prices)
+
+                if neighbors:
+                    prices = cls._merge_prices(frames + [prices])
+
+                    start_dates, end_dates = zip(*[
+                        cls._get_date_range(other_entry) for other_entry in neighbors + [entry]])
+                    merged_kwargs = dict(
+                        kwargs,
+                        start_date=min(start_dates).date().isoformat() if None not in start_dates else None,
+                        end_date=max(end_dates).date().isoformat())
+                    merged_path = cls._set_prices(
+                        merged_kwargs, prices, prefix=prefix, format=format,
+                        compression=compression)
+
+                    for other_entry in neighbors + [entry]:
+                        other_path = os.path.join(TMP_DIR, other_entry["path"])
+                        if other_path != merged_path:
+                            cls._remove_entry(other_path)
+
+                    entries = [
+                        other_entry for other_entry in entries
+                        if other_entry not in neighbors
+                        and other_entry["path"] != os.path.basename(merged_path)]
+                    entry = cls._get_catalog_entry(merged_kwargs, merged_path)
+
+            entries.append(entry)
+            cls._write_catalog(catalog_filepath, entries)
+
+    @classmethod
+    def _is_mergeable(cls, entry, other_entry):
+        """
+        Returns True if the catalog entries have the same fields and an
+        explicit end date and their date ranges overlap or are adjacent.
+        """
+        if other_entry["end_date"] is None or other_entry["fields"] != entry["fields"]:
+            return False
+
+        start_date, end_date = cls._get_date_range(entry)
+        other_start_date, other_end_date = cls._get_date_range(other_entry)
+        one_day = pd.Timedelta(days=1)
+        try:
+            return (
+                (start_date is None or start_date <= other_end_date + one_day)
+                and (other_start_date is None or other_start_date <= end_date + one_day))
+        except TypeError:
+            # can't compare tz-naive and tz-aware dates
+            return False
+
+    @classmethod
+    def _merge_prices(cls, frames):
+        """
+        Merges prices DataFrames covering different date ranges. Where dates
+        overlap, later DataFrames take precedence.
+        """
+        fields = pd.Index([])
+        for prices in frames:
+            fields = fields.union(prices.index.get_level_values("Field").unique(), sort=False)
+
+        # merge field by field to preserve the (Field, Date[, Time]) sort order
+        merged_prices = []
+        for field in fields:
+            field_prices = pd.concat([
+                prices.loc[[field]] for prices in frames
+                if field in prices.index.get_level_values("Field")])
+            field_prices = field_prices[~field_prices.index.duplicated(keep="last")]
+            merged_prices.append(field_prices.sort_index())
+
+        return pd.concat(merged_prices)
@@ -14,11 +14,37 @@
 
 import pandas as pd
 import numpy as np
+from moonshot.exceptions import MoonshotParameterError
 
 class WeightAllocationMixin(object):
     """
     Mixin class with utilities for turning signals into weights.
+
+    The row-wise work of `allocate_fixed_weights_capped` and
+    `neutralize_weights` is done by NumPy kernels on the underlying arrays.
+    Set WEIGHT_KERNELS = "numba" to use numba-compiled loops instead, which
+    avoid the temporary arrays. The numba kernels are not bit-identical to
+    the NumPy kernels: they sum each row in a different order, so weights
+    may differ in the last decimal place, and a row whose sum of fixed
+    weights is within rounding error of the cap may be capped by one kernel
+    and not the other.
     """
+    WEIGHT_KERNELS = "numpy"
+
+    def _get_weight_kernel(self, name):
+        """
+        Returns the kernel function for name ("select_over_cap" or
+        "neutralize") according to WEIGHT_KERNELS.
+        """
+        if self.WEIGHT_KERNELS == "numba":
+            if not _NUMBA_KERNELS:
+                _compile_numba_kernels()
+            return _NUMBA_KERNELS[name]
+        if self.WEIGHT_KERNELS != "numpy":
+            raise MoonshotParameterError(
+                "WEIGHT_KERNELS must be 'numpy' or 'numba', not {0}".format(self.WEIGHT_KERNELS))
+        return _NUMPY_KERNELS[name]
+
     def allocate_equal_weights(self, signals, cap=1.0):
         """
         For multi-security strategies. Given a dataframe of whole number
@@ -44,12 +70,12 @@ class WeightAllocationMixin(object):
         """
         equal_weighted = self.allocate_equal_weights(signals, cap=cap)
         fixed_weighted = self.allocate_fixed_weights(signals, weight)
-        fixed_sum = fixed_weighted.abs().sum(axis=1)
-        fixed_sum = pd.DataFrame(dict(
-            [(column, fixed_sum.copy()) for column in signals.columns]),
-            columns=signals.columns, index=signals.index)
+        select_over_cap = self._get_weight_kernel("select_over_cap")
         return pd.DataFrame(
-            np.where(fixed_sum > cap, equal_weighted, fixed_weighted),
+            select_over_cap(
+                np.asarray(fixed_weighted.values, dtype=np.float64),
+                np.asarray(equal_weighted.values, dtype=np.float64),
+                cap),
             index=signals.index, columns=signals.columns)
 
     def allocate_market_neutral_fixed_weights_capped(self, signals, weight, cap=1.0,
@@ -73,23 +99,107 @@ class WeightAllocationMixin(object):
         If the long or short side has a greater total weight than the
         opposite side, proportionately reduces the overweight side.
         """
-        long_weights = weights.where(weights > 0, 0)
-        short_weights = weights.where(weights < 0, 0)
+        neutralize = self._get_weight_kernel("neutralize")
+        return pd.DataFrame(
+            neutralize(np.asarray(weights.values, dtype=np.float64)),
+            index=weights.index, columns=weights.columns)
 
-        total_long_weights = long_weights.sum(axis=1)
-        total_long_weights = pd.DataFrame(dict((column, total_long_weights.copy()) for column in weights.columns),
-                                          index=weights.index, columns=weights.columns)
-        total_short_weights = short_weights.abs().sum(axis=1)
-        total_short_weights = pd.DataFrame(dict((column, total_short_weights.copy()) for column in weights.columns),
-                                           index=weights.index, columns=weights.columns)
+def _select_over_cap(fixed_weights, equal_weights, cap):
+    """
+    Returns the equal weights in rows where the absolute sum of the fixed
+    weights exceeds the cap, and the fixed weights elsewhere.
+    """
+    fixed_sums = np.where(np.isnan(fixed_weights), 0, np.abs(fixed_weights)).sum(axis=1)
+    return np.where((fixed_sums > cap)[:, np.newaxis], equal_weights, fixed_weights)
+
+def _neutralize(weights):
+    """
+    Proportionately reduces the long or short weights in each row so that
+    neither side has a greater total weight than the other. NaNs become 0.
+    """
+    long_weights = np.where(weights > 0, weights, 0)
+    short_weights = np.where(weights < 0, weights, 0)
 
-        long_weights = long_weights.where(
-            total_long_weights <= total_short_weights,
-            long_weights * total_short_weights / total_long_weights.replace(0, 1))
+    total_long_weights = long_weights.sum(axis=1)[:, np.newaxis]
+    total_short_weights = np.abs(short_weights).sum(axis=1)[:, np.newaxis]
 
-        short_weights = short_weights.where(
-            total_short_weights <= total_long_weights,
-            short_weights * total_long_weights / total_short_weights.replace(0, 1))
+    long_weights = np.where(
+        total_long_weights <= total_short_weights,
+        long_weights,
+        long_weights * total_short_weights / np.where(total_long_weights == 0, 1, total_long_weights))
 
-        weights = long_weights.where(long_weights > 0, short_weights)
-        return weights
+    short_weights = np.where(
+        total_short_weights <= total_long_weights,
+        short_weights,
+        short_weights * total_long_weights / np.where(total_short_weights == 0, 1, total_short_weights))
+
+    return np.where(long_weights > 0, long_weights, short_weights)
+
+def _select_over_cap_loop(fixed_weights, equal_weights, cap):
+    """
+    Loop version of `_select_over_cap`, for compiling with numba.
+    """
+    n_rows, n_cols = fixed_weights.shape
+    selected = np.empty((n_rows, n_cols))
+    for i in range(n_rows):
+        fixed_sum = 0.0
+        for j in range(n_cols):
+            if not np.isnan(fixed_weights[i, j]):
+                fixed_sum += abs(fixed_weights[i, j])
+        if fixed_sum > cap:
+            selected[i] = equal_weights[i]
+        else:
+            selected[i] = fixed_weights[i]
+    return selected
+
+def _neutralize_loop(weights):
+    """
+    Loop version of `_neutralize`, for compiling with numba.
+    """
+    n_rows, n_cols = weights.shape
+    neutralized = np.empty((n_rows, n_cols))
+    for i in range(n_rows):
+        total_long_weight = 0.0
+        total_short_weight = 0.0
+        for j in range(n_cols):
+            if weights[i, j] > 0:
+                total_long_weight += weights[i, j]
+            elif weights[i, j] < 0:
+                total_short_weight -= weights[i, j]
+        for j in range(n_cols):
+            weight = weights[i, j]
+            if weight > 0:
+                if total_long_weight > total_short_weight:
+                    weight = weight * total_short_weight / total_long_weight
+                neutralized[i, j] = weight
+            elif weight < 0:
+                if total_short_weight > total_long_weight:
+                    weight = weight * total_long_weight / total_short_weight
+                neutralized[i, j] = weight
+            else:
+                neutralized[i, j] = 0.0
+    return neutralized
+
+_NUMPY_KERNELS = {
+    "select_over_cap": _select_over_cap,
+    "neutralize": _neutralize,
+}
+
+# compiled the first time WEIGHT_KERNELS = "numba" is used, so that numba is
+# neither imported by nor required for `import moonshot`
+_NUMBA_KERNELS = {}
+
+def _compile_numba_kernels():
+    """
+    Compiles the loop kernels with numba into _NUMBA_KERNELS.
+    """
+    try:
+        import numba
+    except ImportError:
+        raise MoonshotParameterError(
+            "WEIGHT_KERNELS = 'numba' requires numba, please install it")
+
+    _NUMBA_KERNELS.update({
+        "select_over_cap": numba.njit(cache=True)(_select_over_cap_loop),
+        "neutralize": numba.njit(cache=True)(_neutralize_loop),
+    })
@@ -0,0 +1,263 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pandas as pd
+
+class BacktestResults(object):
+    """
+    Backtest results stored as a 3-D array of fields x dates x sids, with
+    one shared index (Date or (Date, Time)) and one shared set of columns
+    (sids).
+
+    Returned by `Moonshot.backtest(lean=True)`. Compared to the default
+    (Field, Date) DataFrame of results, which concatenates a DataFrame per
+    field, the array avoids copying all the fields into a new DataFrame and
+    building its MultiIndex.
+
+    Fields with a different shape or a non-numeric dtype (for example a
+    Benchmark or a custom DataFrame saved with `save_to_results`) are kept as
+    separate DataFrames.
+
+    Use `results.loc[field]` to get a DataFrame of one field, which is a view
+    of the array (so modifying it modifies the results), and `to_frame()` to
+    get the same (Field, Date) DataFrame that `backtest()` returns by default.
+
+    Examples
+    --------
+    >>> results = MyStrategy().backtest(lean=True)
+    >>> returns = results.loc["Return"]
+    >>> results.fields
+    ['AbsExposure', 'AbsWeight', 'Commission', ...]
+    >>> results = results.to_frame()
+    """
+
+    def __init__(self, values, fields, index, columns, other_fields=None):
+        self.values = values
+        self._array_fields = list(fields)
+        self.index = index
+        self.columns = columns
+        self._other_fields = other_fields or {}
+        self.loc = _FieldIndexer(self)
+
+    @classmethod
+    def from_frames(cls, frames, index, columns):
+        """
+        Creates BacktestResults from a dict of field:DataFrame. Fields with
+        the given index and columns and a numeric dtype are copied into the
+        array. The DataFrames are removed from the dict as they are copied,
+        so that (if not referenced elsewhere) each is freed as soon as it has
+        been copied.
+
+        Parameters
+        ----------
+        frames : dict, required
+            dict of field:DataFrame
+
+        index : Index, required
+            the index (Date or (Date, Time)) shared by the fields
+
+        columns : Index, required
+            the columns (sids) shared by the fields
+
+        Returns
+        -------
+        BacktestResults
+        """
+        array_fields = []
+        other_fields = {}
+        for field in sorted(frames.keys()):
+            frame = frames[field]
+            if (
+                frame.index.equals(index)
+                and frame.columns.equals(columns)
+                and all(dtype.kind in ("i", "u", "f") for dtype in frame.dtypes)):
+                array_fields.append(field)
+            else:
+                other_fields[field] = frames.pop(field)
+
+        dtype = np.result_type(*[
+            dtype for field in array_fields for dtype in frames[field].dtypes]) if array_fields else np.float64
+
+        values = np.empty((len(array_fields), len(index), len(columns)), dtype=dtype)
+        for i, field in enumerate(array_fields):
+            values[i] = frames.pop(field).values
+
+        return cls(values, array_fields, index, columns, other_fields=other_fields)
+
+    @classmethod
+    def concat(cls, results_list):
+        """
+        Concatenates BacktestResults of consecutive date ranges (for example
+        the slices of a chunked backtest). The columns are the union of the
+        columns of all the results; sids missing from a date range are NaN.
+
+        Parameters
+        ----------
+        results_list : list of BacktestResults, required
+            the results, in date order
+
+        Returns
+        -------
+        BacktestResults
+        """
+        columns = results_list[0].columns
+        for results in results_list[1:]:
+            if not results.columns.equals(columns):
+                columns = columns.union(results.columns)
+
+        index = results_list[0].index.append([results.index for results in results_list[1:]])
+
+        # fields stored in the array of every results stay in the array
+        array_fields = [
+            field for field in results_list[0]._array_fields
+            if all(field in results._array_fields for results in results_list[1:])]
+        other_fields = sorted(
+            set(field for results in results_list for field in results.fields)
+            - set(array_fields))
+
+        dtype = np.result_type(*[results.values.dtype for results in results_list])
+        if any(not results.columns.equals(columns) for results in results_list):
+            # missing sids are filled with NaN
+            dtype = np.result_type(dtype, np.float64)
+
+        values = np.empty((len(array_fields), len(index), len(columns)), dtype=dtype)
+        start = 0
+        for results in results_list:
+            end = start + len(results.index)
+            column_positions = columns.get_indexer(results.columns)
+            if len(column_positions) != len(columns):
+                values[:, start:end] = np.nan
+            for i, field in enumerate(array_fields):
+                values[i, start:end][:, column_positions] = results.values[
+                    results._array_fields.index(field)]
+            start = end
+
+        other_fields = {
+            field: pd.concat([
+                results.get_field(field) for results in results_list if field in results])
+            for field in other_fields}
+
+        return cls(values, array_fields, index, columns, other_fields=other_fields)
+
+    @property
+    def fields(self):
+        """
+        The sorted field names.
+        """
+        return sorted(self._array_fields + list(self._other_fields.keys()))
+
+    def get_field(self, field):
+        """
+        Returns a DataFrame of one field. For fields stored in the array, the
+        DataFrame is a view of the array.
+        """
+        if field in self._other_fields:
+            return self._other_fields[field]
+        try:
+            i = self._array_fields.index(field)
+        except ValueError:
+            raise KeyError(field)
+        return pd.DataFrame(self.values[i], index=self.index, columns=self.columns, copy=False)
+
+    def __contains__(self, field):
+        return field in self._array_fields or field in self._other_fields
+
+    def __repr__(self):
+        return "<BacktestResults: {0} fields x {1} rows x {2} columns ({3})>".format(
+            len(self.fields), len(self.index), len(self.columns), ", ".join(self.fields))
+
+    @property
+    def nbytes(self):
+        """
+        The size of the results in bytes, excluding the index and columns.
+        """
+        return self.values.nbytes + sum(
+            frame.memory_usage(index=False).sum() for frame in self._other_fields.values())
+
+    def rename_columns(self, mapping):
+        """
+        Renames the columns in place, using a dict of old:new.
+        """
+        self.columns = self.columns.map(lambda column: mapping.get(column, column))
+        for field, frame in self._other_fields.items():
+            self._other_fields[field] = frame.rename(columns=mapping)
+
+    def truncate_before(self, date):
+        """
+        Returns results for dates on or after date. The array of the returned
+        results is a view of this array.
+        """
+        date = pd.Timestamp(date)
+        keep = self.index.get_level_values("Date") >= date
+        if keep.all():
+            return self
+        if keep.any():
+            # the index is sorted, so the kept rows are a slice
+            start = keep.argmax()
+        else:
+            start = len(keep)
+        other_fields = {
+            field: frame.iloc[frame.index.get_level_values("Date") >= date]
+            for field, frame in self._other_fields.items()}
+        return BacktestResults(
+            self.values[:, start:], self._array_fields, self.index[start:],
+            self.columns, other_fields=other_fields)
+
+    def to_frame(self):
+        """
+        Returns a multiindex (Field, Date) or (Field, Date, Time) DataFrame
+        of the results, as returned by `Moonshot.backtest()` by default.
+        """
+        if self._other_fields:
+            frames = dict(self._other_fields)
+            for field in self._array_fields:
+                frames[field] = self.get_field(field)
+            results = pd.concat(frames, keys=list(sorted(frames.keys())))
+            results.index.set_names(["Field"] + list(self.index.names), inplace=True)
+            return results
+
+        # build the (Field, Date[, Time]) index from the codes of the shared
+        # index, and reshape the array without copying it
+        n_fields, n_rows, n_columns = self.values.shape
+        field_codes = np.repeat(np.arange(n_fields), n_rows)
+        if isinstance(self.index, pd.MultiIndex):
+            levels = list(self.index.levels)
+            codes = [np.tile(level_codes, n_fields) for level_codes in self.index.codes]
+        else:
+            levels = [self.index.unique()]
+            codes = [np.tile(levels[0].get_indexer(self.index), n_fields)]
+        index = pd.MultiIndex(
+            levels=[pd.Index(self._array_fields)] + levels,
+            codes=[field_codes] + codes,
+            names=["Field"] + list(self.index.names),
+            verify_integrity=False)
+
+        return pd.DataFrame(
+            self.values.reshape(n_fields * n_rows, n_columns),
+            index=index, columns=self.columns, copy=False)
+
+class _FieldIndexer(object):
+    """
+    Implements BacktestResults.loc.
+    """
+    def __init__(self, results):
+        self._results = results
+
+    def __getitem__(self, key):
+        if isinstance(key, (list, tuple, pd.Index)):
+            return pd.concat(
+                {field: self._results.get_field(field) for field in key},
+                keys=list(key), names=["Field"])
+        return self._results.get_field(key)
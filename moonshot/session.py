@@ -0,0 +1,197 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+
+class TradingSession(object):
+    """
+    A long-running trading session, which keeps a strategy, its model (for
+    MoonshotML), securities master and prices in memory between trades and
+    queries only the new prices for each trade.
+
+    When the session starts, the prices of the strategy's lookback window
+    are queried as in `trade`. Each refresh then queries the prices from the
+    last date held onward (for an intraday strategy, today's bars), appends
+    them, and drops the dates that have left the lookback window. The
+    securities master is queried again only if new sids appear.
+
+    Parameters
+    ----------
+    strategy : class or instance, required
+        the Moonshot subclass or instance to trade
+
+    allocations : dict, required
+        dict of account:allocation to strategy (expressed as a percentage of NLV)
+
+    refresh_interval : float, optional
+        refresh the prices every this many seconds in a background thread,
+        while the session is started, so that trades use the prices as of the
+        last refresh. By default the prices are refreshed at each trade. If a
+        background refresh fails, trades raise its error until a later
+        refresh succeeds.
+
+    Examples
+    --------
+    Refresh the prices at each trade:
+
+    >>> session = TradingSession(IntradayStrategy, {"U12345": 0.5})
+    >>> orders = session.trade()
+
+    Refresh the prices every minute in the background:
+
+    >>> with TradingSession(IntradayStrategy, {"U12345": 0.5}, refresh_interval=60) as session:
+    >>>     orders = session.trade()
+    """
+
+    def __init__(self, strategy, allocations, refresh_interval=None):
+        if isinstance(strategy, type):
+            strategy = strategy()
+        self.strategy = strategy
+        self.allocations = pd.Series(allocations)
+        self.refresh_interval = refresh_interval
+        self.prices = None
+        self._prices_kwargs = None
+        # serializes refreshes and trades, which share the strategy's state
+        self._lock = threading.RLock()
+        self._stopped = threading.Event()
+        self._refresher = None
+        self._refresh_error = None
+
+        strategy.is_trade = True
+        strategy.review_date = None
+        strategy._prepare_to_trade()
+
+        start_date = pd.Timestamp.today()
+        self._prices_kwargs = strategy._get_prices_kwargs(start_date)
+        self.prices = strategy.get_prices(start_date)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """
+        Starts refreshing the prices in the background, if refresh_interval
+        is set.
+
+        Returns
+        -------
+        TradingSession
+            the session
+        """
+        if self.refresh_interval and self._refresher is None:
+            self._stopped.clear()
+            self._refresher = threading.Thread(target=self._refresh_periodically)
+            self._refresher.daemon = True
+            self._refresher.start()
+        return self
+
+    def stop(self):
+        """
+        Stops refreshing the prices in the background.
+        """
+        if self._refresher is not None:
+            self._stopped.set()
+            self._refresher.join()
+            self._refresher = None
+
+    def _refresh_periodically(self):
+        """
+        Refreshes the prices every refresh_interval seconds until stopped.
+        """
+        while not self._stopped.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                # raised by trades until a later refresh succeeds
+                self._refresh_error = e
+
+    def refresh(self):
+        """
+        Queries the new prices and appends them to the prices held, dropping
+        the dates before the lookback window.
+        """
+        strategy = self.strategy
+        with self._lock:
+            with strategy._profile_stage("refresh"):
+                prices = strategy._append_new_prices(self.prices, self._prices_kwargs)
+
+                start_date = pd.Timestamp(
+                    strategy._get_prices_kwargs(pd.Timestamp.today())["start_date"])
+                dates = prices.index.get_level_values("Date")
+                if dates.min() < start_date:
+                    prices = prices[dates >= start_date]
+
+                if not prices.columns.isin(strategy._securities_master.index).all():
+                    strategy._load_master_file(prices.columns.tolist())
+
+                self.prices = prices
+                self._refresh_error = None
+
+    def trade(self, review_date=None, profile=False):
+        """
+        Run the strategy on the prices held and create orders. The account
+        balances, exchange rates, positions and open orders are queried for
+        each trade.
+
+        Parameters
+        ----------
+        review_date : str (YYYY-MM-DD [HH:MM:SS]), optional
+            generate orders as if it were this date, rather than using the latest
+            date. The date must be within the prices held
+
+        profile : bool or str
+            record the stages of the trade in a DataFrame at `strategy.profile`,
+            as in `Moonshot.trade`. Default False
+
+        Returns
+        -------
+        DataFrame
+            orders
+        """
+        if self._refresh_error is not None:
+            raise self._refresh_error
+
+        strategy = self.strategy
+        with self._lock:
+            strategy.review_date = review_date
+            try:
+                with strategy._profiling(profile):
+                    with strategy._profile_stage("trade"):
+                        return self._trade()
+            finally:
+                strategy.review_date = None
+
+    def _trade(self):
+        """
+        Refreshes the prices unless they are refreshed in the background,
+        and creates orders. Called by `trade`.
+        """
+        strategy = self.strategy
+        with ThreadPoolExecutor(max_workers=4) as executor:
+
+            balances = executor.submit(
+                strategy._download_account_balances, list(self.allocations.index))
+
+            if self._refresher is None:
+                self.refresh()
+
+            # pass a copy, so that a strategy which modifies its prices in
+            # place doesn't corrupt the prices held for later trades
+            return strategy._trade_prices(
+                self.prices.copy(), self.allocations, executor, balances)
@@ -13,17 +13,27 @@
 # limitations under the License.
 
 import io
+import os
 import pandas as pd
 import numpy as np
 import time
 import requests
 import json
 import math
+import itertools
+import functools
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from moonshot.slippage import FixedSlippage
 from moonshot.mixins import WeightAllocationMixin
+from moonshot import cache
 from moonshot.cache import Cache
 from moonshot.exceptions import MoonshotError, MoonshotParameterError
+from moonshot._profiler import Profiler
+from moonshot.results import BacktestResults
 from quantrocket.price import get_prices
+from quantrocket.exceptions import NoData
 from quantrocket.master import list_calendar_statuses, download_master_file
 from quantrocket.account import download_account_balances, download_exchange_rates
 from quantrocket.blotter import list_positions, download_order_statuses
@@ -142,6 +152,15 @@ class Moonshot(
         this percentage. For example 0.5 means don't rebalance a position unless
         the position will change by +/-50%.
 
+    TRADE_TAIL_ONLY : bool
+        in live trading, load and compute only the tail of the data needed for
+        the current signal. If True, prices are queried from LOOKBACK_WINDOW
+        trading days before the trade date (rather than LOOKBACK_WINDOW plus a
+        buffer of calendar days) through the trade date, and are trimmed to
+        the signal date and the LOOKBACK_WINDOW dates before it before the
+        strategy runs. Only use if the strategy's calculations need no more
+        than LOOKBACK_WINDOW dates of history. Default False
+
     CONTRACT_VALUE_REFERENCE_FIELD : str, optional
         the price field to use for determining contract values for the purpose of
         applying commissions and constraining weights in backtests and calculating
@@ -189,6 +208,7 @@ class Moonshot(
     CALENDAR = None
     POSITIONS_CLOSED_DAILY = False
     ALLOW_REBALANCE = True
+    TRADE_TAIL_ONLY = False
     CONTRACT_VALUE_REFERENCE_FIELD = None
 
     def __init__(self):
@@ -200,6 +220,10 @@ class Moonshot(
         self._inferred_timezone = None
         self._signal_date = None # set by _weights_to_today_weights
         self._signal_time = None # set by _weights_to_today_weights
+        self._trade_datetime = None # set by _prices_to_orders if TRADE_TAIL_ONLY
+        self._profiler = None # set by _profiling
+        self._cost_inputs = None # set by _caching_cost_inputs
+        self.profile = None # DataFrame of stages, set by backtest(profile=True)
 
     def prices_to_signals(self, prices):
         """
@@ -574,29 +598,9 @@ class Moonshot(
         latest time that is earlier than the time at which the strategy is
         running.
         """
-
-        # First, get the signal date
-
-        # Use review_date if set
-        if self.review_date:
-            dt = pd.Timestamp(self.review_date)
-
-        # Else use trading calendar if provided
-        elif self.CALENDAR:
-            status = list_calendar_statuses([self.CALENDAR])[self.CALENDAR]
-            # If the exchange if closed, the signals should correspond to the
-            # date the exchange was last open
-            if status["status"] == "closed":
-                dt = pd.Timestamp(status["since"])
-            # If the exchange is open, the signals should correspond to
-            # today's date
-            else:
-                dt = pd.Timestamp.now(tz=status["timezone"])
-
-        # If no trading calendar, use today's date (in strategy timezone)
-        else:
-            tz = self.TIMEZONE or self._inferred_timezone
-            dt = pd.Timestamp.now(tz=tz)
+        dt = self._trade_datetime
+        if dt is None:
+            dt = self._get_trade_datetime()
 
         # Keep only the date as the signal_date
         self._signal_date = pd.Timestamp(dt.date())
@@ -676,14 +680,59 @@ class Moonshot(
 
         return today_weights
 
-    def _get_commissions(self, positions, prices):
+    def _get_trade_datetime(self):
+        """
+        Returns the date and time as of which to trade: the review_date if
+        set, else the date the CALENDAR was last open if it is closed, else
+        now (in the strategy timezone).
+        """
+        # Use review_date if set
+        if self.review_date:
+            dt = pd.Timestamp(self.review_date)
+
+        # Else use trading calendar if provided
+        elif self.CALENDAR:
+            status = list_calendar_statuses([self.CALENDAR])[self.CALENDAR]
+            # If the exchange if closed, the signals should correspond to the
+            # date the exchange was last open
+            if status["status"] == "closed":
+                dt = pd.Timestamp(status["since"])
+            # If the exchange is open, the signals should correspond to
+            # today's date
+            else:
+                dt = pd.Timestamp.now(tz=status["timezone"])
+
+        # If no trading calendar, use today's date (in strategy timezone)
+        else:
+            tz = self.TIMEZONE or self._inferred_timezone
+            dt = pd.Timestamp.now(tz=tz)
+
+        return dt
+
+    def _trim_prices_to_tail(self, prices):
+        """
+        Returns the prices of the signal date and the LOOKBACK_WINDOW dates
+        before it, dropping earlier and later dates. Used if TRADE_TAIL_ONLY.
+        """
+        signal_date = pd.Timestamp(self._trade_datetime.date())
+        dates = prices.index.get_level_values("Date")
+        tail_dates = dates[dates <= signal_date].unique().sort_values()
+        tail_dates = tail_dates[-(self._get_lookback_window() + 1):]
+        if tail_dates.empty:
+            # let _weights_to_today_weights report the missing signal date
+            return prices
+        return prices[(dates >= tail_dates[0]) & (dates <= signal_date)]
+
+    def _get_commissions(self, positions, prices, turnover=None):
         """
-        Returns the commissions to be subtracted from the returns.
+        Returns the commissions to be subtracted from the returns. The
+        turnover is computed from the positions if not passed.
         """
         if not self.COMMISSION_CLASS:
             return pd.DataFrame(0, index=positions.index, columns=positions.columns)
 
-        turnover = self._positions_to_turnover(positions)
+        if turnover is None:
+            turnover = self._positions_to_turnover(positions)
         contract_values = self._get_contract_values(prices)
 
         prices_is_intraday = "Time" in prices.index.names
@@ -693,9 +742,8 @@ class Moonshot(
             contract_values = contract_values.groupby(
                 contract_values.index.get_level_values("Date")).first()
 
-        fields = prices.index.get_level_values("Field").unique()
         if "Nlv" in self._securities_master.columns:
-            nlvs = contract_values.apply(lambda x: self._securities_master.Nlv, axis=1)
+            nlvs = self._broadcast_master_field("Nlv", contract_values)
         else:
             nlvs = None
 
@@ -713,38 +761,48 @@ class Moonshot(
 
         defined_sec_groups = set([tuple(k) for k in commission_classes.keys()])
 
-        # Reindex master fields like contract_values
-        sec_types = contract_values.apply(lambda x: self._securities_master.SecType, axis=1)
-        exchanges = contract_values.apply(lambda x: self._securities_master.Exchange, axis=1)
-        currencies = contract_values.apply(lambda x: self._securities_master.Currency, axis=1)
+        # Align master fields to the columns of contract_values
+        master = self._securities_master.reindex(contract_values.columns)
+        sec_types = master.SecType.values
+        exchanges = master.Exchange.values
+        currencies = master.Currency.values
 
-        required_sec_groups = set([
-            tuple(s.split("|")) for s in (sec_types+"|"+exchanges+"|"+currencies).iloc[-1].unique()])
+        required_sec_groups = set(zip(sec_types, exchanges, currencies))
         missing_sec_groups = required_sec_groups - defined_sec_groups
         if missing_sec_groups:
             raise MoonshotParameterError("expected a commission class for each combination of (sectype,exchange,currency) "
                                          "but none is defined for {0}".format(
                                              ", ".join(["({0})".format(",".join(t)) for t in missing_sec_groups])))
 
-        all_commissions = pd.DataFrame(None, index=positions.index, columns=positions.columns)
+        # Evaluate each commission class on the columns of its sec group
+        # only, so the total work is one pass over the columns regardless of
+        # the number of groups, then put the columns back in order
+        sec_group_commissions = []
 
         for sec_group in required_sec_groups:
             commission_cls = commission_classes[sec_group]
             sec_type, exchange, currency = sec_group
 
-            sec_group_commissions = commission_cls.get_commissions(
-                contract_values, turnover=turnover, nlvs=nlvs)
-
             in_sec_group = (sec_types == sec_type) & (exchanges == exchange) & (currencies == currency)
-            all_commissions = sec_group_commissions.where(in_sec_group, all_commissions)
+            sec_group_sids = contract_values.columns[in_sec_group]
+
+            sec_group_commissions.append(commission_cls.get_commissions(
+                contract_values[sec_group_sids],
+                turnover=turnover.reindex(columns=sec_group_sids),
+                nlvs=nlvs[sec_group_sids] if nlvs is not None else None))
+
+        all_commissions = pd.concat(sec_group_commissions, axis=1)
+        all_commissions = all_commissions.reindex(columns=positions.columns)
 
         return all_commissions
 
-    def _get_slippage(self, positions, prices):
+    def _get_slippage(self, positions, prices, turnover=None):
         """
-        Returns the slippage to be subtracted from the returns.
+        Returns the slippage to be subtracted from the returns. The turnover
+        is computed from the positions if not passed.
         """
-        turnover = self._positions_to_turnover(positions)
+        if turnover is None:
+            turnover = self._positions_to_turnover(positions)
         slippage = pd.DataFrame(0, index=turnover.index, columns=turnover.columns)
 
         slippage_classes = self.SLIPPAGE_CLASSES or ()
@@ -773,7 +831,7 @@ class Moonshot(
 
         contract_values = self._get_contract_values(prices)
         contract_values = contract_values.fillna(method="ffill")
-        nlvs_in_trade_currency = contract_values.apply(lambda x: self._securities_master.Nlv, axis=1)
+        nlvs_in_trade_currency = self._broadcast_master_field("Nlv", contract_values)
 
         prices_is_intraday = "Time" in prices.index.names
         weights_is_intraday = "Time" in weights.index.names
@@ -916,34 +974,64 @@ class Moonshot(
 
         return lookback_window
 
+    def _download_master_file(self, sids, fields):
+        """
+        Queries the master service and returns a DataFrame of securities.
+        """
+        f = io.StringIO()
+        download_master_file(
+            f,
+            sids=sids,
+            fields=fields)
+
+        return pd.read_csv(f, index_col="Sid")
+
+    # Fields of the master file used by Moonshot
+    _MASTER_FIELDS = [
+        "Currency", "Multiplier", "PriceMagnifier",
+        "Exchange", "SecType", "Symbol", "Timezone"]
+
     def _load_master_file(self, sids, nlv=None, no_cache=False):
         """
         Loads master file from cache or master service.
         """
+        securities = self._get_master_file(sids, no_cache=no_cache)
+        self._set_securities_master(securities, nlv=nlv)
+
+    def _get_master_file(self, sids, no_cache=False):
+        """
+        Returns a DataFrame of securities from cache (in backtests) or the
+        master service.
+        """
         securities = None
 
-        fields = [
-            "Currency", "Multiplier", "PriceMagnifier",
-            "Exchange", "SecType", "Symbol", "Timezone"]
+        fields = self._MASTER_FIELDS
 
         if self.is_backtest and not no_cache:
             # try to load from cache
             securities = Cache.get(sids, prefix="_master")
 
-        if securities is None:
-
-            # query master
-            f = io.StringIO()
-            download_master_file(
-                f,
-                sids=sids,
-                fields=fields)
+            if securities is None:
+                # only one process at a time queries the master service
+                with Cache.lock(sids, prefix="_master"):
+                    securities = Cache.get(sids, prefix="_master")
+                    if securities is None:
+                        securities = self._download_master_file(sids, fields)
+                        Cache.set(sids, securities, prefix="_master")
 
-            securities = pd.read_csv(f, index_col="Sid")
+        if securities is None:
+            securities = self._download_master_file(sids, fields)
 
             if self.is_backtest:
                 Cache.set(sids, securities, prefix="_master")
 
+        return securities
+
+    def _set_securities_master(self, securities, nlv=None):
+        """
+        Infers the timezone from the securities if needed, appends the NLVs
+        if applicable, and stores the securities as the securities master.
+        """
         if not self.TIMEZONE:
             timezones = securities.Timezone.unique()
 
@@ -970,7 +1058,10 @@ class Moonshot(
                     "NLV dict is missing values for required currencies: {0}".format(
                         ", ".join(missing_nlvs)))
 
-            securities["Nlv"] = currencies.apply(lambda currency: nlvs.get(currency, None))
+            # assign rather than modify in place, as the master file may be
+            # shared with the in-memory cache
+            securities = securities.assign(
+                Nlv=currencies.apply(lambda currency: nlvs.get(currency, None)))
 
         self._securities_master = securities.sort_index()
 
@@ -1011,12 +1102,93 @@ class Moonshot(
             days=math.ceil(lookback_window*days_per_year/trading_days_per_year) + buffer)
         return start_date.date().isoformat()
 
+    @classmethod
+    def _get_tail_start_date(cls, trade_date):
+        """
+        Returns the start date to query for TRADE_TAIL_ONLY: enough weekdays
+        before the trade date to include the LOOKBACK_WINDOW and the signal
+        date (which precedes the trade date if the exchange is closed),
+        allowing for 25 holidays per 260 weekdays (see
+        `_get_start_date_with_lookback`).
+        """
+        lookback_window = cls._get_lookback_window()
+
+        weekdays_per_year = 260
+        max_holidays_per_year = 25
+        holidays = max(1, math.ceil(lookback_window*max_holidays_per_year/weekdays_per_year))
+
+        start_date = pd.Timestamp(trade_date) - pd.offsets.BDay(lookback_window + 1 + holidays)
+        return start_date.date().isoformat()
+
     def get_prices(self, start_date, end_date=None, nlv=None, no_cache=False):
         """
         Downloads prices from a history db and/or real-time aggregate db.
         Downloads security details from the master db.
         """
-        if start_date:
+        kwargs = self._get_prices_kwargs(start_date, end_date=end_date)
+        codes = kwargs["codes"]
+
+        prices = None
+
+        if self.is_backtest and not no_cache:
+
+            # If no end_date is specified (indicating the user wants
+            # up-to-date history), we don't want to use the cache if the dbs
+            # were more recently modified (indicating new data collection).
+            # If there's an end date, we use the cache if possible. (The user
+            # can use --no-cache to disable cache usage if needed.)
+            if not end_date:
+                unless_dbs_modified = {
+                    "services": ["history", "realtime"],
+                    "codes": codes}
+            else:
+                unless_dbs_modified = None
+
+            # try to load from cache
+            prices = Cache.get_prices(kwargs, prefix="_history", unless_dbs_modified=unless_dbs_modified)
+
+            if prices is None:
+                # Only one process at a time queries the db for the same
+                # prices; parallel backtests wait for it and then load the
+                # prices from cache
+                with Cache.lock(kwargs, prefix="_history"):
+                    prices = Cache.get_prices(
+                        kwargs, prefix="_history", unless_dbs_modified=unless_dbs_modified)
+
+                    # If the cached prices expired because the db was modified,
+                    # query only the new dates and append them
+                    if prices is None and unless_dbs_modified and cache.INCREMENTAL_HISTORY:
+                        prices = Cache.get_prices(kwargs, prefix="_history")
+                        if prices is not None:
+                            prices = self._append_new_prices(prices, kwargs)
+                            Cache.set_prices(kwargs, prices, prefix="_history")
+
+                    if prices is None:
+                        prices = get_prices(**kwargs)
+                        Cache.set_prices(kwargs, prices, prefix="_history")
+
+        if prices is None:
+            prices = get_prices(**kwargs)
+            if self.is_backtest:
+                Cache.set_prices(kwargs, prices, prefix="_history")
+
+        self._load_master_file(prices.columns.tolist(), nlv=nlv, no_cache=no_cache)
+
+        return prices
+
+    def _get_prices_kwargs(self, start_date, end_date=None):
+        """
+        Returns the kwargs for `quantrocket.price.get_prices`, with the
+        start_date adjusted to incorporate the LOOKBACK_WINDOW.
+        """
+        if self.is_trade and self.TRADE_TAIL_ONLY:
+            # query only through the review date, if any, and back only as
+            # far as the lookback window requires
+            if not end_date and self.review_date:
+                end_date = pd.Timestamp(self.review_date).date().isoformat()
+            if start_date:
+                start_date = self._get_tail_start_date(start_date)
+        elif start_date:
             start_date = self._get_start_date_with_lookback(start_date)
 
         codes = self.DB
@@ -1054,31 +1226,45 @@ class Moonshot(
         if not self.TIMEZONE:
             kwargs["infer_timezone"] = True
 
-        prices = None
-
-        if self.is_backtest and not no_cache:
-
-            # If no end_date is specified (indicating the user wants
-            # up-to-date history), we don't want to use the cache if the dbs
-            # were more recently modified (indicating new data collection).
-            # If there's an end date, we use the cache if possible. (The user
-            # can use --no-cache to disable cache usage if needed.)
-            if not end_date:
-                unless_dbs_modified = {
-                    "services": ["history", "realtime"],
-                    "codes": codes}
-            else:
-                unless_dbs_modified = None
+        return kwargs
 
-            # try to load from cache
-            prices = Cache.get(kwargs, prefix="_history", unless_dbs_modified=unless_dbs_modified)
+    def _append_new_prices(self, cached_prices, kwargs):
+        """
+        Queries prices from the last cached date onward and merges them into
+        the cached prices, replacing the cached rows on or after the first
+        new date (the last cached bar may have been incomplete).
+        """
+        max_cached_date = cached_prices.index.get_level_values("Date").max()
 
-        if prices is None:
-            prices = get_prices(**kwargs)
-            if self.is_backtest:
-                Cache.set(kwargs, prices, prefix="_history")
+        try:
+            new_prices = get_prices(**dict(kwargs, start_date=max_cached_date.date().isoformat()))
+        except NoData:
+            return cached_prices
+
+        min_new_date = new_prices.index.get_level_values("Date").min()
+        cached_dates = cached_prices.index.get_level_values("Date")
+
+        # append field by field to preserve the (Field, Date[, Time]) sort order
+        fields = cached_prices.index.get_level_values("Field").unique().union(
+            new_prices.index.get_level_values("Field").unique(), sort=False)
+        pieces = []
+        for field in fields:
+            if field in cached_prices.index:
+                field_rows = cached_prices.index.get_loc(field)
+                if isinstance(field_rows, slice):
+                    # the field's rows are contiguous and sorted by date, so
+                    # keep the rows before the new date as a view, to copy
+                    # the prices only once, in the final concat
+                    keep = cached_dates[field_rows].searchsorted(min_new_date)
+                    pieces.append(cached_prices.iloc[field_rows.start:field_rows.start + keep])
+                else:
+                    field_prices = cached_prices.loc[[field]]
+                    pieces.append(field_prices[
+                        field_prices.index.get_level_values("Date") < min_new_date])
+            if field in new_prices.index:
+                pieces.append(new_prices.loc[[field]])
 
-        self._load_master_file(prices.columns.tolist(), nlv=nlv, no_cache=no_cache)
+        prices = pd.concat(pieces)
 
         return prices
 
@@ -1092,7 +1278,8 @@ class Moonshot(
         return self.prices_to_signals(prices)
 
     def backtest(self, start_date=None, end_date=None, nlv=None, allocation=1.0,
-                 label_sids=False, no_cache=False):
+                 label_sids=False, no_cache=False, profile=False, lean=False,
+                 chunk_interval=None, chunk_dir=None):
         """
         Backtest a strategy and return a DataFrame of results.
 
@@ -1120,27 +1307,217 @@ class Moonshot(
             up backtests but may be undesirable if underlying data has changed.
             See http://qrok.it/h/mcache to learn more about caching in Moonshot.
 
+        profile : bool or str
+            record the wall time, CPU time, peak memory delta and output shape
+            of each stage of the backtest (including strategy methods such as
+            `prices_to_signals`) in a DataFrame at `self.profile`. If a str,
+            also write a JSON trace of the stages to this path, which can be
+            viewed in chrome://tracing or https://ui.perfetto.dev. Default False
+
+        lean : bool
+            return the results as a BacktestResults, which stores the fields
+            in a 3-D array (field x date x sid) instead of concatenating them
+            into a multiindex DataFrame, using less memory and time for large
+            backtests. `results.loc[field]` returns a DataFrame of one field
+            and `results.to_frame()` returns the usual DataFrame. Default False
+
+        chunk_interval : str, optional
+            run the backtest in consecutive slices of the date range, each
+            spanning this pandas frequency (for example 'M' or 'Q'), to bound
+            memory usage by the slice rather than the whole history. Each
+            slice loads the prices from LOOKBACK_WINDOW before its start, runs
+            the full pipeline and drops the warm-up rows. Requires start_date;
+            without end_date, the last slice is open-ended and the backtest
+            runs through the latest available prices
+
+        chunk_dir : str, optional
+            with chunk_interval, pickle the results of each slice to this
+            directory as soon as they are computed instead of concatenating
+            them in memory, and return the list of file paths
+
         Returns
         -------
-        DataFrame
+        DataFrame or BacktestResults or list
             multiindex (Field, Date) or (Field, Date, Time) DataFrame of
-            backtest results
+            backtest results, or BacktestResults if lean, or the paths of the
+            results files if chunk_dir
         """
         self.is_backtest = True
         allocation = allocation or 1.0
 
-        prices = self.get_prices(start_date, end_date, nlv=nlv, no_cache=no_cache)
+        if chunk_dir and not chunk_interval:
+            raise MoonshotParameterError("chunk_dir requires chunk_interval")
+
+        with self._profiling(profile):
+            with self._profile_stage("backtest"):
+                if chunk_interval:
+                    return self._backtest_chunks(
+                        chunk_interval, start_date, end_date, chunk_dir=chunk_dir,
+                        nlv=nlv, allocation=allocation, label_sids=label_sids,
+                        no_cache=no_cache, lean=lean)
+
+                prices = self.get_prices(start_date, end_date, nlv=nlv, no_cache=no_cache)
+
+                return self._backtest_prices(
+                    prices, start_date=start_date, allocation=allocation,
+                    label_sids=label_sids, no_cache=no_cache, lean=lean)
+
+    def _backtest_chunks(self, chunk_interval, start_date, end_date=None,
+                         chunk_dir=None, nlv=None, allocation=1.0,
+                         label_sids=False, no_cache=False, lean=False):
+        """
+        Runs the backtest in consecutive slices of the date range and
+        returns the concatenated results, or the paths of the pickled
+        results of each slice if chunk_dir. Called by `backtest`.
+
+        Each slice's prices start LOOKBACK_WINDOW before the slice (see
+        `get_prices`), so the slices overlap by the lookback window and
+        the rows of each slice are computed as in an unchunked backtest.
+        """
+        if not start_date:
+            raise MoonshotParameterError("chunk_interval requires start_date")
+
+        chunks = _get_date_chunks(start_date, end_date, chunk_interval)
+
+        if chunk_dir:
+            os.makedirs(chunk_dir, exist_ok=True)
+
+        all_results = []
+        for i, (chunk_start_date, chunk_end_date) in enumerate(chunks):
+            chunk_start_date = chunk_start_date.date().isoformat()
+            chunk_end_date = chunk_end_date.date().isoformat()
+
+            # Leave the last slice open-ended if no end_date was given, as in
+            # an unchunked backtest, so that cached prices are checked for
+            # newly collected data
+            is_open_ended = not end_date and i == len(chunks) - 1
+
+            # custom results are saved per slice
+            self._backtest_results = {}
+
+            with self._profile_stage("chunk"):
+                try:
+                    prices = self.get_prices(
+                        chunk_start_date, None if is_open_ended else chunk_end_date,
+                        nlv=nlv, no_cache=no_cache)
+                except NoData:
+                    continue
+
+                results = self._backtest_prices(
+                    prices, start_date=chunk_start_date, allocation=allocation,
+                    label_sids=label_sids, no_cache=no_cache, lean=lean)
+                del prices
+
+            if not len(results.index):
+                continue
+
+            if chunk_dir:
+                path = os.path.join(chunk_dir, "results_{0}_{1}.pkl".format(
+                    chunk_start_date, chunk_end_date))
+                pd.to_pickle(results, path)
+                all_results.append(path)
+            else:
+                all_results.append(results)
+
+            del results
+
+        if chunk_dir:
+            return all_results
+
+        if not all_results:
+            raise MoonshotError("no backtest results between {0} and {1}".format(
+                chunks[0][0].date().isoformat(), chunks[-1][1].date().isoformat()))
+
+        if lean:
+            return BacktestResults.concat(all_results)
+
+        return _concat_results_by_field(all_results)
+
+    # Methods recorded as stages when profiling a backtest
+    _PROFILED_METHODS = (
+        "get_prices",
+        "_load_master_file",
+        "_prices_to_signals",
+        "prices_to_signals",
+        "signals_to_target_weights",
+        "_constrain_weights",
+        "target_weights_to_positions",
+        "positions_to_gross_returns",
+        "_get_commissions",
+        "_get_slippage",
+        "_positions_to_turnover",
+        "_get_benchmark",
+        # trade
+        "_trim_prices_to_tail",
+        "_weights_to_today_weights",
+        "_get_contract_values",
+        "_get_target_quantities",
+        "limit_position_sizes",
+        "_get_positions_and_orders",
+        "_quantities_to_order_stubs",
+        "order_stubs_to_orders",
+    )
+
+    @contextmanager
+    def _profiling(self, profile):
+        """
+        Context manager which, if profile is truthy, records the stages of
+        the backtest in self.profile, and writes a JSON trace if profile is a
+        path.
+        """
+        if not profile:
+            yield
+            return
 
+        profiler = Profiler()
+        self._profiler = profiler
+        # wrap the methods on the instance so that calls from anywhere in
+        # the pipeline are recorded
+        for method_name in self._PROFILED_METHODS:
+            setattr(self, method_name, profiler.wrap(method_name, getattr(self, method_name)))
+        profiler.start()
+        try:
+            yield
+        finally:
+            profiler.stop()
+            for method_name in self._PROFILED_METHODS:
+                delattr(self, method_name)
+            self._profiler = None
+
+        self.profile = profiler.to_frame()
+        if isinstance(profile, str):
+            profiler.write_trace(profile)
+
+    def _profile_stage(self, name):
+        """
+        Returns a context manager which records a stage if profiling.
+        """
+        if self._profiler:
+            return self._profiler.stage(name)
+        return _null_stage()
+
+    def _backtest_prices(self, prices, start_date=None, allocation=1.0,
+                         label_sids=False, no_cache=False, lean=False):
+        """
+        Runs the backtest on already loaded prices and returns a DataFrame
+        of results (or BacktestResults if lean). Called by `backtest` (after
+        `get_prices`) and by `sweep`, which loads the prices once for all
+        parameter combinations.
+        """
         signals = self._prices_to_signals(prices, no_cache=no_cache)
         weights = self.signals_to_target_weights(signals, prices)
         weights = weights * allocation
-        weights = self._constrain_weights(weights, prices)
-        positions = self.target_weights_to_positions(weights, prices)
-        gross_returns = self.positions_to_gross_returns(positions, prices)
-        commissions = self._get_commissions(positions, prices)
-        slippages = self._get_slippage(positions, prices)
+        # the contract values and NLVs computed by _constrain_weights are
+        # reused by _get_commissions, and the turnover is computed once for
+        # the commissions, slippage and results
+        with self._caching_cost_inputs():
+            weights = self._constrain_weights(weights, prices)
+            positions = self.target_weights_to_positions(weights, prices)
+            gross_returns = self.positions_to_gross_returns(positions, prices)
+            turnover = self._positions_to_turnover(positions)
+            commissions = self._get_commissions(positions, prices, turnover=turnover)
+            slippages = self._get_slippage(positions, prices, turnover=turnover)
         returns = gross_returns.fillna(0) - commissions - slippages
-        turnover = self._positions_to_turnover(positions)
 
         total_holdings = (positions.fillna(0) != 0).astype(int)
 
@@ -1173,26 +1550,209 @@ class Moonshot(
         if self.BENCHMARK:
             all_results["Benchmark"] = self._get_benchmark(prices, daily=not results_are_intraday)
 
-        results = pd.concat(all_results, keys=list(sorted(all_results.keys())))
+        if lean:
+            index = positions.index.set_names(
+                ["Date", "Time"] if results_are_intraday else ["Date"])
+            columns = positions.columns
+            # drop the local references to the results so that each one is
+            # freed as soon as it has been copied into the array
+            del signals, weights, positions, gross_returns, commissions
+            del slippages, returns, turnover, total_holdings
+
+            with self._profile_stage("concat_results") as record:
+                results = BacktestResults.from_frames(all_results, index, columns)
+
+                if label_sids:
+                    symbols = self._securities_master.Symbol
+                    symbols_with_sids = symbols.astype(str) + "(" + symbols.index.astype(str) + ")"
+                    results.rename_columns(symbols_with_sids.to_dict())
 
-        names = ["Field","Date"]
-        if results.index.nlevels == 3:
-            names.append("Time")
+                if start_date:
+                    results = results.truncate_before(start_date)
 
-        results.index.set_names(names, inplace=True)
+                if record is not None:
+                    record["shape"] = list(results.values.shape)
+
+            return results
+
+        with self._profile_stage("concat_results") as record:
+            results = pd.concat(all_results, keys=list(sorted(all_results.keys())))
+
+            names = ["Field","Date"]
+            if results.index.nlevels == 3:
+                names.append("Time")
+
+            results.index.set_names(names, inplace=True)
+
+            if label_sids:
+                symbols = self._securities_master.Symbol
+                symbols_with_sids = symbols.astype(str) + "(" + symbols.index.astype(str) + ")"
+                results.rename(columns=symbols_with_sids.to_dict(), inplace=True)
+
+            # truncate at requested start_date
+            if start_date:
+                results = results.iloc[
+                    results.index.get_level_values("Date") >= pd.Timestamp(start_date)]
+
+            if record is not None:
+                record["shape"] = list(results.shape)
+
+        return results
+
+    # Parameters which change the prices query and therefore can't vary
+    # within a sweep, which loads the prices once
+    SWEEP_EXCLUDED_PARAMS = (
+        "DB", "DB_FIELDS", "DB_TIMES", "SIDS", "UNIVERSES", "EXCLUDE_SIDS",
+        "EXCLUDE_UNIVERSES", "CONT_FUT", "TIMEZONE", "BENCHMARK",
+        "BENCHMARK_DB")
+
+    @classmethod
+    def sweep(cls, param_grid, start_date=None, end_date=None, nlv=None,
+              allocation=1.0, label_sids=False, no_cache=False, n_jobs=1):
+        """
+        Backtest every combination of the parameter values in param_grid
+        and return a DataFrame of results keyed by the parameter values.
 
-        if label_sids:
-            symbols = self._securities_master.Symbol
-            symbols_with_sids = symbols.astype(str) + "(" + symbols.index.astype(str) + ")"
-            results.rename(columns=symbols_with_sids.to_dict(), inplace=True)
+        The prices are loaded once (covering the longest lookback window of
+        any combination) and shared by all the backtests. With n_jobs > 1,
+        the backtests run in a pool of worker processes. On platforms that
+        support forking, the workers inherit the prices from the parent
+        process instead of receiving a pickled copy.
 
-        # truncate at requested start_date
+        Parameters
+        ----------
+        param_grid : dict, required
+            dict of param:list of values, where each param is a class
+            attribute of the strategy. Params which change the prices query
+            (for example DB or DB_FIELDS) are not supported.
+
+        start_date : str (YYYY-MM-DD), optional
+            the backtest start date (default is to include all history in db)
+
+        end_date : str (YYYY-MM-DD), optional
+            the backtest end date (default is to include all history in db)
+
+        nlv : dict
+            dict of currency:nlv. Should contain a currency:nlv pair for
+            each currency represented in the strategy
+
+        allocation : float
+            how much to allocate to the strategy
+
+        label_sids : bool
+            replace <Sid> with <Symbol>(<Sid>) in columns in output
+            for better readability (default True)
+
+        no_cache : bool
+            don't use cached files even if available
+
+        n_jobs : int
+            number of backtests to run in parallel. -1 means use all CPUs.
+            Default 1 runs the backtests sequentially in this process.
+
+        Returns
+        -------
+        DataFrame
+            multiindex (<param>, ..., Field, Date) or (<param>, ..., Field,
+            Date, Time) DataFrame of backtest results, with one level per
+            param in param_grid
+
+        Examples
+        --------
+        Backtest each combination of moving average windows on 4 CPUs:
+
+        >>> results = DualMovingAverageStrategy.sweep(
+                {"LMAVG_WINDOW": [200, 300], "SMAVG_WINDOW": [50, 100]},
+                start_date="2010-01-01", n_jobs=4)
+        >>> results.loc[(300, 100, "Return")]
+        """
+        if not param_grid:
+            raise MoonshotParameterError("param_grid must contain at least one param")
+
+        param_names = list(param_grid.keys())
+        for param_name in param_names:
+            if param_name in cls.SWEEP_EXCLUDED_PARAMS:
+                raise MoonshotParameterError(
+                    "cannot sweep {0} because it changes the prices query".format(
+                        param_name))
+            if not hasattr(cls, param_name):
+                raise MoonshotParameterError(
+                    "{0} has no parameter {1}".format(cls.__name__, param_name))
+
+        combinations = [
+            dict(zip(param_names, values))
+            for values in itertools.product(*[param_grid[param_name] for param_name in param_names])]
+
+        if n_jobs == -1:
+            n_jobs = multiprocessing.cpu_count()
+        n_jobs = max(min(n_jobs or 1, len(combinations)), 1)
+
+        # Load the prices with the combination that needs the longest
+        # lookback, so they cover every combination
+        loader = _get_sweep_strategy(cls, combinations[0])
         if start_date:
-            results = results.iloc[
-                results.index.get_level_values("Date") >= pd.Timestamp(start_date)]
+            loader = min(
+                [_get_sweep_strategy(cls, params) for params in combinations],
+                key=lambda strategy: strategy._get_start_date_with_lookback(start_date))
+        loader.is_backtest = True
+        prices = loader.get_prices(start_date, end_date, nlv=nlv, no_cache=no_cache)
+
+        sweep_state = dict(
+            strategy_class=cls,
+            prices=prices,
+            securities_master=loader._securities_master,
+            inferred_timezone=loader._inferred_timezone,
+            backtest_kwargs=dict(
+                start_date=start_date,
+                allocation=allocation or 1.0,
+                label_sids=label_sids,
+                no_cache=no_cache))
+
+        for params in combinations:
+            _get_sweep_strategy(cls, params)._prepare_sweep(sweep_state)
+
+        if n_jobs == 1:
+            _init_sweep_worker(sweep_state)
+            try:
+                all_results = [_run_sweep_backtest(params) for params in combinations]
+            finally:
+                _init_sweep_worker(None)
+        else:
+            try:
+                mp_context = multiprocessing.get_context("fork")
+            except ValueError:
+                mp_context = None
+            with ProcessPoolExecutor(
+                max_workers=n_jobs, mp_context=mp_context,
+                initializer=_init_sweep_worker, initargs=(sweep_state,)) as executor:
+                all_results = list(executor.map(_run_sweep_backtest, combinations))
+
+        if len(param_names) == 1:
+            keys = [params[param_names[0]] for params in combinations]
+        else:
+            keys = [tuple(params.values()) for params in combinations]
+
+        results = pd.concat(all_results, keys=keys, names=param_names)
 
         return results
 
+    def _prepare_sweep(self, sweep_state):
+        """
+        Called in the parent process for each parameter combination of a
+        sweep, before any backtests run. Subclasses can override this to add
+        what the backtests need, such as a model, to the shared sweep_state.
+        """
+        pass
+
+    def _prepare_sweep_strategy(self, sweep_state):
+        """
+        Prepares the strategy to backtest one parameter combination of a
+        sweep from the shared sweep_state.
+        """
+        self.is_backtest = True
+        self._securities_master = sweep_state["securities_master"]
+        self._inferred_timezone = sweep_state["inferred_timezone"]
+
     def _get_benchmark(self, prices, daily=True):
         """
         Returns a 1-column DataFrame of benchmark prices, either extracted
@@ -1349,7 +1909,7 @@ class Moonshot(
 
         self._backtest_results[name] = df
 
-    def trade(self, allocations, review_date=None):
+    def trade(self, allocations, review_date=None, profile=False):
         """
         Run the strategy and create orders.
 
@@ -1363,141 +1923,223 @@ class Moonshot(
             For end-of-day strategies, provide a date; for intraday strategies a date
             and time
 
+        profile : bool or str
+            record the wall time, CPU time, peak memory delta and output shape
+            of each stage in a DataFrame at `self.profile`. If a str, also
+            write a JSON trace of the stages to this path. Default False
+
         Returns
         -------
         DataFrame
             orders
         """
+        with self._profiling(profile):
+            with self._profile_stage("trade"):
+                return self._trade(allocations, review_date=review_date)
+
+    def _trade(self, allocations, review_date=None):
+        """
+        Runs the strategy and creates orders. Called by `trade`.
+        """
         self.is_trade = True
         self.review_date = review_date
+        self._prepare_to_trade()
 
         start_date = review_date or pd.Timestamp.today()
 
-        prices = self.get_prices(start_date)
-        prices_is_intraday = "Time" in prices.index.names
-
-        signals = self._prices_to_signals(prices)
-
-        weights = self.signals_to_target_weights(signals, prices)
-
-        weights = self._weights_to_today_weights(weights, prices)
-
         allocations = pd.Series(allocations)
         # Out:
         # U12345    0.25
         # U55555    0.50
 
-        # Multiply weights times allocations
-        weights = weights.apply(lambda x: x * allocations)
+        accounts = list(allocations.index)
 
-        # Out:
-        #        U12345  U55555
-        # 12345  -0.050   -0.10
-        # 23456   0.000    0.00
-        # 34567   0.025    0.05
-        contract_values = self._get_contract_values(prices)
-        contract_values = contract_values.fillna(method="ffill").loc[self._signal_date]
-        if prices_is_intraday:
-            if self._signal_time:
-                contract_values = contract_values.loc[self._signal_time]
-            else:
-                contract_values = contract_values.iloc[-1]
-        contract_values = allocations.apply(lambda x: contract_values).T
-        # Out:
-        #          U12345    U55555
-        # 12345     95.68     95.68
-        # 23456   1500.00   1500.00
-        # 34567   3600.00   3600.00
+        # The account, exchange rate, position and order queries don't
+        # depend on the signals, so they run in threads as soon as their
+        # inputs are known, overlapping with the prices query and the
+        # strategy's calculations
+        with ThreadPoolExecutor(max_workers=4) as executor:
 
-        currencies = self._securities_master.Currency
-        sec_types = self._securities_master.SecType
+            balances = executor.submit(self._download_account_balances, accounts)
 
-        # For FX, exchange rate conversions should be based on the quote currency
-        # (extracted from the Symbol), not the currency (i.e. 100 EUR.USD = 100 EUR,
-        # not 100 USD)
-        if (sec_types == "CASH").any():
-            quote_currencies = self._securities_master.Symbol.astype(str).str.split(".").str[0]
-            currencies = currencies.where(sec_types != "CASH", quote_currencies)
+            prices = self.get_prices(start_date)
 
-        f = io.StringIO()
-        download_account_balances(
-            f,
-            latest=True,
-            accounts=list(allocations.index),
-            fields=["NetLiquidation"])
+            return self._trade_prices(prices, allocations, executor, balances)
 
-        balances = pd.read_csv(f, index_col="Account")
+    def _trade_prices(self, prices, allocations, executor, balances):
+        """
+        Submits the exchange rate, position and order queries to the
+        executor and creates orders from the already loaded prices. balances
+        is a Future of the account balances. Called by `_trade` and by
+        `TradingSession.trade`.
+        """
+        currencies = self._get_trade_currencies()
 
-        f = io.StringIO()
-        download_exchange_rates(
-            f, latest=True,
-            base_currencies=list(balances.Currency.unique()),
-            quote_currencies=list(currencies.unique()))
-        exchange_rates = pd.read_csv(f)
+        exchange_rates = executor.submit(self._download_exchange_rates, balances, currencies)
+        positions_and_orders = executor.submit(
+            self._get_positions_and_orders, accounts=list(allocations.index),
+            sids=list(prices.columns))
 
-        nlvs = balances.NetLiquidation.reindex(allocations.index)
-        # Out:
-        # U12345 1000000
-        # U55555  500000
+        return self._prices_to_orders(
+            prices, allocations, currencies, balances.result,
+            exchange_rates.result, positions_and_orders.result)
 
-        nlvs = weights.apply(lambda x: nlvs, axis=1)
-        # Out:
-        #        U12345 U55555
-        # 12345 1000000 500000
-        # 23456 1000000 500000
-        # 34567 1000000 500000
+    def _prepare_to_trade(self):
+        """
+        Called before running the strategy in live trading. Subclasses can
+        override this to load what they need, such as a model.
+        """
+        pass
 
-        base_currencies = balances.Currency.reindex(allocations.index)
-        # Out:
-        # U12345 USD
-        # U55555 EUR
+    @staticmethod
+    def trade_batch(strategies, review_date=None):
+        """
+        Run several strategies and create their orders, sharing the data
+        loads between them.
 
-        base_currencies = weights.apply(lambda x: base_currencies, axis=1)
-        # Out:
-        #        U12345 U55555
-        # 12345     USD    EUR
-        # 23456     USD    EUR
-        # 34567     USD    EUR
+        The strategies are grouped by their prices query, and the prices of
+        each group are queried once. The master file, account balances,
+        exchange rates, positions and open orders are queried once for all
+        the strategies. Each strategy then runs on the shared data as in
+        `trade`.
 
-        trade_currencies = allocations.apply(lambda x: currencies).T
-        # Out:
-        #        U12345 U55555
-        # 12345     USD    USD
-        # 23456     JPY    JPY
-        # 34567     JPY    JPY
-
-        base_currencies = base_currencies.stack()
-        trade_currencies= trade_currencies.stack()
-        base_currencies.name = "BaseCurrency"
-        trade_currencies.name = "QuoteCurrency"
-        currencies = pd.concat((base_currencies,trade_currencies), axis=1)
-        # Out:
-        #              BaseCurrency QuoteCurrency
-        # 12345 U12345          USD           USD
-        #       U55555          EUR           USD
-        # 23456 U12345          USD           JPY
-        #       U55555          EUR           JPY
-        # 34567 U12345          USD           JPY
-        #       U55555          EUR           JPY
-
-        exchange_rates = pd.merge(currencies, exchange_rates, how="left",
-                                  on=["BaseCurrency","QuoteCurrency"])
-        exchange_rates.index = currencies.index
-        exchange_rates.loc[(exchange_rates.BaseCurrency == exchange_rates.QuoteCurrency), "Rate"] = 1
-        exchange_rates = exchange_rates.Rate.unstack()
-        # Out:
-        #        U12345  U55555
-        # 12345    1.00    1.15
-        # 23456  107.02  127.12
-        # 34567  107.02  127.12
+        Parameters
+        ----------
+        strategies : list of (class or instance, dict), required
+            list of (strategy, allocations), where strategy is a Moonshot
+            subclass or instance and allocations is a dict of
+            account:allocation to the strategy (expressed as a percentage
+            of NLV)
 
-        # Convert weights to quantities
-        target_trade_values_in_base_currency = weights * nlvs
-        target_trade_values_in_trade_currency = target_trade_values_in_base_currency * exchange_rates
-        # Note: we take abs() of contract_values because combos can have
-        # negative prices which would invert the sign of the trade
-        target_quantities = target_trade_values_in_trade_currency / contract_values.where(contract_values != 0).abs()
-        target_quantities = target_quantities.round().fillna(0).astype(int)
+        review_date : str (YYYY-MM-DD [HH:MM:SS]), optional
+            generate orders as if it were this date, rather than using the latest date.
+            For end-of-day strategies, provide a date; for intraday strategies a date
+            and time
+
+        Returns
+        -------
+        DataFrame
+            orders of all the strategies, or None if there are no orders
+
+        Examples
+        --------
+        >>> orders = Moonshot.trade_batch([
+        >>>     (DualMovingAverageStrategy, {"U12345": 0.5}),
+        >>>     (MeanReversionStrategy, {"U12345": 0.25, "U55555": 1.0})])
+        """
+        if not strategies:
+            raise MoonshotParameterError("strategies must not be empty")
+
+        strategies = [
+            (strategy() if isinstance(strategy, type) else strategy, pd.Series(allocations))
+            for strategy, allocations in strategies]
+
+        start_date = review_date or pd.Timestamp.today()
+
+        accounts = []
+        for _, allocations in strategies:
+            accounts.extend(account for account in allocations.index if account not in accounts)
+
+        # the shared queries are made through the first strategy
+        first_strategy = strategies[0][0]
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+
+            balances = executor.submit(first_strategy._download_account_balances, accounts)
+
+            # query the prices once per distinct query
+            prices_by_query = {}
+            strategy_queries = []
+            for strategy, _ in strategies:
+                strategy.is_trade = True
+                strategy.review_date = review_date
+                strategy._prepare_to_trade()
+                kwargs = strategy._get_prices_kwargs(start_date)
+                query = json.dumps(kwargs, sort_keys=True, default=str)
+                if query not in prices_by_query:
+                    prices_by_query[query] = get_prices(**kwargs)
+                strategy_queries.append(query)
+
+            sids = sorted(set(itertools.chain.from_iterable(
+                prices.columns for prices in prices_by_query.values())))
+            securities = first_strategy._get_master_file(sids)
+
+            all_currencies = []
+            for (strategy, _), query in zip(strategies, strategy_queries):
+                prices = prices_by_query[query]
+                strategy._set_securities_master(
+                    securities[securities.index.isin(prices.columns)])
+                all_currencies.append(strategy._get_trade_currencies())
+
+            exchange_rates = executor.submit(
+                first_strategy._download_exchange_rates, balances, pd.concat(all_currencies))
+            positions_and_orders = executor.submit(
+                first_strategy._get_positions_and_orders, accounts=accounts, sids=sids,
+                order_refs=[strategy.CODE for strategy, _ in strategies])
+
+            def get_strategy_positions_and_orders(strategy):
+                all_positions_and_orders = positions_and_orders.result()
+                return all_positions_and_orders[
+                    all_positions_and_orders.OrderRef == strategy.CODE][["Sid","Account","Quantity"]]
+
+            all_orders = []
+            used_queries = set()
+            for (strategy, allocations), query in zip(strategies, strategy_queries):
+                prices = prices_by_query[query]
+                # strategies sharing prices each get their own copy, in case
+                # they modify them
+                if query in used_queries:
+                    prices = prices.copy()
+                used_queries.add(query)
+                orders = strategy._prices_to_orders(
+                    prices, allocations, strategy._get_trade_currencies(),
+                    balances.result, exchange_rates.result,
+                    functools.partial(get_strategy_positions_and_orders, strategy))
+                if orders is not None:
+                    all_orders.append(orders)
+
+        if not all_orders:
+            return None
+
+        return pd.concat(all_orders, ignore_index=True, sort=False)
+
+    def _prices_to_orders(self, prices, allocations, currencies, get_balances,
+                          get_exchange_rates, get_positions_and_orders):
+        """
+        Runs the strategy on the prices and creates orders. The get_*
+        arguments are functions which return the account balances, exchange
+        rates and positions and orders, waiting for them if they are still
+        being queried. Called by `_trade_prices` and `trade_batch`.
+        """
+        if self.TRADE_TAIL_ONLY:
+            # determine the signal date up front to keep only the prices
+            # needed for its signals
+            self._trade_datetime = self._get_trade_datetime()
+            prices = self._trim_prices_to_tail(prices)
+        else:
+            self._trade_datetime = None
+
+        prices_is_intraday = "Time" in prices.index.names
+
+        signals = self._prices_to_signals(prices)
+
+        weights = self.signals_to_target_weights(signals, prices)
+
+        weights = self._weights_to_today_weights(weights, prices)
+
+        contract_values = self._get_contract_values(prices)
+        contract_values = contract_values.fillna(method="ffill").loc[self._signal_date]
+        if prices_is_intraday:
+            if self._signal_time:
+                contract_values = contract_values.loc[self._signal_time]
+            else:
+                contract_values = contract_values.iloc[-1]
+
+        balances = get_balances()
+        exchange_rates = get_exchange_rates()
+
+        target_quantities = self._get_target_quantities(
+            weights, allocations, contract_values, currencies, balances, exchange_rates)
 
         # Constrain quantities (we do this before applying the position diff in order to
         # mirror backtesting)
@@ -1508,7 +2150,7 @@ class Moonshot(
             max_quantities_for_longs = max_quantities_for_longs.loc[self._signal_date]
             if max_quantities_for_longs_is_intraday:
                 max_quantities_for_longs = max_quantities_for_longs.loc[self._signal_time]
-            max_quantities_for_longs = allocations.apply(lambda x: max_quantities_for_longs.abs()).T
+            max_quantities_for_longs = _repeat_for_accounts(max_quantities_for_longs.abs(), allocations.index)
             target_quantities = max_quantities_for_longs.where(
                 target_quantities > max_quantities_for_longs, target_quantities)
 
@@ -1517,14 +2159,15 @@ class Moonshot(
             max_quantities_for_shorts = max_quantities_for_shorts.loc[self._signal_date]
             if max_quantities_for_shorts_is_intraday:
                 max_quantities_for_shorts = max_quantities_for_shorts.loc[self._signal_time]
-            max_quantities_for_shorts = allocations.apply(lambda x: -max_quantities_for_shorts.abs()).T
+            max_quantities_for_shorts = _repeat_for_accounts(-max_quantities_for_shorts.abs(), allocations.index)
             target_quantities = max_quantities_for_shorts.where(
                 target_quantities < max_quantities_for_shorts, target_quantities)
 
-        # Adjust quantities based on existing positions_and_orders
-        positions_and_orders = self._get_positions_and_orders(
-            accounts=list(allocations.index),
-            sids=list(target_quantities.index))
+        # Adjust quantities based on existing positions_and_orders (which
+        # were queried for all the sids in the prices)
+        positions_and_orders = get_positions_and_orders()
+        positions_and_orders = positions_and_orders[
+            positions_and_orders.Sid.isin(target_quantities.index)]
 
         if positions_and_orders.empty:
             net_quantities = target_quantities
@@ -1569,46 +2212,165 @@ class Moonshot(
 
         return orders
 
-    def _get_positions_and_orders(self, accounts, sids):
+    def _get_target_quantities(self, weights, allocations, contract_values,
+                               currencies, balances, exchange_rates):
+        """
+        Returns a DataFrame of target quantities (with Sids as index,
+        Accounts as columns), from Series of the weights, contract values
+        and trade currencies by sid, the allocations by account, and the
+        account balances and exchange rates.
+
+        Each weight is multiplied by each account's allocation and NLV,
+        converted from the account's base currency to the sid's trade
+        currency, and divided by the contract value. The (sid x account)
+        matrices are outer products of the sid and account arrays, and the
+        exchange rates are looked up in a (base x quote currency) matrix.
+        """
+        # align the sids as pandas arithmetic would
+        sids = weights.index
+        for other_sids in (currencies.index, contract_values.index):
+            if not sids.equals(other_sids):
+                sids = sids.union(other_sids)
+
+        accounts = allocations.index
+        quote_currencies = currencies.reindex(sids)
+        base_currencies = balances.Currency.reindex(accounts)
+
+        # Out:
+        #       USD     JPY
+        # USD  1.00  107.02
+        # EUR  1.15  127.12
+        rates = exchange_rates.set_index(["BaseCurrency","QuoteCurrency"]).Rate.unstack()
+        unique_base_currencies = pd.Index(base_currencies.unique())
+        unique_quote_currencies = pd.Index(quote_currencies.unique())
+        rates = rates.reindex(
+            index=unique_base_currencies, columns=unique_quote_currencies).values.astype(float)
+        rates[unique_base_currencies.values[:, np.newaxis] == unique_quote_currencies.values] = 1
+
+        # Out (sid x account):
+        #        U12345  U55555
+        # 12345    1.00    1.15
+        # 23456  107.02  127.12
+        # 34567  107.02  127.12
+        rates = rates[
+            unique_base_currencies.get_indexer(base_currencies)[np.newaxis, :],
+            unique_quote_currencies.get_indexer(quote_currencies)[:, np.newaxis]]
+
+        weights = weights.reindex(sids).values.astype(float)[:, np.newaxis]
+        nlvs = balances.NetLiquidation.reindex(accounts).values.astype(float)
+        contract_values = contract_values.reindex(sids).values.astype(float)[:, np.newaxis]
+
+        # Convert weights to quantities
+        target_trade_values_in_base_currency = weights * allocations.values.astype(float) * nlvs
+        target_trade_values_in_trade_currency = target_trade_values_in_base_currency * rates
+        # Note: we take abs() of contract_values because combos can have
+        # negative prices which would invert the sign of the trade
+        target_quantities = target_trade_values_in_trade_currency / np.abs(
+            np.where(contract_values != 0, contract_values, np.nan))
+        target_quantities = np.round(target_quantities)
+        target_quantities = np.where(np.isnan(target_quantities), 0, target_quantities).astype(int)
+
+        return pd.DataFrame(target_quantities, index=sids, columns=accounts)
+
+    def _get_trade_currencies(self):
+        """
+        Returns a Series of the currency of each sid in the securities
+        master, in which trade values are expressed. For FX, this is the base
+        currency.
+        """
+        currencies = self._securities_master.Currency
+        sec_types = self._securities_master.SecType
+
+        # For FX, exchange rate conversions should be based on the quote currency
+        # (extracted from the Symbol), not the currency (i.e. 100 EUR.USD = 100 EUR,
+        # not 100 USD)
+        if (sec_types == "CASH").any():
+            quote_currencies = self._securities_master.Symbol.astype(str).str.split(".").str[0]
+            currencies = currencies.where(sec_types != "CASH", quote_currencies)
+
+        return currencies
+
+    def _download_account_balances(self, accounts):
+        """
+        Returns a DataFrame of the latest NLV and base currency of each
+        account.
+        """
+        with self._profile_stage("download_account_balances"):
+            f = io.StringIO()
+            download_account_balances(
+                f,
+                latest=True,
+                accounts=accounts,
+                fields=["NetLiquidation"])
+
+            return pd.read_csv(f, index_col="Account")
+
+    def _download_exchange_rates(self, balances, currencies):
+        """
+        Returns a DataFrame of the latest exchange rates from the accounts'
+        base currencies to the trade currencies. balances is a Future of the
+        account balances.
+        """
+        balances = balances.result()
+
+        with self._profile_stage("download_exchange_rates"):
+            f = io.StringIO()
+            download_exchange_rates(
+                f, latest=True,
+                base_currencies=list(balances.Currency.unique()),
+                quote_currencies=list(currencies.unique()))
+            return pd.read_csv(f)
+
+    def _get_positions_and_orders(self, accounts, sids, order_refs=None):
         """
         Returns a DataFrame of current positions and open orders, for the
         purpose of generating an order diff in live trading.
+
+        If order_refs is given, queries the positions and orders of those
+        order refs instead of this strategy's CODE, and returns them by
+        OrderRef as well as Sid and Account.
         """
+        by_order_ref = order_refs is not None
+        keys = ["Sid","Account","OrderRef"] if by_order_ref else ["Sid","Account"]
+        order_refs = order_refs if by_order_ref else [self.CODE]
+
         # query positions
-        positions = list_positions(
-            order_refs=[self.CODE],
-            accounts=accounts,
-            sids=sids
-        )
+        with self._profile_stage("list_positions"):
+            positions = list_positions(
+                order_refs=order_refs,
+                accounts=accounts,
+                sids=sids
+            )
 
         if positions:
             positions = pd.DataFrame(positions)
         else:
-            positions = pd.DataFrame(columns=["Sid","Account","Quantity"])
+            positions = pd.DataFrame(columns=keys + ["Quantity"])
 
         # query open orders
         f = io.StringIO()
-        download_order_statuses(
-            f,
-            order_refs=[self.CODE],
-            accounts=accounts,
-            sids=sids,
-            open_orders=True,
-            fields=["Sid","Account","OrderRef","Remaining","Action"],
-            output="json")
+        with self._profile_stage("download_order_statuses"):
+            download_order_statuses(
+                f,
+                order_refs=order_refs,
+                accounts=accounts,
+                sids=sids,
+                open_orders=True,
+                fields=["Sid","Account","OrderRef","Remaining","Action"],
+                output="json")
 
         if f.getvalue():
             orders = json.load(f)
             orders = pd.DataFrame(orders)
             orders.loc[orders.Action == "SELL", "Remaining"] = -orders.loc[orders.Action == "SELL"].Remaining
-            orders = orders.groupby([orders.Sid, orders.Account]).Remaining.sum().reset_index()
+            orders = orders.groupby([orders[key] for key in keys]).Remaining.sum().reset_index()
         else:
-            orders = pd.DataFrame(columns=["Sid","Account","Remaining"])
+            orders = pd.DataFrame(columns=keys + ["Remaining"])
 
-        positions_and_orders = pd.merge(positions, orders, how="outer", on=["Sid","Account"])
+        positions_and_orders = pd.merge(positions, orders, how="outer", on=keys)
         positions_and_orders.loc[:, "Quantity"] = positions_and_orders.Quantity.fillna(0) + positions_and_orders.Remaining.fillna(0)
 
-        positions_and_orders = positions_and_orders[["Sid","Account","Quantity"]]
+        positions_and_orders = positions_and_orders[keys + ["Quantity"]]
 
         return positions_and_orders
 
@@ -1617,6 +2379,13 @@ class Moonshot(
         Return a DataFrame of contract values by multiplying prices times
         multipliers and dividing by price magnifiers.
         """
+        return self._get_cost_input(
+            "contract_values", prices, lambda: self._calculate_contract_values(prices))
+
+    def _calculate_contract_values(self, prices):
+        """
+        Calculates the contract values returned by `_get_contract_values`.
+        """
         # Find a price field we can use
         field = self.CONTRACT_VALUE_REFERENCE_FIELD
         if not field:
@@ -1655,13 +2424,174 @@ class Moonshot(
 
         closes = prices.loc[field]
 
+        # Align the master fields to the columns once; the 1-D arrays are
+        # then broadcast across the rows
+        master = self._securities_master.reindex(closes.columns)
+
         # For FX, the value of the contract is simply 1 (1 EUR.USD = 1
         # EUR; 1 EUR.JPY = 1 EUR)
         if "CASH" in self._securities_master.SecType.values:
-            sec_types = closes.apply(lambda x: self._securities_master.SecType, axis=1)
-            closes = closes.where(sec_types != "CASH", 1)
+            is_cash = (master.SecType == "CASH").values
+            closes = closes.where(~np.broadcast_to(is_cash, closes.shape), 1)
 
-        price_magnifiers = closes.apply(lambda x: self._securities_master.PriceMagnifier.fillna(1), axis=1)
-        multipliers = closes.apply(lambda x: self._securities_master.Multiplier.fillna(1), axis=1)
+        price_magnifiers = master.PriceMagnifier.fillna(1).values.astype(float)
+        multipliers = master.Multiplier.fillna(1).values.astype(float)
         contract_values = closes / price_magnifiers * multipliers
         return contract_values
+
+    def _broadcast_master_field(self, field, like):
+        """
+        Returns a DataFrame with the index and columns of like, in which each
+        column holds the securities master value of field for that column's
+        sid.
+
+        The master field is aligned to the columns once and repeated across
+        the rows with NumPy, rather than building a Series per row.
+        """
+        def broadcast():
+            values = self._securities_master[field].reindex(like.columns).values
+            return pd.DataFrame(
+                np.repeat(values[np.newaxis, :], len(like.index), axis=0),
+                index=like.index, columns=like.columns)
+
+        return self._get_cost_input(field, (like.index, like.columns), broadcast)
+
+    @contextmanager
+    def _caching_cost_inputs(self):
+        """
+        Context manager which caches the inputs to the transaction cost
+        calculations (contract values and broadcast master fields) until it
+        exits, so that each is computed once per backtest.
+        """
+        self._cost_inputs = {}
+        try:
+            yield
+        finally:
+            self._cost_inputs = None
+
+    def _get_cost_input(self, name, key, calculate):
+        """
+        Returns calculate(), or, inside `_caching_cost_inputs`, the result of
+        an earlier call with the same name and key. Keys match if they are
+        the same object, or equal indexes, or tuples of matching keys.
+        """
+        if self._cost_inputs is None:
+            return calculate()
+
+        if name in self._cost_inputs:
+            cached_key, cached_value = self._cost_inputs[name]
+            if _keys_match(cached_key, key):
+                return cached_value
+
+        value = calculate()
+        self._cost_inputs[name] = (key, value)
+        return value
+
+def _get_date_chunks(start_date, end_date, chunk_interval):
+    """
+    Returns a list of consecutive (start, end) Timestamps covering
+    start_date through end_date (default today), split at the period ends
+    of chunk_interval.
+    """
+    start_date = pd.Timestamp(start_date)
+    end_date = pd.Timestamp(end_date or pd.Timestamp.today().date())
+    if end_date < start_date:
+        raise MoonshotParameterError("end_date must not be earlier than start_date")
+
+    period_ends = [
+        period_end for period_end in pd.date_range(start_date, end_date, freq=chunk_interval)
+        if period_end < end_date]
+    period_ends.append(end_date)
+    period_starts = [start_date] + [
+        period_end + pd.Timedelta(days=1) for period_end in period_ends[:-1]]
+    return list(zip(period_starts, period_ends))
+
+def _concat_results_by_field(all_results):
+    """
+    Concatenates the (Field, Date[, Time]) results DataFrames of
+    consecutive date ranges, keeping the rows grouped by field.
+    """
+    fields = sorted(set(itertools.chain.from_iterable(
+        results.index.get_level_values("Field").unique() for results in all_results)))
+
+    results = pd.concat([
+        pd.concat([
+            results.loc[[field]] for results in all_results
+            if field in results.index.get_level_values("Field")])
+        for field in fields])
+    return results
+
+def _repeat_for_accounts(values, accounts):
+    """
+    Returns a DataFrame with a column per account, each a copy of the
+    values (a Series by sid).
+    """
+    return pd.DataFrame(
+        np.repeat(values.values[:, np.newaxis], len(accounts), axis=1),
+        index=values.index, columns=accounts)
+
+def _keys_match(key, other_key):
+    """
+    Returns True if the cost input keys match (see `Moonshot._get_cost_input`).
+    """
+    if isinstance(key, tuple) and isinstance(other_key, tuple):
+        return len(key) == len(other_key) and all(
+            _keys_match(k, other_k) for k, other_k in zip(key, other_key))
+    if key is other_key:
+        return True
+    if isinstance(key, pd.Index) and isinstance(other_key, pd.Index):
+        return key.equals(other_key)
+    return False
+
+@contextmanager
+def _null_stage():
+    """
+    Stands in for Profiler.stage when not profiling.
+    """
+    yield None
+
+# State shared by the backtests of a sweep. Set once per worker process by
+# the pool initializer (which, when forking, inherits the prices without
+# pickling them), or in the parent process for a sequential sweep.
+_sweep_state = None
+
+def _init_sweep_worker(sweep_state):
+    """
+    Stores the state shared by the backtests of a sweep.
+    """
+    global _sweep_state
+    _sweep_state = sweep_state
+
+def _get_sweep_strategy(strategy_class, params):
+    """
+    Returns an instance of a subclass of strategy_class with the params
+    set as class attributes.
+    """
+    # keep the strategy's own module, so that objects cached with
+    # unless_file_modified=self expire when the strategy's file is modified
+    strategy_subclass = type(strategy_class.__name__, (strategy_class,), dict(
+        params,
+        __module__=strategy_class.__module__,
+        __qualname__=strategy_class.__qualname__))
+    return strategy_subclass()
+
+def _run_sweep_backtest(params):
+    """
+    Backtests one parameter combination of a sweep on the shared prices.
+    """
+    strategy = _get_sweep_strategy(_sweep_state["strategy_class"], params)
+    strategy._prepare_sweep_strategy(_sweep_state)
+
+    prices = _sweep_state["prices"]
+    backtest_kwargs = _sweep_state["backtest_kwargs"]
+    start_date = backtest_kwargs["start_date"]
+
+    # Limit the prices to this combination's own lookback, as a standalone
+    # backtest would query
+    if start_date:
+        lookback_start_date = pd.Timestamp(strategy._get_start_date_with_lookback(start_date))
+        dates = prices.index.get_level_values("Date")
+        if dates.min() < lookback_start_date:
+            prices = prices.loc[dates >= lookback_start_date]
+
+    return strategy._backtest_prices(prices, **backtest_kwargs)
@@ -12,11 +12,12 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import copy
 import pickle
 try:
     import joblib
 except ImportError:
-    pass
+    joblib = None
 import pandas as pd
 import numpy as np
 from moonshot.strategies.base import Moonshot
@@ -172,6 +173,7 @@ class MoonshotML(Moonshot):
     def __init__(self, *args, **kwargs):
         super(MoonshotML, self).__init__(*args, **kwargs)
         self.model = None
+        self._walkforward_params = None # set by walkforward()
 
     def _load_model(self):
         """
@@ -293,7 +295,8 @@ class MoonshotML(Moonshot):
         raise NotImplementedError("strategies must implement predictions_to_signals")
 
     def backtest(self, model=None, start_date=None, end_date=None, nlv=None,
-                allocation=1.0, label_sids=False, no_cache=False):
+                allocation=1.0, label_sids=False, no_cache=False, profile=False,
+                lean=False, chunk_interval=None, chunk_dir=None):
         """
         Backtest a strategy and return a DataFrame of results.
 
@@ -325,11 +328,31 @@ class MoonshotML(Moonshot):
             up backtests but may be undesirable if underlying data has changed.
             See http://qrok.it/h/mcache to learn more about caching in Moonshot.
 
+        profile : bool or str
+            record the wall time, CPU time, peak memory delta and output shape
+            of each stage of the backtest in a DataFrame at `self.profile`. If
+            a str, also write a JSON trace of the stages to this path. Default
+            False
+
+        lean : bool
+            return the results as a BacktestResults (a 3-D array of field x
+            date x sid) instead of a multiindex DataFrame. Default False
+
+        chunk_interval : str, optional
+            run the backtest in consecutive slices of the date range, each
+            spanning this pandas frequency (for example 'M' or 'Q'), to bound
+            memory usage. Requires start_date. See `Moonshot.backtest`
+
+        chunk_dir : str, optional
+            with chunk_interval, pickle the results of each slice to this
+            directory and return the list of file paths
+
         Returns
         -------
-        DataFrame
+        DataFrame or BacktestResults or list
             multiindex (Field, Date) or (Field, Date, Time) DataFrame of
-            backtest results
+            backtest results, or BacktestResults if lean, or the paths of the
+            results files if chunk_dir
         """
 
         if model:
@@ -340,7 +363,144 @@ class MoonshotML(Moonshot):
         return super(MoonshotML, self).backtest(
             start_date=start_date, end_date=end_date, nlv=nlv,
             allocation=allocation, label_sids=label_sids,
-            no_cache=no_cache)
+            no_cache=no_cache, profile=profile, lean=lean,
+            chunk_interval=chunk_interval, chunk_dir=chunk_dir)
+
+    _PROFILED_METHODS = Moonshot._PROFILED_METHODS + (
+        "_get_features",
+        "prices_to_features",
+        "_features_to_array",
+        "_predict",
+        "_walkforward_predict",
+        "predictions_to_signals",
+    )
+
+    def walkforward(self, retrain_interval, model=None, train_window=None,
+                    gap=0, partial_fit=False, n_jobs=1, start_date=None,
+                    end_date=None, nlv=None, allocation=1.0, label_sids=False,
+                    no_cache=False, profile=False, lean=False):
+        """
+        Run a walk-forward backtest and return a DataFrame of results.
+
+        The features are computed once. The backtest period is split into
+        consecutive test windows of retrain_interval, and for each test window
+        a clone of the model is fit on the features and targets of the dates
+        before the window (all preceding dates, or the preceding train_window
+        dates) and used to predict the test window. The out-of-sample
+        predictions are stitched together and backtested as usual.
+
+        Dates that are not in any test window, or whose window has no
+        training data, have NaN predictions. To train the first window on
+        history before start_date, increase LOOKBACK_WINDOW.
+
+        Parameters
+        ----------
+        retrain_interval : str, required
+            retrain the model at this interval, as a pandas offset alias (for
+            example 'Q' or 'MS')
+
+        model : object, optional
+            machine learning model to clone and fit; if not specified, the
+            model will be loaded from file based on MODEL class attribute.
+            scikit-learn models are cloned with sklearn.base.clone, other
+            models are deep copied
+
+        train_window : int, optional
+            train each model on this many dates before the test window (a
+            rolling window). Default is to train on all dates before the test
+            window (an expanding window)
+
+        gap : int, optional
+            exclude this many dates at the end of each train window, to avoid
+            training on targets that were not yet known at the start of the
+            test window (for example, set to 5 if the targets are 5-day
+            forward returns). Default 0
+
+        partial_fit : bool
+            instead of fitting a new clone for each test window, update a
+            single clone with model.partial_fit using only the dates added to
+            the train window since the previous window. Requires an expanding
+            window. Default False
+
+        n_jobs : int
+            number of models to fit in parallel (using joblib). -1 means use
+            all CPUs. Ignored if partial_fit=True. Default 1
+
+        start_date : str (YYYY-MM-DD), optional
+            the backtest start date, which is also the start of the first test
+            window (default is to include all history in db)
+
+        end_date : str (YYYY-MM-DD), optional
+            the backtest end date (default is to include all history in db)
+
+        nlv : dict
+            dict of currency:nlv. Should contain a currency:nlv pair for
+            each currency represented in the strategy
+
+        allocation : float
+            how much to allocate to the strategy
+
+        label_sids : bool
+            replace <Sid> with <Symbol>(<Sid>) in columns in output
+            for better readability (default True)
+
+        no_cache : bool
+            don't use cached files even if available
+
+        profile : bool or str
+            record the stages of the backtest in `self.profile`, and write a
+            JSON trace to this path if a str. Default False
+
+        lean : bool
+            return the results as a BacktestResults instead of a multiindex
+            DataFrame. Default False
+
+        Returns
+        -------
+        DataFrame or BacktestResults
+            multiindex (Field, Date) or (Field, Date, Time) DataFrame of
+            backtest results, or BacktestResults if lean
+
+        Examples
+        --------
+        Retrain a model each quarter on the previous 2 years of data:
+
+        >>> results = DemoMLStrategy().walkforward(
+                "Q", model=DecisionTreeClassifier(), train_window=504,
+                start_date="2015-01-01")
+        """
+        if partial_fit and train_window:
+            raise MoonshotParameterError(
+                "partial_fit requires an expanding window, please don't set train_window")
+
+        if n_jobs != 1 and not partial_fit and joblib is None:
+            raise MoonshotError("joblib is required to fit models in parallel")
+
+        if model is None:
+            self._load_model()
+            model = self.model
+
+        if partial_fit and not hasattr(model, "partial_fit"):
+            raise MoonshotParameterError(
+                "partial_fit=True but {0} has no partial_fit method".format(
+                    type(model).__name__))
+
+        self.model = model
+        self._walkforward_params = dict(
+            retrain_interval=retrain_interval,
+            train_window=train_window,
+            gap=gap,
+            partial_fit=partial_fit,
+            n_jobs=n_jobs,
+            start_date=start_date)
+
+        try:
+            return super(MoonshotML, self).backtest(
+                start_date=start_date, end_date=end_date, nlv=nlv,
+                allocation=allocation, label_sids=label_sids,
+                no_cache=no_cache, profile=profile, lean=lean)
+        finally:
+            self._walkforward_params = None
 
     def _prices_to_signals(self, prices, no_cache=False):
         """
@@ -350,13 +510,38 @@ class MoonshotML(Moonshot):
         - using the ML model to create predictions from the features
         - creating signals from the predictions
         """
+        features, targets = self._get_features(prices, no_cache=no_cache)
+
+        features, targets, predictions_series_idx, unstack_predictions_series = self._features_to_array(
+            features, targets=targets if self._walkforward_params else None)
+
+        # get predictions
+        if self._walkforward_params:
+            predictions = self._walkforward_predict(features, targets, predictions_series_idx)
+        else:
+            predictions = self._predict(self.model, features)
+        del features
+
+        predictions = pd.Series(predictions, index=predictions_series_idx)
+        if unstack_predictions_series:
+            predictions = predictions.unstack(level="Sid")
+
+        # predictions to signals
+        signals = self.predictions_to_signals(predictions, prices)
+        return signals
+
+    def _get_features(self, prices, no_cache=False):
+        """
+        Returns a tuple of (features, targets) from prices_to_features, served
+        from cache in backtests if possible.
+        """
         features = None
 
         # serve features from cache in backtests if possible. The features are cached
         # based on the index and columns of prices. If this file has been
         # edited more recently than the features were cached, the cache is
         # not used.
-        cache_key = [self.CODE, prices.index.tolist(), prices.columns.tolist()]
+        cache_key = [self.CODE, Cache.fingerprint(prices.index), Cache.fingerprint(prices.columns)]
         if self.is_backtest and not no_cache:
             features = Cache.get(cache_key, prefix="_features", unless_file_modified=self)
 
@@ -369,11 +554,17 @@ class MoonshotML(Moonshot):
         if not isinstance(features, tuple) or len(features) != 2:
             raise MoonshotError("prices_to_features should return a tuple of (features, targets)")
 
-        features, targets = features
+        return features
 
-        # Don't use the targets/labels for predictions
-        del targets
+    def _features_to_array(self, features, targets=None):
+        """
+        Converts the features to the array expected by the model. Returns a
+        tuple of (features array, targets array or None, index of the
+        predictions Series, whether to unstack the predictions Series).
 
+        The targets are only converted if provided, and are aligned with the
+        rows of the features array.
+        """
         if not isinstance(features, (dict, list, tuple, pd.DataFrame)):
             raise MoonshotError("features should either be a DataFrame or a dict, list, or tuple of DataFrames or Series")
 
@@ -420,9 +611,18 @@ class MoonshotML(Moonshot):
             features = np.stack(all_features, axis=-1)
             del all_features
 
-        # get predictions
-        predictions = self.model.predict(features)
-        del features
+        if targets is not None:
+            if isinstance(targets, pd.DataFrame):
+                targets = targets.stack(dropna=False)
+            targets = targets.reindex(predictions_series_idx).values.astype(float)
+
+        return features, targets, predictions_series_idx, unstack_predictions_series
+
+    def _predict(self, model, features):
+        """
+        Returns a 1-d array of the model's predictions for the features array.
+        """
+        predictions = model.predict(features)
 
         if len(predictions.shape) == 2:
             # Keras output has (n_samples,1) shape and needs to be squeezed
@@ -433,23 +633,137 @@ class MoonshotML(Moonshot):
             # 0 (False) and second col is probability of 1 (True); we just want the
             # second col (https://datascience.stackexchange.com/a/22821)
             elif (
-                hasattr(self.model, "classes_")
-                and len(self.model.classes_) == 2
-                and list(self.model.classes_) == [0,1]):
+                hasattr(model, "classes_")
+                and len(model.classes_) == 2
+                and list(model.classes_) == [0,1]):
                 predictions = predictions[:,-1]
 
             else:
                 raise NotImplementedError("Don't know what to do with predictions having shape {}".format(predictions.shape))
 
-        predictions = pd.Series(predictions, index=predictions_series_idx)
-        if unstack_predictions_series:
-            predictions = predictions.unstack(level="Sid")
+        return predictions
 
-        # predictions to signals
-        signals = self.predictions_to_signals(predictions, prices)
-        return signals
+    def _get_walkforward_windows(self, dates):
+        """
+        Returns a list of (train mask, test mask) boolean arrays for the rows
+        of the features array, given the Date of each row.
+        """
+        params = self._walkforward_params
+
+        unique_dates = dates.unique().sort_values()
+
+        test_start_date = unique_dates[0]
+        if params["start_date"]:
+            test_start_date = pd.Timestamp(params["start_date"])
+            if unique_dates.tz is not None:
+                test_start_date = test_start_date.tz_localize(unique_dates.tz)
+
+        test_start_dates = pd.date_range(
+            test_start_date, unique_dates[-1], freq=params["retrain_interval"])
+        test_start_dates = test_start_dates[test_start_dates > test_start_date].insert(
+            0, test_start_date)
+        test_end_dates = test_start_dates[1:].append(pd.DatetimeIndex([unique_dates[-1]]))
+
+        windows = []
+        for i, (test_start_date, test_end_date) in enumerate(zip(test_start_dates, test_end_dates)):
+            if i == len(test_start_dates) - 1:
+                test_mask = (dates >= test_start_date) & (dates <= test_end_date)
+            else:
+                test_mask = (dates >= test_start_date) & (dates < test_end_date)
+
+            train_dates = unique_dates[unique_dates < test_start_date]
+            if params["gap"]:
+                train_dates = train_dates[:-params["gap"]]
+            if params["train_window"]:
+                train_dates = train_dates[-params["train_window"]:]
+
+            if len(train_dates):
+                train_mask = (dates >= train_dates[0]) & (dates <= train_dates[-1])
+            else:
+                train_mask = np.zeros(len(dates), dtype=bool)
 
-    def trade(self, allocations, review_date=None):
+            windows.append((train_mask, test_mask))
+
+        return windows
+
+    def _walkforward_predict(self, features, targets, predictions_series_idx):
+        """
+        Returns a 1-d array of out-of-sample predictions, fitting a model for
+        each walk-forward test window.
+        """
+        if targets is None:
+            raise MoonshotError("prices_to_features must return targets for walk-forward backtests")
+
+        params = self._walkforward_params
+
+        dates = pd.DatetimeIndex(predictions_series_idx.get_level_values(0))
+        windows = self._get_walkforward_windows(dates)
+
+        # don't train on rows without a target
+        has_target = ~np.isnan(targets)
+        windows = [
+            (train_mask & has_target, test_mask) for train_mask, test_mask in windows
+            if test_mask.any()]
+
+        predictions = np.full(len(targets), np.nan)
+
+        if params["partial_fit"]:
+            model = self._clone_model(self.model)
+            fit_kwargs = {}
+            if hasattr(model, "get_params"):
+                # scikit-learn is imported lazily so that it isn't loaded
+                # (or required) by `import moonshot`
+                try:
+                    from sklearn.base import is_classifier
+                except ImportError:
+                    is_classifier = None
+                if is_classifier is not None and is_classifier(model):
+                    fit_kwargs["classes"] = np.unique(targets[has_target])
+            trained_mask = np.zeros(len(targets), dtype=bool)
+            is_fitted = False
+            for train_mask, test_mask in windows:
+                new_mask = train_mask & ~trained_mask
+                if new_mask.any():
+                    model.partial_fit(features[new_mask], targets[new_mask], **fit_kwargs)
+                    trained_mask |= new_mask
+                    is_fitted = True
+                if is_fitted:
+                    predictions[test_mask] = self._predict(model, features[test_mask])
+            return predictions
+
+        windows = [(train_mask, test_mask) for train_mask, test_mask in windows if train_mask.any()]
+
+        if params["n_jobs"] == 1:
+            models = [
+                _fit_model(self._clone_model(self.model), features[train_mask], targets[train_mask])
+                for train_mask, _ in windows]
+        else:
+            models = joblib.Parallel(n_jobs=params["n_jobs"])(
+                joblib.delayed(_fit_model)(
+                    self._clone_model(self.model), features[train_mask], targets[train_mask])
+                for train_mask, _ in windows)
+
+        for model, (_, test_mask) in zip(models, windows):
+            predictions[test_mask] = self._predict(model, features[test_mask])
+
+        return predictions
+
+    def _clone_model(self, model):
+        """
+        Returns an unfitted copy of the model (for scikit-learn models) or a
+        deep copy (for other models).
+        """
+        if hasattr(model, "get_params"):
+            # scikit-learn is imported lazily, as in _walkforward_predict
+            try:
+                from sklearn.base import clone
+            except ImportError:
+                pass
+            else:
+                return clone(model)
+        return copy.deepcopy(model)
+
+    def trade(self, allocations, review_date=None, profile=False):
         """
         Run the strategy and create orders.
 
@@ -463,10 +777,43 @@ class MoonshotML(Moonshot):
             For end-of-day strategies, provide a date; for intraday strategies a date
             and time
 
+        profile : bool or str
+            record the stages in `self.profile`, and write a JSON trace to this
+            path if a str. Default False
+
         Returns
         -------
         DataFrame
             orders
         """
+        return super(MoonshotML, self).trade(
+            allocations, review_date=review_date, profile=profile)
+
+    def _prepare_to_trade(self):
+        """
+        Loads the model before running the strategy in live trading.
+        """
         self._load_model()
-        return super(MoonshotML, self).trade(allocations, review_date=review_date)
+
+    def _prepare_sweep(self, sweep_state):
+        """
+        Loads the model once for the sweep, rather than in every backtest.
+        """
+        models = sweep_state.setdefault("models", {})
+        if self.MODEL not in models:
+            self._load_model()
+            models[self.MODEL] = self.model
+
+    def _prepare_sweep_strategy(self, sweep_state):
+        """
+        Gives the strategy the model loaded by _prepare_sweep.
+        """
+        super(MoonshotML, self)._prepare_sweep_strategy(sweep_state)
+        self.model = sweep_state["models"][self.MODEL]
+
+def _fit_model(model, features, targets):
+    """
+    Fits the model and returns it.
+    """
+    model.fit(features, targets)
+    return model
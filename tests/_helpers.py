@@ -0,0 +1,92 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Price and securities master mocks shared by the test modules.
+"""
+
+import numpy as np
+import pandas as pd
+
+def make_prices(intraday=False):
+
+    dt_idx = pd.DatetimeIndex(["2018-05-01","2018-05-02"])
+    fields = ["Close","Open","Volume"]
+    if intraday:
+        idx = pd.MultiIndex.from_product(
+            [fields, dt_idx, ["09:30:00", "10:00:00"]], names=["Field", "Date", "Time"])
+    else:
+        idx = pd.MultiIndex.from_product([fields, dt_idx], names=["Field", "Date"])
+
+    n = len(idx)
+    prices = pd.DataFrame(
+        {
+            "FI12345": [float(i) for i in range(n)],
+            "FI23456": [float(i) * 2 if i % 3 else None for i in range(n)],
+        },
+        index=idx
+    )
+    prices.columns.name = "Sid"
+    return prices
+
+def mock_download_master_file(f, *args, **kwargs):
+
+    master_fields = ["Timezone", "Symbol", "SecType", "Currency", "PriceMagnifier", "Multiplier"]
+    securities = pd.DataFrame(
+        {
+            "FI12345": [
+                "America/New_York",
+                "ABC",
+                "STK",
+                "USD",
+                None,
+                None
+            ],
+            "FI23456": [
+                "America/New_York",
+                "DEF",
+                "STK",
+                "USD",
+                None,
+                None,
+            ]
+        },
+        index=master_fields
+    )
+    securities.columns.name = "Sid"
+    securities.T.to_csv(f, index=True, header=True)
+    f.seek(0)
+
+def mock_get_prices(start_date=None, end_date=None, **kwargs):
+    """
+    Returns daily closes from 2018-01-01 through 2018-06-29, limited to the
+    requested dates.
+    """
+    dt_idx = pd.bdate_range("2018-01-01", "2018-06-29", name="Date")
+    idx = pd.MultiIndex.from_product([["Close"], dt_idx], names=["Field", "Date"])
+    day_numbers = np.arange(len(idx))
+    prices = pd.DataFrame(
+        {
+            "FI12345": 10 + np.sin(day_numbers / 3),
+            "FI23456": 20 + np.cos(day_numbers / 5),
+        },
+        index=idx)
+    dates = prices.index.get_level_values("Date")
+    if start_date:
+        prices = prices.loc[dates >= pd.Timestamp(start_date)]
+        dates = prices.index.get_level_values("Date")
+    if end_date:
+        prices = prices.loc[dates <= pd.Timestamp(end_date)]
+    prices.columns.name = "Sid"
+    return prices
@@ -0,0 +1,196 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from quantrocket.exceptions import NoData
+from moonshot import Moonshot
+from moonshot.cache import Cache
+from moonshot.exceptions import MoonshotParameterError
+from ._helpers import mock_download_master_file, mock_get_prices
+
+class MovingAverageStrategy(Moonshot):
+
+    DB = "test-db"
+    MAVG_WINDOW = 5
+    DIRECTION = 1
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        signals = (closes > mavgs).astype(int) * self.DIRECTION
+        return signals
+
+    def target_weights_to_positions(self, weights, prices):
+        return weights.shift()
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        return closes.pct_change() * positions.shift()
+
+class SaveMovingAveragesStrategy(MovingAverageStrategy):
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        self.save_to_results("MAvg", mavgs)
+        signals = (closes > mavgs).astype(int) * self.DIRECTION
+        return signals
+
+class ChunkedBacktestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+            patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_chunked_backtest_matches_backtest(self):
+        """
+        Tests that a backtest run in monthly slices queries each slice with
+        its lookback and returns the same results as an unchunked backtest,
+        including custom results.
+        """
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            expected_results = SaveMovingAveragesStrategy().backtest(
+                start_date="2018-02-01", end_date="2018-06-29", no_cache=True)
+
+        with patch("moonshot.strategies.base.get_prices", side_effect=mock_get_prices) as mock:
+            results = SaveMovingAveragesStrategy().backtest(
+                start_date="2018-02-01", end_date="2018-06-29", no_cache=True,
+                chunk_interval="M")
+
+        self.assertListEqual(
+            [(call[1]["start_date"], call[1]["end_date"]) for call in mock.call_args_list],
+            [(SaveMovingAveragesStrategy._get_start_date_with_lookback(start_date), end_date)
+             for start_date, end_date in [
+                 ("2018-02-01", "2018-02-28"),
+                 ("2018-03-01", "2018-03-31"),
+                 ("2018-04-01", "2018-04-30"),
+                 ("2018-05-01", "2018-05-31"),
+                 ("2018-06-01", "2018-06-29")]])
+
+        pd.testing.assert_frame_equal(results, expected_results)
+
+    def test_last_slice_is_open_ended_without_end_date(self):
+        """
+        Tests that, without an end_date, the last slice is queried without
+        an end date, so that its cached prices are checked for db updates
+        as in an unchunked backtest.
+        """
+        def _mock_get_prices(*args, **kwargs):
+            prices = mock_get_prices(*args, **kwargs)
+            if prices.empty:
+                raise NoData("no history matches the query parameters")
+            return prices
+
+        with patch("moonshot.strategies.base.get_prices", new=_mock_get_prices):
+            expected_results = MovingAverageStrategy().backtest(
+                start_date="2018-02-01", no_cache=True)
+
+        with patch("moonshot.strategies.base.get_prices", side_effect=_mock_get_prices) as mock_get:
+            with patch("moonshot.strategies.base.Cache.get_prices", side_effect=Cache.get_prices) as mock_cache_get:
+                results = MovingAverageStrategy().backtest(
+                    start_date="2018-02-01", chunk_interval="A")
+
+        end_dates = [call[1]["end_date"] for call in mock_get.call_args_list]
+        self.assertEqual(end_dates[0], "2018-12-31")
+        self.assertTrue(all(end_dates[:-1]))
+        self.assertIsNone(end_dates[-1])
+
+        for call in mock_cache_get.call_args_list:
+            if call[0][0]["end_date"]:
+                self.assertIsNone(call[1]["unless_dbs_modified"])
+            else:
+                self.assertDictEqual(
+                    call[1]["unless_dbs_modified"],
+                    {"services": ["history", "realtime"], "codes": ["test-db"]})
+        self.assertIsNone(mock_cache_get.call_args[0][0]["end_date"])
+
+        pd.testing.assert_frame_equal(results, expected_results)
+
+    def test_chunked_backtest_lean(self):
+        """
+        Tests that the slices of a lean chunked backtest are concatenated
+        into one BacktestResults.
+        """
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            expected_results = MovingAverageStrategy().backtest(
+                start_date="2018-02-01", end_date="2018-06-29", no_cache=True)
+            results = MovingAverageStrategy().backtest(
+                start_date="2018-02-01", end_date="2018-06-29", no_cache=True,
+                chunk_interval="Q", lean=True)
+
+        self.assertEqual(len(results.index), len(expected_results.loc["Return"]))
+        pd.testing.assert_frame_equal(results.to_frame(), expected_results, check_dtype=False)
+
+    def test_chunked_backtest_to_dir(self):
+        """
+        Tests that chunk_dir pickles the results of each slice and returns
+        the paths.
+        """
+        chunk_dir = os.path.join(self.tmpdir, "chunks")
+
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            expected_results = MovingAverageStrategy().backtest(
+                start_date="2018-02-01", end_date="2018-06-29", no_cache=True)
+            paths = MovingAverageStrategy().backtest(
+                start_date="2018-02-01", end_date="2018-06-29", no_cache=True,
+                chunk_interval="Q", chunk_dir=chunk_dir)
+
+        self.assertListEqual(
+            paths,
+            [os.path.join(chunk_dir, "results_2018-02-01_2018-03-31.pkl"),
+             os.path.join(chunk_dir, "results_2018-04-01_2018-06-29.pkl")])
+
+        all_results = [pd.read_pickle(path) for path in paths]
+        for results in all_results:
+            self.assertListEqual(
+                sorted(results.index.get_level_values("Field").unique()),
+                sorted(expected_results.index.get_level_values("Field").unique()))
+
+        returns = pd.concat([results.loc["Return"] for results in all_results])
+        pd.testing.assert_frame_equal(returns, expected_results.loc["Return"])
+
+    def test_complain_if_chunked_without_start_date(self):
+        """
+        Tests error handling when chunk_interval is used without a start
+        date or chunk_dir without chunk_interval.
+        """
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            with self.assertRaises(MoonshotParameterError) as cm:
+                MovingAverageStrategy().backtest(no_cache=True, chunk_interval="M")
+
+            self.assertIn("chunk_interval requires start_date", repr(cm.exception))
+
+            with self.assertRaises(MoonshotParameterError) as cm:
+                MovingAverageStrategy().backtest(
+                    start_date="2018-02-01", no_cache=True, chunk_dir=self.tmpdir)
+
+            self.assertIn("chunk_dir requires chunk_interval", repr(cm.exception))
@@ -0,0 +1,156 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from moonshot.cache import Cache, COMPRESSION_MAGIC
+from moonshot.exceptions import MoonshotParameterError
+from ._helpers import make_prices
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class CacheCompressionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _get_codec(self, filepath):
+        """
+        Returns the codec the file was compressed with, based on its magic
+        number.
+        """
+        with open(filepath, "rb") as f:
+            header = f.read(6)
+        for magic, codec in COMPRESSION_MAGIC.items():
+            if header.startswith(magic):
+                return codec
+        return None
+
+    def test_roundtrip(self):
+        """
+        Tests that objects are compressed with each codec and decompressed
+        transparently.
+        """
+        prices = make_prices()
+        codecs = ["lzma", "gzip"]
+        if lz4:
+            codecs.append("lz4")
+        if zstandard:
+            codecs.append("zstd")
+
+        for codec in codecs:
+            Cache.set(codec, prices, prefix="foo", compression=codec)
+            self.assertEqual(
+                self._get_codec(Cache._get_filepath(codec, prefix="foo")), codec)
+            pd.testing.assert_frame_equal(Cache.get(codec, prefix="foo"), prices)
+
+        Cache.set("none", prices, prefix="foo", compression="none")
+        self.assertIsNone(self._get_codec(Cache._get_filepath("none", prefix="foo")))
+        pd.testing.assert_frame_equal(Cache.get("none", prefix="foo"), prices)
+
+    def test_compression_by_prefix(self):
+        """
+        Tests that MOONSHOT_CACHE_COMPRESSION selects the codec by prefix.
+        """
+        with patch("moonshot.cache.COMPRESSION", new="_history:lzma, gzip"):
+            self.assertEqual(Cache._get_compression("_history"), "lzma")
+            self.assertEqual(Cache._get_compression("_master"), "gzip")
+            self.assertEqual(Cache._get_compression("_master", compression="none"), None)
+
+        with patch("moonshot.cache.COMPRESSION", new="_history:lzma"):
+            self.assertEqual(Cache._get_compression("_history"), "lzma")
+            self.assertIsNone(Cache._get_compression("_master"))
+
+        with patch("moonshot.cache.COMPRESSION", new="lzma,_master:none"):
+            self.assertEqual(Cache._get_compression("_history"), "lzma")
+            self.assertIsNone(Cache._get_compression("_master"))
+
+        with patch("moonshot.cache.COMPRESSION", new=None):
+            self.assertIsNone(Cache._get_compression("_history"))
+
+        with patch("moonshot.cache.COMPRESSION", new="gzip"):
+            Cache.set("a", 1, prefix="_master")
+        self.assertEqual(self._get_codec(Cache._get_filepath("a", prefix="_master")), "gzip")
+        self.assertEqual(Cache.get("a", prefix="_master"), 1)
+
+    def test_invalid_codec(self):
+        """
+        Tests error handling for an unknown codec.
+        """
+        with self.assertRaises(MoonshotParameterError) as cm:
+            Cache.set("a", 1, prefix="foo", compression="snappy")
+
+        self.assertIn(
+            "invalid compression codec: snappy (choices are lz4, zstd, lzma, gzip, none)",
+            repr(cm.exception))
+
+    def test_fallback_if_not_installed(self):
+        """
+        Tests that lz4 and zstd fall back to gzip if not installed, and that
+        files compressed with a codec that isn't installed are cache misses.
+        """
+        with patch("moonshot.cache.lz4", new=None):
+            with patch("moonshot.cache.zstandard", new=None):
+                self.assertEqual(Cache._get_compression("foo", compression="lz4"), "gzip")
+                self.assertEqual(Cache._get_compression("foo", compression="zstd"), "gzip")
+
+        if lz4:
+            Cache.set("a", 1, prefix="foo", compression="lz4")
+            with patch("moonshot.cache.lz4", new=None):
+                self.assertIsNone(Cache.get("a", prefix="foo"))
+            self.assertEqual(Cache.get("a", prefix="foo"), 1)
+
+    def test_compressed_prices(self):
+        """
+        Tests that pickled and feather price caches are compressed.
+        """
+        prices = make_prices()
+        kwargs = dict(codes=["test-db"], fields=None)
+
+        Cache.set_prices(kwargs, prices, format="pickle", compression="gzip")
+        self.assertEqual(self._get_codec(Cache._get_filepath(kwargs, prefix="_history")), "gzip")
+        pd.testing.assert_frame_equal(Cache.get_prices(kwargs, format="pickle"), prices)
+
+        if pyarrow:
+            Cache.set_prices(kwargs, prices, format="feather", compression="zstd")
+            pd.testing.assert_frame_equal(Cache.get_prices(kwargs, format="feather"), prices)
+            pd.testing.assert_frame_equal(
+                Cache.get_prices(dict(codes=["test-db"], fields=["Open"]), format="feather"),
+                prices.loc[["Open"]])
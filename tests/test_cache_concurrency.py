@@ -0,0 +1,177 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+from unittest.mock import patch
+import pandas as pd
+from moonshot import Moonshot
+from moonshot.cache import Cache, fcntl
+from ._helpers import make_prices, mock_download_master_file
+
+class BuyBelow10(Moonshot):
+
+    DB_FIELDS = ["Close"]
+
+    def prices_to_signals(self, prices):
+        signals = prices.loc["Close"] < 10
+        return signals.astype(int)
+
+def run_backtest(tmpdir):
+    """
+    Runs a backtest with slow mock prices and master services that record
+    each query in a log file.
+    """
+    logpath = os.path.join(tmpdir, "queries.log")
+
+    def mock_get_prices(*args, **kwargs):
+        with open(logpath, "a") as f:
+            f.write("prices\n")
+        time.sleep(0.3)
+        return make_prices().loc[["Close"]]
+
+    def mock_download_master_file_slowly(f, *args, **kwargs):
+        with open(logpath, "a") as log:
+            log.write("master\n")
+        time.sleep(0.3)
+        mock_download_master_file(f, *args, **kwargs)
+
+    with patch("moonshot.cache.TMP_DIR", new=tmpdir):
+        with patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file_slowly):
+            with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+                return BuyBelow10().backtest(end_date="2018-05-02")
+
+class CacheConcurrencyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_failed_write_leaves_cached_object_intact(self):
+        """
+        Tests that a write which fails partway through neither corrupts the
+        previously cached object nor leaves temporary files behind.
+        """
+        Cache.set("a", 1, prefix="foo")
+
+        with patch("moonshot.cache.pickle.dump", side_effect=OSError("No space left on device")):
+            with self.assertRaises(OSError):
+                Cache.set("a", 2, prefix="foo")
+
+        self.assertEqual(Cache.get("a", prefix="foo"), 1)
+        self.assertListEqual(
+            os.listdir(self.tmpdir), [os.path.basename(Cache._get_filepath("a", prefix="foo"))])
+
+    def test_failed_open_raises_original_error(self):
+        """
+        Tests that the original error is raised if the temporary file
+        couldn't be created.
+        """
+        with patch("moonshot.cache.Cache._open_for_write", side_effect=PermissionError("denied")):
+            with self.assertRaises(PermissionError):
+                Cache.set("a", 1, prefix="foo")
+
+        self.assertListEqual(os.listdir(self.tmpdir), [])
+
+    def test_replace_columnar_prices(self):
+        """
+        Tests that rewriting a columnar prices cache replaces the entry and
+        leaves no temporary directories behind.
+        """
+        kwargs = dict(codes=["test-db"], fields=None)
+        prices = make_prices()
+        Cache.set_prices(kwargs, prices, format="mmap")
+        Cache.set_prices(kwargs, prices * 2, format="mmap")
+
+        pd.testing.assert_frame_equal(Cache.get_prices(kwargs, format="mmap"), prices * 2)
+        self.assertListEqual(
+            os.listdir(self.tmpdir),
+            [os.path.basename(Cache._get_prices_dirpath(kwargs, format="mmap"))])
+
+    def test_entry_replaced_while_loading_is_a_miss(self):
+        """
+        Tests that prices are not returned if another process replaced the
+        entry while they were being loaded.
+        """
+        kwargs = dict(codes=["test-db"], fields=None)
+        prices = make_prices()
+        Cache.set_prices(kwargs, prices, format="mmap")
+
+        load_columnar_prices = Cache._load_columnar_prices
+
+        def replace_while_loading(*args, **kwargs_):
+            loaded_prices = load_columnar_prices(*args, **kwargs_)
+            Cache.set_prices(kwargs, prices * 2, format="mmap")
+            return loaded_prices
+
+        with patch.object(Cache, "_load_columnar_prices", side_effect=replace_while_loading):
+            self.assertIsNone(Cache.get_prices(kwargs, format="mmap"))
+
+        pd.testing.assert_frame_equal(Cache.get_prices(kwargs, format="mmap"), prices * 2)
+
+    @unittest.skipIf(fcntl is None, "fcntl not available")
+    def test_lock_is_exclusive(self):
+        """
+        Tests that only one process at a time holds the lock on a key.
+        """
+        logpath = os.path.join(self.tmpdir, "lock.log")
+
+        def hold_lock():
+            with Cache.lock("a", prefix="foo"):
+                with open(logpath, "a") as f:
+                    f.write("acquired\n")
+                time.sleep(0.2)
+                with open(logpath, "a") as f:
+                    f.write("released\n")
+
+        processes = [multiprocessing.get_context("fork").Process(target=hold_lock) for _ in range(3)]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+
+        with open(logpath) as f:
+            self.assertListEqual(f.read().split(), ["acquired", "released"] * 3)
+
+    @unittest.skipIf(fcntl is None, "fcntl not available")
+    def test_parallel_backtests_query_once(self):
+        """
+        Tests that parallel backtests of the same strategy query the price
+        and master services once, and that every backtest gets the same
+        results.
+        """
+        with multiprocessing.get_context("fork").Pool(4) as pool:
+            results = pool.map(run_backtest, [self.tmpdir] * 4)
+
+        with open(os.path.join(self.tmpdir, "queries.log")) as f:
+            self.assertListEqual(sorted(f.read().split()), ["master", "prices"])
+
+        for result in results[1:]:
+            pd.testing.assert_frame_equal(result, results[0])
@@ -0,0 +1,121 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+import pandas as pd
+from moonshot.cache import Cache
+
+def make_mock_list_databases(last_modified):
+    return MagicMock(return_value={
+        "postgres": [],
+        "sqlite": [{'last_modified': last_modified.isoformat(),
+                    'name': 'quantrocket.history.my-db.sqlite',
+                    'path': '/var/lib/quantrocket/quantrocket.history.my-db.sqlite',
+                    'size_in_mb': 3.1}]})
+
+class DbsModifiedMemoTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+            patch.object(Cache, "_dbs_last_modified", new={}),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+        Cache.set("a", 1, prefix="foo")
+        self.unless_dbs_modified = {"services": ["history"], "codes": ["my-db"]}
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _get(self):
+        return Cache.get("a", prefix="foo", unless_dbs_modified=self.unless_dbs_modified)
+
+    def test_disabled_by_default(self):
+        """
+        Tests that list_databases is queried on every lookup by default, and
+        that the caller's kwargs are not modified.
+        """
+        mock_list_databases = make_mock_list_databases(pd.Timestamp("2015-01-01"))
+        with patch("moonshot.cache.list_databases", new=mock_list_databases):
+            self.assertEqual(self._get(), 1)
+            self.assertEqual(self._get(), 1)
+
+        self.assertEqual(mock_list_databases.call_count, 2)
+        mock_list_databases.assert_called_with(services=["history"], codes=["my-db"], detail=True)
+        self.assertDictEqual(self.unless_dbs_modified, {"services": ["history"], "codes": ["my-db"]})
+
+    def test_memo(self):
+        """
+        Tests that the db last modified time is remembered until the TTL
+        expires.
+        """
+        old = make_mock_list_databases(pd.Timestamp("2015-01-01"))
+        modified = make_mock_list_databases(pd.Timestamp.now() + pd.Timedelta(seconds=60))
+
+        with patch("moonshot.cache.DBS_MODIFIED_TTL", new=0.5):
+            with patch("moonshot.cache.list_databases", new=old):
+                for _ in range(5):
+                    self.assertEqual(self._get(), 1)
+
+            # the db was modified, but the remembered time is used until
+            # the TTL expires
+            with patch("moonshot.cache.list_databases", new=modified):
+                self.assertEqual(self._get(), 1)
+                time.sleep(0.5)
+                self.assertIsNone(self._get())
+
+        self.assertEqual(old.call_count, 1)
+        self.assertEqual(modified.call_count, 1)
+
+        # different kwargs are remembered separately
+        with patch("moonshot.cache.DBS_MODIFIED_TTL", new=60):
+            with patch("moonshot.cache.list_databases", new=old):
+                self.assertIsNone(self._get())
+                self.assertEqual(
+                    Cache.get("a", prefix="foo", unless_dbs_modified={"services": ["history"], "codes": ["other-db"]}),
+                    1)
+        self.assertEqual(old.call_count, 2)
+
+    def test_shared_memo(self):
+        """
+        Tests that db last modified times are shared with other processes
+        through a file if enabled.
+        """
+        mock_list_databases = make_mock_list_databases(pd.Timestamp("2015-01-01"))
+
+        with patch("moonshot.cache.DBS_MODIFIED_TTL", new=60):
+            with patch("moonshot.cache.DBS_MODIFIED_SHARED", new=True):
+                with patch("moonshot.cache.list_databases", new=mock_list_databases):
+                    self.assertEqual(self._get(), 1)
+                    # simulate another process
+                    Cache._dbs_last_modified.clear()
+                    self.assertEqual(self._get(), 1)
+
+                with patch("moonshot.cache.DBS_MODIFIED_SHARED", new=False):
+                    with patch("moonshot.cache.list_databases", new=mock_list_databases):
+                        Cache._dbs_last_modified.clear()
+                        self.assertEqual(self._get(), 1)
+
+        self.assertEqual(mock_list_databases.call_count, 2)
@@ -0,0 +1,218 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from collections import Counter
+from moonshot.cache import Cache
+from ._helpers import make_prices
+
+class CacheEvictionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+            patch.object(Cache, "_hits", new=Counter()),
+            patch.object(Cache, "_misses", new=Counter()),
+            patch.object(Cache, "_evictions", new=Counter()),
+            patch.object(Cache, "_evicted_bytes", new=Counter()),
+            patch.object(Cache, "_memory_hits", new=Counter()),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _set_times(self, key, prefix, accessed, modified):
+        """
+        Backdates the access and modification times of a cached file.
+        """
+        filepath = Cache._get_filepath(key, prefix=prefix)
+        now = time.time()
+        os.utime(filepath, (now - accessed, now - modified))
+        return filepath
+
+    def test_stats(self):
+        """
+        Tests that stats reports hits, misses, and entries by prefix.
+        """
+        Cache.get("a", prefix="foo")
+        Cache.set("a", "x" * 1000, prefix="foo")
+        Cache.get("a", prefix="foo")
+        Cache.get("a", prefix="foo")
+        Cache.set("b", "y", prefix="bar")
+
+        stats = Cache.stats()
+        self.assertListEqual(
+            list(stats.columns),
+            ["Hits", "Misses", "MemoryHits", "Entries", "Bytes", "Evictions", "EvictedBytes"])
+        self.assertEqual(stats.index.name, "Prefix")
+        self.assertDictEqual(
+            stats.drop("Bytes", axis=1).to_dict(orient="index"),
+            {
+                "bar": {"Hits": 0, "Misses": 0, "MemoryHits": 0, "Entries": 1, "Evictions": 0, "EvictedBytes": 0},
+                "foo": {"Hits": 2, "Misses": 1, "MemoryHits": 0, "Entries": 1, "Evictions": 0, "EvictedBytes": 0},
+            })
+        self.assertGreater(stats.loc["foo", "Bytes"], 1000)
+
+    def test_get_preserves_modification_time(self):
+        """
+        Tests that a cache hit updates the access time but not the
+        modification time, which is used to check expiration.
+        """
+        Cache.set("a", 1, prefix="foo")
+        filepath = self._set_times("a", "foo", accessed=100, modified=100)
+        mtime = os.stat(filepath).st_mtime
+
+        self.assertEqual(Cache.get("a", prefix="foo"), 1)
+        stat = os.stat(filepath)
+        self.assertEqual(stat.st_mtime, mtime)
+        self.assertGreater(stat.st_atime, mtime + 50)
+
+    def test_prune_max_age(self):
+        """
+        Tests that prune evicts objects cached longer ago than max_age.
+        """
+        Cache.set("old", 1, prefix="foo")
+        Cache.set("new", 2, prefix="foo")
+        self._set_times("old", "foo", accessed=0, modified=7200)
+
+        evicted = Cache.prune(max_age="1H")
+        self.assertListEqual(
+            list(evicted.columns), ["Path", "Prefix", "Bytes", "LastAccessed", "Reason"])
+        self.assertListEqual(
+            evicted.Path.tolist(), [Cache._get_filepath("old", prefix="foo")])
+        self.assertListEqual(evicted.Reason.tolist(), ["max_age"])
+
+        self.assertIsNone(Cache.get("old", prefix="foo"))
+        self.assertEqual(Cache.get("new", prefix="foo"), 2)
+        self.assertEqual(Cache.stats().loc["foo", "Evictions"], 1)
+
+    def test_prune_max_bytes_evicts_least_recently_used(self):
+        """
+        Tests that prune evicts the least recently accessed objects until
+        the cache is within max_bytes.
+        """
+        for key in ("a", "b", "c"):
+            Cache.set(key, "x" * 1000, prefix="foo")
+        self._set_times("a", "foo", accessed=10, modified=300)
+        self._set_times("b", "foo", accessed=300, modified=300)
+        self._set_times("c", "foo", accessed=200, modified=200)
+        entry_size = os.path.getsize(Cache._get_filepath("a", prefix="foo"))
+
+        evicted = Cache.prune(max_bytes=entry_size)
+        self.assertListEqual(
+            evicted.Path.tolist(),
+            [Cache._get_filepath("b", prefix="foo"), Cache._get_filepath("c", prefix="foo")])
+        self.assertListEqual(evicted.Reason.tolist(), ["max_bytes", "max_bytes"])
+        self.assertIsNotNone(Cache.get("a", prefix="foo"))
+
+        # already within limits
+        self.assertTrue(Cache.prune(max_bytes=entry_size).empty)
+
+    def test_set_enforces_limits(self):
+        """
+        Tests that caching an object prunes the cache directory when limits
+        are configured, without evicting the newly cached object.
+        """
+        Cache.set("a", "x" * 1000, prefix="foo")
+        self._set_times("a", "foo", accessed=100, modified=100)
+
+        with patch("moonshot.cache.MAX_BYTES", new="1"):
+            Cache.set("b", "x" * 1000, prefix="foo")
+
+        self.assertFalse(os.path.exists(Cache._get_filepath("a", prefix="foo")))
+        self.assertTrue(os.path.exists(Cache._get_filepath("b", prefix="foo")))
+
+    def test_prune_columnar_prices(self):
+        """
+        Tests that columnar price caches, which are directories, are counted
+        and evicted.
+        """
+        kwargs = dict(codes=["test-db"], fields=None)
+        Cache.set_prices(kwargs, make_prices(), format="mmap")
+        dirpath = Cache._get_prices_dirpath(kwargs, format="mmap")
+        self.assertIsNotNone(Cache.get_prices(kwargs, format="mmap"))
+
+        stats = Cache.stats()
+        self.assertEqual(stats.loc["_history", "Hits"], 1)
+        self.assertEqual(stats.loc["_history", "Entries"], 1)
+
+        evicted = Cache.prune(max_bytes=0)
+        self.assertListEqual(evicted.Path.tolist(), [dirpath])
+        self.assertFalse(os.path.exists(dirpath))
+        self.assertIsNone(Cache.get_prices(kwargs, format="mmap"))
+
+    def test_prune_stale_tmp_paths(self):
+        """
+        Tests that prune removes temporary files and directories left behind
+        by interrupted writes, but not recent ones or lock files.
+        """
+        filepath = Cache._get_filepath("foo", prefix="bar")
+        stale_filepath = Cache._get_tmp_path(filepath)
+        stale_dirpath = Cache._get_tmp_path(filepath, suffix=".old")
+        recent_filepath = Cache._get_tmp_path(filepath)
+        open(stale_filepath, "w").close()
+        os.makedirs(stale_dirpath)
+        open(os.path.join(stale_dirpath, "_meta.pkl"), "w").close()
+        open(recent_filepath, "w").close()
+        an_hour_ago = time.time() - 3601
+        for path in (stale_filepath, stale_dirpath):
+            os.utime(path, (an_hour_ago, an_hour_ago))
+
+        with Cache.lock("foo", prefix="bar"):
+            pass
+        lockpath = Cache._get_lockpath("foo", prefix="bar")
+
+        evicted = Cache.prune(max_bytes=0)
+        self.assertTrue(evicted.empty)
+        self.assertFalse(os.path.exists(stale_filepath))
+        self.assertFalse(os.path.exists(stale_dirpath))
+        self.assertTrue(os.path.exists(recent_filepath))
+        self.assertTrue(os.path.exists(lockpath))
+
+    def test_prune_catalogs(self):
+        """
+        Tests that prune removes the catalog entries of evicted prices, and
+        catalogs with no remaining entries.
+        """
+        kwargs1 = dict(codes=["test-db"], start_date="2018-05-01", end_date="2018-05-02", fields=None)
+        kwargs2 = dict(kwargs1, start_date="2018-05-03", end_date="2018-05-04")
+        with patch("moonshot.cache.HISTORY_REUSE", new="slice"):
+            Cache.set_prices(kwargs1, make_prices(), format="mmap")
+            Cache.set_prices(kwargs2, make_prices(), format="mmap")
+        catalog_filepath = Cache._get_catalog_filepath(kwargs1)
+        dirpath1 = Cache._get_prices_dirpath(kwargs1, format="mmap")
+        dirpath2 = Cache._get_prices_dirpath(kwargs2, format="mmap")
+
+        Cache.prune(max_bytes=Cache._get_entry_bytes(dirpath2), exclude=[dirpath2])
+        self.assertFalse(os.path.exists(dirpath1))
+        with open(catalog_filepath) as f:
+            self.assertListEqual(
+                [entry["path"] for entry in json.load(f)], [os.path.basename(dirpath2)])
+
+        Cache.prune(max_bytes=0)
+        self.assertFalse(os.path.exists(catalog_filepath))
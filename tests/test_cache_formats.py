@@ -0,0 +1,156 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+import numpy as np
+from moonshot import Moonshot
+from moonshot.cache import Cache
+from ._helpers import make_prices, mock_download_master_file
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+class PricesCacheFormatMixin(object):
+
+    FORMAT = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patcher = patch("moonshot.cache.TMP_DIR", new=self.tmpdir)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_roundtrip(self):
+        """
+        Tests that cached prices are returned unchanged.
+        """
+        for intraday in (False, True):
+            prices = make_prices(intraday=intraday)
+            kwargs = dict(codes=["test-db"], fields=None, intraday=intraday)
+            Cache.set_prices(kwargs, prices, format=self.FORMAT)
+            cached_prices = Cache.get_prices(kwargs, format=self.FORMAT)
+            pd.testing.assert_frame_equal(cached_prices, prices)
+
+    def test_load_only_requested_fields(self):
+        """
+        Tests that a cached entry serves any subset of its fields, but not
+        fields it doesn't contain.
+        """
+        prices = make_prices()
+        Cache.set_prices(
+            dict(codes=["test-db"], fields=["Close","Open","Volume"]), prices, format=self.FORMAT)
+
+        cached_prices = Cache.get_prices(
+            dict(codes=["test-db"], fields=["Volume", "Close"]), format=self.FORMAT)
+        pd.testing.assert_frame_equal(cached_prices, prices.loc[["Close", "Volume"]])
+
+        cached_prices = Cache.get_prices(
+            dict(codes=["test-db"], fields="Open"), format=self.FORMAT)
+        pd.testing.assert_frame_equal(cached_prices, prices.loc[["Open"]])
+
+        self.assertIsNone(Cache.get_prices(
+            dict(codes=["test-db"], fields=["Close", "Wap"]), format=self.FORMAT))
+
+        self.assertIsNone(Cache.get_prices(
+            dict(codes=["other-db"], fields=["Close"]), format=self.FORMAT))
+
+    def test_subset_of_fields_does_not_serve_all_fields(self):
+        """
+        Tests that an entry cached for a subset of fields doesn't serve a
+        request for all fields, but an entry cached for all fields does.
+        """
+        prices = make_prices()
+        Cache.set_prices(
+            dict(codes=["test-db"], fields=["Close"]), prices.loc[["Close"]], format=self.FORMAT)
+
+        self.assertIsNone(Cache.get_prices(
+            dict(codes=["test-db"], fields=None), format=self.FORMAT))
+
+        Cache.set_prices(dict(codes=["test-db"], fields=None), prices, format=self.FORMAT)
+
+        cached_prices = Cache.get_prices(dict(codes=["test-db"], fields=None), format=self.FORMAT)
+        pd.testing.assert_frame_equal(cached_prices, prices)
+
+    def test_backtest_uses_cache(self):
+        """
+        Tests that a backtest fills and then uses the cache.
+        """
+        class BuyBelow10(Moonshot):
+
+            DB_FIELDS = ["Close"]
+
+            def prices_to_signals(self, prices):
+                signals = prices.loc["Close"] < 10
+                return signals.astype(int)
+
+        def mock_get_prices(*args, **kwargs):
+            return make_prices().loc[["Close"]]
+
+        with patch("moonshot.cache.PRICES_CACHE_FORMAT", new=self.FORMAT):
+            with patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file):
+                with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+                    results = BuyBelow10().backtest(end_date="2018-05-02", no_cache=True)
+
+                with patch("moonshot.strategies.base.get_prices", side_effect=AssertionError("cache not used")):
+                    cached_results = BuyBelow10().backtest(end_date="2018-05-02")
+
+        pd.testing.assert_frame_equal(results, cached_results)
+
+    def test_pickle_non_columnar_prices(self):
+        """
+        Tests that prices with mixed dtypes are pickled instead.
+        """
+        prices = make_prices().astype({"FI12345": object})
+        kwargs = dict(codes=["test-db"], fields=None)
+        Cache.set_prices(kwargs, prices, format=self.FORMAT)
+        self.assertIsNone(Cache.get_prices(kwargs, format=self.FORMAT))
+        pd.testing.assert_frame_equal(Cache.get_prices(kwargs, format="pickle"), prices)
+
+@unittest.skipIf(pyarrow is None, "pyarrow not installed")
+class FeatherPricesCacheTestCase(PricesCacheFormatMixin, unittest.TestCase):
+
+    FORMAT = "feather"
+
+class MmapPricesCacheTestCase(PricesCacheFormatMixin, unittest.TestCase):
+
+    FORMAT = "mmap"
+
+    def test_prices_are_memory_mapped(self):
+        """
+        Tests that the loaded prices are a read-only view of the cached
+        array when all fields are requested, and a private copy otherwise.
+        """
+        prices = make_prices()
+        Cache.set_prices(dict(codes=["test-db"], fields=None), prices, format="mmap")
+
+        cached_prices = Cache.get_prices(dict(codes=["test-db"], fields=None), format="mmap")
+        self.assertFalse(cached_prices.values.flags.writeable)
+        base = cached_prices.values
+        while base is not None and not isinstance(base, np.memmap):
+            base = base.base
+        self.assertIsInstance(base, np.memmap)
+
+        cached_prices = Cache.get_prices(dict(codes=["test-db"], fields=["Close"]), format="mmap")
+        self.assertTrue(cached_prices.values.flags.writeable)
+        pd.testing.assert_frame_equal(cached_prices, prices.loc[["Close"]])
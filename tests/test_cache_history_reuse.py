@@ -0,0 +1,244 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+import numpy as np
+from moonshot import Moonshot
+from moonshot.cache import Cache
+from ._helpers import mock_download_master_file
+
+def make_prices(start_date, end_date, intraday=False):
+    """
+    Returns prices whose values are a function of the date. FI34567 has no
+    prices before 2018-05-08.
+    """
+    dt_idx = pd.date_range(start_date, end_date, name="Date")
+    if intraday:
+        idx = pd.MultiIndex.from_product(
+            [["Close", "Volume"], dt_idx, ["09:30:00", "10:00:00"]], names=["Field", "Date", "Time"])
+    else:
+        idx = pd.MultiIndex.from_product([["Close", "Volume"], dt_idx], names=["Field", "Date"])
+    dates = idx.get_level_values("Date")
+    day_numbers = (dates - pd.Timestamp("2018-05-01")).days
+    prices = pd.DataFrame(
+        {
+            "FI12345": day_numbers,
+            "FI23456": day_numbers + 1,
+            "FI34567": np.where(dates >= pd.Timestamp("2018-05-08"), day_numbers + 2, np.nan),
+        },
+        index=idx).astype(float)
+    prices.columns.name = "Sid"
+    return prices
+
+def make_kwargs(start_date, end_date, fields=None):
+    return dict(codes=["test-db"], start_date=start_date, end_date=end_date, fields=fields)
+
+class HistoryReuseMixin(object):
+
+    FORMAT = None
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+            patch("moonshot.cache.HISTORY_REUSE", new="slice"),
+            patch("moonshot.cache.PRICES_CACHE_FORMAT", new=self.FORMAT),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _list_entries(self):
+        return sorted(entry["path"] for entry in Cache._list_entries())
+
+    def test_slice_contained_date_range(self):
+        """
+        Tests that a date range contained in a cached date range is served by
+        slicing the cached prices, dropping sids without prices in the range.
+        """
+        for intraday in (False, True):
+            shutil.rmtree(self.tmpdir)
+            os.mkdir(self.tmpdir)
+
+            Cache.set_prices(
+                make_kwargs("2018-05-01", "2018-05-10"),
+                make_prices("2018-05-01", "2018-05-10", intraday=intraday))
+
+            prices = Cache.get_prices(make_kwargs("2018-05-03", "2018-05-06"))
+            expected_prices = make_prices("2018-05-03", "2018-05-06", intraday=intraday)
+            pd.testing.assert_frame_equal(prices, expected_prices.drop("FI34567", axis=1))
+
+            prices = Cache.get_prices(make_kwargs("2018-05-07", "2018-05-10"))
+            pd.testing.assert_frame_equal(
+                prices, make_prices("2018-05-07", "2018-05-10", intraday=intraday))
+
+            prices = Cache.get_prices(make_kwargs("2018-05-01", "2018-05-10"))
+            pd.testing.assert_frame_equal(
+                prices, make_prices("2018-05-01", "2018-05-10", intraday=intraday))
+
+            stats = Cache.stats()
+            self.assertEqual(stats.loc["_history", "Entries"], 1)
+
+    def test_uncontained_date_ranges(self):
+        """
+        Tests that date ranges not contained in a cached date range are not
+        served.
+        """
+        Cache.set_prices(
+            make_kwargs("2018-05-02", "2018-05-10"), make_prices("2018-05-02", "2018-05-10"))
+
+        self.assertIsNone(Cache.get_prices(make_kwargs("2018-05-01", "2018-05-05")))
+        self.assertIsNone(Cache.get_prices(make_kwargs(None, "2018-05-05")))
+        self.assertIsNone(Cache.get_prices(make_kwargs("2018-05-05", "2018-05-11")))
+        self.assertIsNone(Cache.get_prices(make_kwargs("2018-05-05", None)))
+        # other query parameters must match
+        self.assertIsNone(Cache.get_prices(
+            dict(make_kwargs("2018-05-03", "2018-05-05"), codes=["other-db"])))
+
+        self.assertIsNotNone(Cache.get_prices(make_kwargs("2018-05-02", "2018-05-05")))
+
+    def test_open_ended_cached_date_range(self):
+        """
+        Tests that prices cached without an end date serve date ranges ending
+        before the day they were cached.
+        """
+        Cache.set_prices(make_kwargs("2018-05-01", None), make_prices("2018-05-01", "2018-05-10"))
+
+        prices = Cache.get_prices(make_kwargs("2018-05-02", "2018-05-04"))
+        pd.testing.assert_frame_equal(
+            prices, make_prices("2018-05-02", "2018-05-04").drop("FI34567", axis=1))
+
+        today = pd.Timestamp.today().date().isoformat()
+        self.assertIsNone(Cache.get_prices(make_kwargs("2018-05-02", today)))
+        self.assertIsNotNone(Cache.get_prices(make_kwargs("2018-05-02", None)))
+
+    def test_disabled_by_default(self):
+        """
+        Tests that cached date ranges are not reused by default.
+        """
+        with patch("moonshot.cache.HISTORY_REUSE", new="none"):
+            Cache.set_prices(
+                make_kwargs("2018-05-01", "2018-05-10"), make_prices("2018-05-01", "2018-05-10"))
+            self.assertIsNone(Cache.get_prices(make_kwargs("2018-05-03", "2018-05-06")))
+
+    def test_merge_adjacent_date_ranges(self):
+        """
+        Tests that cached prices with overlapping or adjacent date ranges are
+        merged into one entry.
+        """
+        with patch("moonshot.cache.HISTORY_REUSE", new="merge"):
+            Cache.set_prices(
+                make_kwargs("2018-05-01", "2018-05-04"), make_prices("2018-05-01", "2018-05-04"))
+            Cache.set_prices(
+                make_kwargs("2018-05-08", "2018-05-10"), make_prices("2018-05-08", "2018-05-10"))
+            self.assertEqual(len(self._list_entries()), 2)
+
+            # adjacent to the first range, overlaps the second
+            Cache.set_prices(
+                make_kwargs("2018-05-05", "2018-05-09"), make_prices("2018-05-05", "2018-05-09"))
+            self.assertEqual(len(self._list_entries()), 1)
+
+            prices = Cache.get_prices(make_kwargs("2018-05-01", "2018-05-10"))
+            pd.testing.assert_frame_equal(prices, make_prices("2018-05-01", "2018-05-10"))
+
+            prices = Cache.get_prices(make_kwargs("2018-05-03", "2018-05-08"))
+            pd.testing.assert_frame_equal(prices, make_prices("2018-05-03", "2018-05-08"))
+
+            # a gap of more than a day is not merged
+            Cache.set_prices(
+                make_kwargs("2018-05-12", "2018-05-15"), make_prices("2018-05-12", "2018-05-15"))
+            self.assertEqual(len(self._list_entries()), 2)
+
+    def test_backtest_reuses_wider_date_range(self):
+        """
+        Tests that a backtest of a narrower date range than a previous
+        backtest uses the cached prices.
+        """
+        class BuyBelow10(Moonshot):
+
+            DB = "test-db"
+            DB_FIELDS = ["Close", "Volume"]
+
+            def prices_to_signals(self, prices):
+                signals = prices.loc["Close"] < 10
+                return signals.astype(int)
+
+        def mock_get_prices(**kwargs):
+            return make_prices(kwargs["start_date"], kwargs["end_date"])
+
+        with patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file):
+            with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+                BuyBelow10().backtest(start_date="2018-05-01", end_date="2018-05-10")
+
+            with patch("moonshot.strategies.base.get_prices", side_effect=AssertionError("cache not used")):
+                results = BuyBelow10().backtest(start_date="2018-05-03", end_date="2018-05-06")
+
+        self.assertEqual(
+            results.index.get_level_values("Date").min(), pd.Timestamp("2018-05-03"))
+        self.assertEqual(
+            results.index.get_level_values("Date").max(), pd.Timestamp("2018-05-06"))
+
+class PickleHistoryReuseTestCase(HistoryReuseMixin, unittest.TestCase):
+
+    FORMAT = "pickle"
+
+    def test_fields_must_match(self):
+        """
+        Tests that pickled prices only serve requests for the same fields.
+        """
+        Cache.set_prices(
+            make_kwargs("2018-05-01", "2018-05-10", fields=["Close", "Volume"]),
+            make_prices("2018-05-01", "2018-05-10"))
+
+        self.assertIsNone(Cache.get_prices(make_kwargs("2018-05-03", "2018-05-06", fields=["Close"])))
+        self.assertIsNotNone(Cache.get_prices(make_kwargs("2018-05-03", "2018-05-06", fields=["Close", "Volume"])))
+
+class MmapHistoryReuseTestCase(HistoryReuseMixin, unittest.TestCase):
+
+    FORMAT = "mmap"
+
+    def test_subset_of_fields(self):
+        """
+        Tests that columnar prices serve requests for a subset of fields.
+        """
+        Cache.set_prices(
+            make_kwargs("2018-05-01", "2018-05-10", fields=["Close", "Volume"]),
+            make_prices("2018-05-01", "2018-05-10"))
+
+        prices = Cache.get_prices(make_kwargs("2018-05-08", "2018-05-09", fields=["Close"]))
+        pd.testing.assert_frame_equal(
+            prices, make_prices("2018-05-08", "2018-05-09").loc[["Close"]])
+
+    def test_subset_of_fields_does_not_serve_all_fields(self):
+        """
+        Tests that columnar prices cached for a subset of fields don't serve
+        requests for all fields.
+        """
+        Cache.set_prices(
+            make_kwargs("2018-05-01", "2018-05-10", fields=["Close"]),
+            make_prices("2018-05-01", "2018-05-10").loc[["Close"]])
+
+        self.assertIsNone(Cache.get_prices(make_kwargs("2018-05-03", "2018-05-06", fields=None)))
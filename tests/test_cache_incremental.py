@@ -0,0 +1,160 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from moonshot import Moonshot
+from quantrocket.exceptions import NoHistoricalData
+from ._helpers import mock_download_master_file
+
+def make_prices(start_date, end_date, sids=("FI12345", "FI23456"), intraday=False):
+    """
+    Returns prices whose values are a function of the date, so that prices
+    queried for overlapping periods agree.
+    """
+    dt_idx = pd.date_range(start_date, end_date, name="Date")
+    if intraday:
+        idx = pd.MultiIndex.from_product(
+            [["Close", "Volume"], dt_idx, ["09:30:00", "10:00:00"]], names=["Field", "Date", "Time"])
+    else:
+        idx = pd.MultiIndex.from_product([["Close", "Volume"], dt_idx], names=["Field", "Date"])
+    day_numbers = (idx.get_level_values("Date") - pd.Timestamp("2018-05-01")).days
+    prices = pd.DataFrame(
+        {sid: day_numbers + i for i, sid in enumerate(sids)}, index=idx).astype(float)
+    prices.columns.name = "Sid"
+    return prices
+
+def mock_list_databases(**kwargs):
+    # db was modified after anything was cached
+    return {
+        "postgres": [],
+        "sqlite": [{'last_modified': (pd.Timestamp.now() + pd.Timedelta(seconds=60)).isoformat(),
+                    'name': 'quantrocket.history.test-db.sqlite',
+                    'path': '/var/lib/quantrocket/quantrocket.history.test-db.sqlite',
+                    'size_in_mb': 2.1}]}
+
+class BuyBelow10(Moonshot):
+
+    DB = "test-db"
+    DB_FIELDS = ["Close", "Volume"]
+
+    def prices_to_signals(self, prices):
+        signals = prices.loc["Close"] < 10
+        return signals.astype(int)
+
+class IncrementalHistoryTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+            patch("moonshot.cache.INCREMENTAL_HISTORY", new=True),
+            patch("moonshot.cache.list_databases", new=mock_list_databases),
+            patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _get_prices(self, strategy, **mock_kwargs):
+        """
+        Runs get_prices with the db returning data through the given end
+        date, and returns the prices and the queried start dates.
+        """
+        end_date = mock_kwargs.pop("end_date")
+        queried_start_dates = []
+
+        def mock_get_prices(**kwargs):
+            queried_start_dates.append(kwargs["start_date"])
+            return make_prices(kwargs["start_date"] or "2018-05-01", end_date, **mock_kwargs)
+
+        strategy.is_backtest = True
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            prices = strategy.get_prices(start_date=None)
+
+        return prices, queried_start_dates
+
+    def test_append_new_dates(self):
+        """
+        Tests that only the dates since the last cached date are queried,
+        and that the last cached date is replaced.
+        """
+        for intraday in (False, True):
+            # start with an empty cache
+            shutil.rmtree(self.tmpdir)
+            os.mkdir(self.tmpdir)
+
+            prices, queried_start_dates = self._get_prices(
+                BuyBelow10(), end_date="2018-05-10", intraday=intraday)
+            self.assertListEqual(queried_start_dates, [None])
+
+            prices, queried_start_dates = self._get_prices(
+                BuyBelow10(), end_date="2018-05-15", intraday=intraday)
+            self.assertListEqual(queried_start_dates, ["2018-05-10"])
+            pd.testing.assert_frame_equal(
+                prices, make_prices("2018-05-01", "2018-05-15", intraday=intraday))
+
+            # the appended prices were cached
+            prices, queried_start_dates = self._get_prices(
+                BuyBelow10(), end_date="2018-05-16", intraday=intraday)
+            self.assertListEqual(queried_start_dates, ["2018-05-15"])
+            pd.testing.assert_frame_equal(
+                prices, make_prices("2018-05-01", "2018-05-16", intraday=intraday))
+
+    def test_new_sids(self):
+        """
+        Tests that sids appearing in the new dates are added.
+        """
+        self._get_prices(BuyBelow10(), end_date="2018-05-10")
+        prices, _ = self._get_prices(
+            BuyBelow10(), end_date="2018-05-15", sids=("FI12345", "FI23456", "FI34567"))
+
+        self.assertListEqual(list(prices.columns), ["FI12345", "FI23456", "FI34567"])
+        self.assertTrue(prices.loc["Close"].loc[:"2018-05-09", "FI34567"].isnull().all())
+        self.assertFalse(prices.loc["Close"].loc["2018-05-10":, "FI34567"].isnull().any())
+
+    def test_no_new_data(self):
+        """
+        Tests that the cached prices are used if there is no new data.
+        """
+        self._get_prices(BuyBelow10(), end_date="2018-05-10")
+
+        strategy = BuyBelow10()
+        strategy.is_backtest = True
+        with patch("moonshot.strategies.base.get_prices", side_effect=NoHistoricalData("no history matches the query parameters")):
+            prices = strategy.get_prices(start_date=None)
+
+        pd.testing.assert_frame_equal(prices, make_prices("2018-05-01", "2018-05-10"))
+
+    def test_disabled_by_default(self):
+        """
+        Tests that the entire history is queried again if incremental
+        history is disabled, or if an end date is given.
+        """
+        self._get_prices(BuyBelow10(), end_date="2018-05-10")
+
+        with patch("moonshot.cache.INCREMENTAL_HISTORY", new=False):
+            _, queried_start_dates = self._get_prices(BuyBelow10(), end_date="2018-05-15")
+        self.assertListEqual(queried_start_dates, [None])
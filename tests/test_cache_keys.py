@@ -0,0 +1,115 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import hashlib
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+import numpy as np
+from moonshot.cache import Cache
+from ._helpers import make_prices
+
+class FingerprintTestCase(unittest.TestCase):
+
+    def test_fingerprint_is_stable(self):
+        """
+        Tests that copies of an object have the same fingerprint.
+        """
+        for intraday in (False, True):
+            prices = make_prices(intraday=intraday)
+            for obj in (prices, prices.index, prices.columns, prices.iloc[:, 0], prices.values):
+                self.assertEqual(Cache.fingerprint(obj), Cache.fingerprint(obj.copy()))
+
+    def test_fingerprint_changes(self):
+        """
+        Tests that the fingerprint changes when values, names, dtypes or
+        timezones change.
+        """
+        prices = make_prices()
+        fingerprint = Cache.fingerprint(prices)
+
+        changed_values = prices.copy()
+        changed_values.iloc[0, 0] = 99
+        changed_names = prices.rename(columns={"FI12345": "FI99999"})
+        changed_index_names = prices.copy()
+        changed_index_names.index.set_names("Dt", level="Date", inplace=True)
+        changed_dtypes = prices.astype(np.float32)
+        changed_dates = prices.copy()
+        changed_dates.index = changed_dates.index.set_levels(
+            changed_dates.index.levels[1] + pd.Timedelta(days=1), level="Date")
+        changed_tz = prices.copy()
+        changed_tz.index = changed_tz.index.set_levels(
+            changed_tz.index.levels[1].tz_localize("UTC"), level="Date")
+
+        fingerprints = [Cache.fingerprint(obj) for obj in (
+            changed_values, changed_names, changed_index_names, changed_dtypes,
+            changed_dates, changed_tz)]
+        self.assertNotIn(fingerprint, fingerprints)
+        self.assertEqual(len(set(fingerprints)), len(fingerprints))
+
+        self.assertNotEqual(
+            Cache.fingerprint(pd.Index(["a", "b"])),
+            Cache.fingerprint(pd.Index(["a", "c"])))
+
+    def test_fingerprint_mixed_dtypes(self):
+        """
+        Tests fingerprinting a DataFrame with mixed dtypes.
+        """
+        securities = pd.DataFrame({"Symbol": ["ABC", "DEF"], "Multiplier": [1.0, None]})
+        self.assertEqual(Cache.fingerprint(securities), Cache.fingerprint(securities.copy()))
+        self.assertNotEqual(
+            Cache.fingerprint(securities),
+            Cache.fingerprint(securities.assign(Symbol=["ABC", "XYZ"])))
+
+    def test_plain_keys_unchanged(self):
+        """
+        Tests that keys not containing pandas objects are hashed as before.
+        """
+        key = dict(codes=["test-db"], fields=["Close"], sids=("FI1", "FI2"))
+        digest = hashlib.sha224(pickle.dumps(key)).hexdigest()
+        self.assertTrue(Cache._get_filepath(key, prefix="foo").endswith(
+            "moonshot_foo_{0}.pkl".format(digest)))
+
+class FingerprintKeysTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patcher = patch("moonshot.cache.TMP_DIR", new=self.tmpdir)
+        self.patcher.start()
+
+    def tearDown(self):
+        self.patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_pandas_objects_in_keys_are_fingerprinted(self):
+        """
+        Tests that pandas objects in keys are fingerprinted rather than
+        pickled, and that an equal key hits the cache.
+        """
+        prices = make_prices()
+        Cache.set(["my-strategy", prices.index, {"columns": prices.columns}], 1, prefix="foo")
+
+        with patch.object(Cache, "fingerprint", wraps=Cache.fingerprint) as mock_fingerprint:
+            self.assertEqual(
+                Cache.get(["my-strategy", prices.index.copy(), {"columns": prices.columns.copy()}], prefix="foo"),
+                1)
+        self.assertEqual(mock_fingerprint.call_count, 2)
+
+        self.assertIsNone(
+            Cache.get(["my-strategy", prices.index, {"columns": prices.columns[:1]}], prefix="foo"))
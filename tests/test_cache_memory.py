@@ -0,0 +1,190 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+from collections import Counter, OrderedDict
+import pandas as pd
+import numpy as np
+from moonshot.cache import Cache
+from ._helpers import make_prices
+
+class MemoryCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=10**6),
+            patch.object(Cache, "_memory", new=OrderedDict()),
+            patch.object(Cache, "_hits", new=Counter()),
+            patch.object(Cache, "_misses", new=Counter()),
+            patch.object(Cache, "_memory_hits", new=Counter()),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_get_returns_object_from_memory(self):
+        """
+        Tests that repeat lookups return the object without unpickling it
+        again.
+        """
+        prices = make_prices()
+        Cache.set("a", prices, prefix="foo")
+
+        with patch("moonshot.cache.pickle.load", side_effect=AssertionError("unpickled")):
+            pd.testing.assert_frame_equal(Cache.get("a", prefix="foo"), prices)
+            pd.testing.assert_frame_equal(Cache.get("a", prefix="foo"), prices)
+
+        stats = Cache.stats()
+        self.assertEqual(stats.loc["foo", "Hits"], 2)
+        self.assertEqual(stats.loc["foo", "MemoryHits"], 2)
+
+        # after clearing memory, the object is loaded from disk again
+        Cache.clear_memory()
+        cached_prices = Cache.get("a", prefix="foo")
+        self.assertIsNot(cached_prices, prices)
+        pd.testing.assert_frame_equal(cached_prices, prices)
+        self.assertEqual(Cache.stats().loc["foo", "MemoryHits"], 2)
+
+    def test_modifying_object_does_not_modify_cache(self):
+        """
+        Tests that modifying an object after caching it, or after getting it
+        from memory, doesn't modify the object in memory.
+        """
+        prices = make_prices()
+        Cache.set("a", prices, prefix="foo")
+        prices.iloc[0, 0] = -1
+        prices["FI99999"] = 1.0
+
+        cached_prices = Cache.get("a", prefix="foo")
+        pd.testing.assert_frame_equal(cached_prices, make_prices())
+        cached_prices.iloc[0, 0] = -1
+        cached_prices.loc[:, "FI12345"] = 0.0
+
+        pd.testing.assert_frame_equal(Cache.get("a", prefix="foo"), make_prices())
+
+        securities = {"FI12345": {"Symbol": "ABC"}}
+        Cache.set("b", securities, prefix="foo")
+        securities["FI12345"]["Symbol"] = "XYZ"
+        cached_securities = Cache.get("b", prefix="foo")
+        cached_securities["FI12345"]["Symbol"] = "XYZ"
+        self.assertDictEqual(Cache.get("b", prefix="foo"), {"FI12345": {"Symbol": "ABC"}})
+        self.assertEqual(Cache.stats().loc["foo", "MemoryHits"], 4)
+
+    def test_memory_mapped_prices_in_memory_are_shared(self):
+        """
+        Tests that read-only memory-mapped prices are shallowly copied out
+        of memory, sharing their values.
+        """
+        prices = make_prices()
+        kwargs = dict(codes=["test-db"], fields=None)
+        Cache.set_prices(kwargs, prices, format="mmap")
+
+        cached_prices = Cache.get_prices(kwargs, format="mmap")
+        other_cached_prices = Cache.get_prices(kwargs, format="mmap")
+        self.assertEqual(Cache.stats().loc["_history", "MemoryHits"], 1)
+        self.assertIsNot(other_cached_prices, cached_prices)
+        self.assertTrue(np.shares_memory(other_cached_prices.values, cached_prices.values))
+        with self.assertRaises(ValueError):
+            other_cached_prices.iloc[0, 0] = -1
+
+        other_cached_prices["FI99999"] = 1.0
+        pd.testing.assert_frame_equal(Cache.get_prices(kwargs, format="mmap"), prices)
+
+    def test_memory_tier_disabled_by_default(self):
+        """
+        Tests that nothing is kept in memory when the budget is 0.
+        """
+        with patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0):
+            Cache.set("a", make_prices(), prefix="foo")
+            Cache.get("a", prefix="foo")
+
+        self.assertEqual(len(Cache._memory), 0)
+
+    def test_modified_file_is_reloaded(self):
+        """
+        Tests that an object in memory is not returned if the cached file
+        was rewritten (for example by another process) or removed.
+        """
+        Cache.set("a", 1, prefix="foo")
+        filepath = Cache._get_filepath("a", prefix="foo")
+
+        with open(filepath, "wb") as f:
+            pickle.dump(2, f)
+        stat = os.stat(filepath)
+        os.utime(filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        self.assertEqual(Cache.get("a", prefix="foo"), 2)
+
+        os.remove(filepath)
+        self.assertIsNone(Cache.get("a", prefix="foo"))
+
+    def test_expired_object_is_not_returned_from_memory(self):
+        """
+        Tests that expiration checks still apply to objects in memory.
+        """
+        Cache.set("a", 1, prefix="foo")
+
+        with patch("moonshot.cache.Cache._is_expired", return_value=True):
+            self.assertIsNone(Cache.get("a", prefix="foo", unless_file_modified=__file__))
+
+    def test_evicts_least_recently_used(self):
+        """
+        Tests that the least recently used objects are evicted to stay
+        within the memory budget, and that objects larger than the budget
+        are not kept in memory.
+        """
+        prices = make_prices()
+        nbytes = prices.memory_usage(deep=True).sum()
+
+        with patch("moonshot.cache.MEMORY_CACHE_BYTES", new=nbytes * 2):
+            Cache.set("a", prices, prefix="foo")
+            Cache.set("b", prices.copy(), prefix="foo")
+            # access "a" so that "b" is least recently used
+            Cache.get("a", prefix="foo")
+            Cache.set("c", prices.copy(), prefix="foo")
+
+            self.assertListEqual(
+                list(Cache._memory.keys()),
+                [Cache._get_filepath("a", prefix="foo"), Cache._get_filepath("c", prefix="foo")])
+
+            Cache.set("big", pd.DataFrame(np.zeros((nbytes, 1))), prefix="foo")
+            self.assertNotIn(Cache._get_filepath("big", prefix="foo"), Cache._memory)
+
+    def test_columnar_prices_in_memory(self):
+        """
+        Tests that columnar prices are kept in memory per set of fields.
+        """
+        prices = make_prices()
+        Cache.set_prices(dict(codes=["test-db"], fields=None), prices, format="mmap")
+
+        cached_prices = Cache.get_prices(dict(codes=["test-db"], fields=["Close"]), format="mmap")
+        pd.testing.assert_frame_equal(
+            Cache.get_prices(dict(codes=["test-db"], fields=["Close"]), format="mmap"),
+            cached_prices)
+        pd.testing.assert_frame_equal(
+            Cache.get_prices(dict(codes=["test-db"], fields=None), format="mmap"), prices)
+        self.assertEqual(Cache.stats().loc["_history", "MemoryHits"], 1)
@@ -724,6 +724,125 @@ class MoonshotCommissionsTestCase(unittest.TestCase):
              }
         )
 
+    def test_cost_inputs_computed_once_per_backtest(self):
+        """
+        Tests that the contract values and turnover are computed once per
+        backtest and shared by limit_position_sizes, the commissions, the
+        slippage and the results.
+        """
+        class TestCommission(PercentageCommission):
+            BROKER_COMMISSION_RATE = 0.0001 # 1 BPS
+            EXCHANGE_FEE_RATE = 0
+            MIN_COMMISSION = 500
+
+        class BuyBelow10ShortAbove10(Moonshot):
+            """
+            A basic test strategy that buys below 10 and shorts above 10.
+            """
+            COMMISSION_CLASS = TestCommission
+            SLIPPAGE_BPS = 10
+
+            def prices_to_signals(self, prices):
+                long_signals = prices.loc["Close"] <= 10
+                short_signals = prices.loc["Close"] > 10
+                signals = long_signals.astype(int).where(long_signals, -short_signals.astype(int))
+                return signals
+
+            def limit_position_sizes(self, prices):
+                max_quantities = prices.loc["Volume"]
+                return max_quantities, max_quantities
+
+        def mock_get_prices(*args, **kwargs):
+
+            dt_idx = pd.DatetimeIndex(["2018-05-01","2018-05-02","2018-05-03", "2018-05-04"])
+            fields = ["Close","Volume"]
+            idx = pd.MultiIndex.from_product([fields, dt_idx], names=["Field", "Date"])
+
+            prices = pd.DataFrame(
+                {
+                    "FI12345": [
+                        # Close
+                        9,
+                        11,
+                        10.50,
+                        9.99,
+                        # Volume
+                        5000,
+                        16000,
+                        8800,
+                        9900
+                    ],
+                    "FI23456": [
+                        # Close
+                        9.89,
+                        11,
+                        8.50,
+                        10.50,
+                        # Volume
+                        15000,
+                        14000,
+                        28800,
+                        17000
+
+                    ],
+                 },
+                index=idx
+            )
+
+            return prices
+
+        def mock_download_master_file(f, *args, **kwargs):
+
+            master_fields = ["Timezone", "Symbol", "SecType", "Currency", "PriceMagnifier", "Multiplier"]
+            securities = pd.DataFrame(
+                {
+                    "FI12345": [
+                        "America/New_York",
+                        "ABC",
+                        "STK",
+                        "USD",
+                        None,
+                        None
+                    ],
+                    "FI23456": [
+                        "America/New_York",
+                        "DEF",
+                        "STK",
+                        "USD",
+                        None,
+                        None,
+                    ]
+                },
+                index=master_fields
+            )
+            securities.columns.name = "Sid"
+            securities.T.to_csv(f, index=True, header=True)
+            f.seek(0)
+
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            with patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file):
+                with patch.object(
+                    Moonshot, "_calculate_contract_values", autospec=True,
+                    side_effect=Moonshot._calculate_contract_values) as mock_calculate_contract_values:
+                    with patch.object(
+                        Moonshot, "_positions_to_turnover", autospec=True,
+                        side_effect=Moonshot._positions_to_turnover) as mock_positions_to_turnover:
+
+                        strategy = BuyBelow10ShortAbove10()
+                        results = strategy.backtest(nlv={"USD":50000})
+
+        self.assertEqual(mock_calculate_contract_values.call_count, 1)
+        self.assertEqual(mock_positions_to_turnover.call_count, 1)
+        # the cache is cleared after the backtest
+        self.assertIsNone(strategy._cost_inputs)
+
+        # the min commission applies to the opening trades
+        commissions = results.loc["Commission"].round(7)
+        self.assertDictEqual(
+            commissions.loc["2018-05-02"].to_dict(),
+            {"FI12345": 0.01, "FI23456": 0.01}
+        )
+
     def test_commissions_by_exchange_sectype_currency_complain_if_missing(self):
         """
         Tests error handling when commissions are specified per sec
@@ -818,6 +937,137 @@ class MoonshotCommissionsTestCase(unittest.TestCase):
             "expected a commission class for each combination of (sectype,exchange,currency) "
             "but none is defined for (FUT,OSE,HKD)"), repr(cm.exception))
 
+    def test_commissions_by_exchange_sectype_currency_only_get_own_sids(self):
+        """
+        Tests that, with commission classes per sec type/exchange/currency,
+        each commission class is only evaluated on the sids of its group.
+        """
+        received_sids = {}
+
+        class TsejTestCommission(PercentageCommission):
+            BROKER_COMMISSION_RATE = 0.0001 # 1 BPS
+
+            @classmethod
+            def get_commissions(cls, contract_values, turnover, nlvs=None):
+                received_sids["TSEJ"] = (list(contract_values.columns), list(turnover.columns))
+                return super(TsejTestCommission, cls).get_commissions(
+                    contract_values, turnover, nlvs=nlvs)
+
+        class OseTestCommission(PercentageCommission):
+            BROKER_COMMISSION_RATE = 0.0002 # 2 BPS
+
+            @classmethod
+            def get_commissions(cls, contract_values, turnover, nlvs=None):
+                received_sids["OSE"] = (list(contract_values.columns), list(turnover.columns))
+                return super(OseTestCommission, cls).get_commissions(
+                    contract_values, turnover, nlvs=nlvs)
+
+        class BuyBelow10ShortAbove10(Moonshot):
+            """
+            A basic test strategy that buys below 10 and shorts above 10.
+            """
+            COMMISSION_CLASS = {
+                ("STK", "TSEJ", "JPY"): TsejTestCommission,
+                ("FUT", "OSE", "JPY"): OseTestCommission,
+                }
+
+            def prices_to_signals(self, prices):
+                long_signals = prices.loc["Close"] <= 10
+                short_signals = prices.loc["Close"] > 10
+                signals = long_signals.astype(int).where(long_signals, -short_signals.astype(int))
+                return signals
+
+        def mock_get_prices(*args, **kwargs):
+
+            dt_idx = pd.DatetimeIndex(["2018-05-01","2018-05-02","2018-05-03", "2018-05-04"])
+            fields = ["Close"]
+            idx = pd.MultiIndex.from_product([fields, dt_idx], names=["Field", "Date"])
+
+            prices = pd.DataFrame(
+                {
+                    "FI12345": [
+                        # Close
+                        9,
+                        11,
+                        10.50,
+                        9.99
+                    ],
+                    "FI23456": [
+                        # Close
+                        9.89,
+                        11,
+                        8.50,
+                        10.50,
+                    ],
+                    "FI34567": [
+                        # Close
+                        9.89,
+                        11,
+                        8.50,
+                        10.50,
+                    ],
+                 },
+                index=idx
+            )
+
+            return prices
+
+        def mock_download_master_file(f, *args, **kwargs):
+
+            master_fields = ["Timezone", "Symbol", "SecType", "PriceMagnifier", "Multiplier", "Currency", "Exchange"]
+            securities = pd.DataFrame(
+                {
+                    "FI12345": [
+                        "Japan",
+                        "1500",
+                        "STK",
+                        1,
+                        1,
+                        "JPY",
+                        "TSEJ"
+                    ],
+                    "FI23456": [
+                        "Japan",
+                        "N225",
+                        "FUT",
+                        None,
+                        None,
+                        "JPY",
+                        "OSE"
+                    ],
+                    "FI34567": [
+                        "Japan",
+                        "1600",
+                        "STK",
+                        1,
+                        1,
+                        "JPY",
+                        "TSEJ"
+                    ]
+                },
+                index=master_fields
+            )
+            securities.columns.name = "Sid"
+            securities.T.to_csv(f, index=True, header=True)
+            f.seek(0)
+
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            with patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file):
+                results = BuyBelow10ShortAbove10().backtest()
+
+        self.assertDictEqual(
+            received_sids,
+            {"TSEJ": (["FI12345", "FI34567"], ["FI12345", "FI34567"]),
+             "OSE": (["FI23456"], ["FI23456"])})
+
+        # the commissions are reassembled in the original column order
+        commissions = results.loc["Commission"]
+        self.assertListEqual(list(commissions.columns), ["FI12345", "FI23456", "FI34567"])
+        # FI23456 and FI34567 have the same turnover but different rates
+        self.assertAlmostEqual(
+            commissions.loc["2018-05-02", "FI23456"],
+            commissions.loc["2018-05-02", "FI34567"] * 2)
+
     def test_apply_commissions_by_exchange_sectype_currency_eod(self):
         """
         Tests that the resulting DataFrames are correct when commissions
@@ -1030,12 +1280,12 @@ class MoonshotCommissionsTestCase(unittest.TestCase):
                 '2018-05-04T00:00:00'],
              "FI12345": ["nan",
                      -0.00005,
-                     -0.022827272727272706, # (10.50 - 11)/11 * 0.5 - 0.0001
-                     0.0242857142857143], # (9.99 - 10.50)/10.50 * -0.5
+                     -0.0228273, # (10.50 - 11)/11 * 0.5 - 0.0001
+                     0.0242857], # (9.99 - 10.50)/10.50 * -0.5
              "FI23456": ["nan",
                      -0.0001,
-                     -0.11383636363636365, # (8.50 - 11)/11 * 0.5
-                     -0.11784705882352944] # (10.50 - 8.50)/8.50 * -0.5
+                     -0.1138364, # (8.50 - 11)/11 * 0.5
+                     -0.1178471] # (10.50 - 8.50)/8.50 * -0.5
              }
         )
     def test_apply_commissions_once_a_day_intraday_no_nlv(self):
@@ -1755,11 +2005,11 @@ class MoonshotCommissionsTestCase(unittest.TestCase):
                 '2018-05-02T00:00:00',
                 '2018-05-03T00:00:00'],
              "FI12345": [0.0,
-                     -0.1317199604743083, # (15.45 - 10.12)/10.12 * -0.25 - 0.00005
+                     -0.13172, # (15.45 - 10.12)/10.12 * -0.25 - 0.00005
                      0.0],
              "FI23456": [0.0,
                      0.0,
-                     -0.020622388059701485] # (14.50 - 13.40)/13.40 * 0.25 - 0.0001
+                     -0.0206224] # (14.50 - 13.40)/13.40 * 0.25 - 0.0001
              }
         )
 
@@ -2637,17 +2887,17 @@ class MoonshotCommissionsTestCase(unittest.TestCase):
                           '12:00:00'],
                  "FI12345": ['nan',
                          -0.00005,
-                         -0.01588947368421052, # (10.12-10.45)/10.45 * 0.5 - 0.0001
-                         -0.2633399209486166, # (15.45-10.12)/10.12 * -0.5
-                         0.21941747572815534,  # (8.67-15.45)/15.45 * -0.5
-                         -0.2094425605536333  # (12.30-8.67)/8.67 * -0.5 - 0.0001
+                         -0.0158895, # (10.12-10.45)/10.45 * 0.5 - 0.0001
+                         -0.2633399, # (15.45-10.12)/10.12 * -0.5
+                         0.2194175,  # (8.67-15.45)/15.45 * -0.5
+                         -0.2094426  # (12.30-8.67)/8.67 * -0.5 - 0.0001
                          ],
                  "FI23456": ['nan',
                          -0.0001,
-                         0.06286427976686093, # (10.50-12.01)/12.01 * -0.5
-                         0.033333333333333326, # (9.80-10.50)/10.50 * -0.5
-                         -0.1838734693877551, # (13.40-9.80)/9.80 * -0.5 - 0.0002
-                         -0.22034925373134331 # (7.50-13.40)/13.40 * 0.5 - 0.0002
+                         0.0628643, # (10.50-12.01)/12.01 * -0.5
+                         0.0333333, # (9.80-10.50)/10.50 * -0.5
+                         -0.1838735, # (13.40-9.80)/9.80 * -0.5 - 0.0002
+                         -0.2203493 # (7.50-13.40)/13.40 * 0.5 - 0.0002
                          ]}
             )
 
@@ -0,0 +1,235 @@
+# Copyright 2019 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import sys
+import shutil
+import tempfile
+import subprocess
+import unittest
+from unittest.mock import patch
+import pandas as pd
+import numpy as np
+from moonshot import MoonshotML
+from moonshot.exceptions import MoonshotError, MoonshotParameterError
+from ._helpers import mock_download_master_file
+
+def mock_get_prices(*args, **kwargs):
+
+    dt_idx = pd.bdate_range("2018-01-01", "2018-06-29", name="Date")
+    idx = pd.MultiIndex.from_product([["Close"], dt_idx], names=["Field", "Date"])
+    prices = pd.DataFrame(
+        {
+            "FI12345": 10 + np.sin(np.arange(len(idx)) / 3),
+            "FI23456": 20 + np.cos(np.arange(len(idx)) / 5),
+        },
+        index=idx)
+    prices.columns.name = "Sid"
+    return prices
+
+class MeanModel(object):
+    """
+    Predicts the mean of the targets it was fit on.
+    """
+    def fit(self, X, y):
+        self.sum_ = y.sum()
+        self.count_ = len(y)
+        return self
+
+    def partial_fit(self, X, y):
+        self.sum_ = getattr(self, "sum_", 0) + y.sum()
+        self.count_ = getattr(self, "count_", 0) + len(y)
+        return self
+
+    def predict(self, X):
+        return np.full(len(X), self.sum_ / self.count_)
+
+class MeanTargetML(MoonshotML):
+
+    CODE = "mean-target-ml"
+    DB = "test-db"
+    LOOKBACK_WINDOW = 0
+
+    def prices_to_features(self, prices):
+        closes = prices.loc["Close"]
+        features = {}
+        features["close"] = closes
+        # the target of each date is its row number
+        targets = pd.DataFrame(
+            np.arange(len(closes))[:, np.newaxis].repeat(len(closes.columns), axis=1),
+            index=closes.index, columns=closes.columns)
+        targets.iloc[-1] = np.nan
+        return features, targets
+
+    def predictions_to_signals(self, predictions, prices):
+        self.save_to_results("Prediction", predictions)
+        return (predictions > 50).astype(int)
+
+def get_expected_predictions(test_start_dates, train_window=None, gap=0):
+    """
+    Returns the expected predictions of MeanModel for each date.
+    """
+    dates = mock_get_prices().loc["Close"].index
+    row_numbers = pd.Series(np.arange(len(dates)), index=dates, dtype=float)
+    row_numbers.iloc[-1] = np.nan
+    expected = pd.Series(np.nan, index=dates)
+    test_start_dates = pd.DatetimeIndex(test_start_dates)
+    for i, test_start_date in enumerate(test_start_dates):
+        test_end_date = test_start_dates[i + 1] if i + 1 < len(test_start_dates) else dates[-1] + pd.Timedelta(days=1)
+        train_targets = row_numbers[row_numbers.index < test_start_date]
+        if gap:
+            train_targets = train_targets.iloc[:-gap]
+        if train_window:
+            train_targets = train_targets.iloc[-train_window:]
+        expected[(dates >= test_start_date) & (dates < test_end_date)] = train_targets.mean()
+    return expected
+
+class WalkForwardTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+            patch("moonshot.strategies.base.get_prices", new=mock_get_prices),
+            patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _get_predictions(self, results):
+        predictions = results.loc["Prediction"]
+        # both sids have the same targets and therefore the same predictions
+        pd.testing.assert_series_equal(
+            predictions["FI12345"], predictions["FI23456"], check_names=False)
+        return predictions["FI12345"].rename(None)
+
+    def test_expanding_window(self):
+        """
+        Tests that each test window is predicted by a model fit on all
+        preceding dates.
+        """
+        results = MeanTargetML().walkforward(
+            "MS", model=MeanModel(), start_date="2018-03-01", end_date="2018-06-29")
+
+        pd.testing.assert_series_equal(
+            self._get_predictions(results),
+            get_expected_predictions(
+                ["2018-03-01", "2018-04-01", "2018-05-01", "2018-06-01"]).loc["2018-03-01":],
+            check_names=False, check_freq=False)
+
+    def test_rolling_window_with_gap(self):
+        """
+        Tests that train_window limits the train dates and gap excludes the
+        dates right before the test window.
+        """
+        results = MeanTargetML().walkforward(
+            "MS", model=MeanModel(), train_window=10, gap=3,
+            start_date="2018-03-01", end_date="2018-06-29")
+
+        pd.testing.assert_series_equal(
+            self._get_predictions(results),
+            get_expected_predictions(
+                ["2018-03-01", "2018-04-01", "2018-05-01", "2018-06-01"],
+                train_window=10, gap=3).loc["2018-03-01":],
+            check_names=False, check_freq=False)
+
+    def test_no_training_data(self):
+        """
+        Tests that a test window without training data gets NaN predictions.
+        """
+        results = MeanTargetML().walkforward("MS", model=MeanModel(), end_date="2018-06-29")
+
+        predictions = self._get_predictions(results)
+        expected_predictions = get_expected_predictions(
+            ["2018-01-01", "2018-02-01", "2018-03-01", "2018-04-01", "2018-05-01", "2018-06-01"])
+        self.assertTrue(predictions.loc[:"2018-01-31"].isnull().all())
+        pd.testing.assert_series_equal(
+            predictions, expected_predictions, check_names=False, check_freq=False)
+
+    def test_partial_fit_and_parallel_match_fit(self):
+        """
+        Tests that partial_fit and fitting in parallel produce the same
+        results as fitting a clone for each window.
+        """
+        results = MeanTargetML().walkforward(
+            "MS", model=MeanModel(), start_date="2018-03-01", end_date="2018-06-29")
+
+        partial_fit_results = MeanTargetML().walkforward(
+            "MS", model=MeanModel(), partial_fit=True,
+            start_date="2018-03-01", end_date="2018-06-29")
+        pd.testing.assert_frame_equal(results, partial_fit_results)
+
+        parallel_results = MeanTargetML().walkforward(
+            "MS", model=MeanModel(), n_jobs=2,
+            start_date="2018-03-01", end_date="2018-06-29")
+        pd.testing.assert_frame_equal(results, parallel_results)
+
+    def test_sklearn_model_is_cloned(self):
+        """
+        Tests that a scikit-learn model passed to walkforward is cloned
+        rather than fit in place.
+        """
+        from sklearn.linear_model import LinearRegression
+
+        model = LinearRegression()
+        MeanTargetML().walkforward(
+            "MS", model=model, start_date="2018-03-01", end_date="2018-06-29")
+        self.assertFalse(hasattr(model, "coef_"))
+
+    def test_import_does_not_load_sklearn(self):
+        """
+        Tests that scikit-learn is only imported when a walk-forward backtest
+        needs it, not by `import moonshot`.
+        """
+        result = subprocess.run(
+            [sys.executable, "-c", "import sys, moonshot; print('sklearn' in sys.modules)"],
+            stdout=subprocess.PIPE, check=True, universal_newlines=True)
+        self.assertEqual(result.stdout.strip(), "False")
+
+    def test_complain_if_invalid_params(self):
+        """
+        Tests error handling of invalid walk-forward params.
+        """
+        with self.assertRaises(MoonshotParameterError) as cm:
+            MeanTargetML().walkforward("MS", model=MeanModel(), train_window=10, partial_fit=True)
+        self.assertIn("partial_fit requires an expanding window", repr(cm.exception))
+
+        class NoPartialFitModel(object):
+            def fit(self, X, y):
+                pass
+
+        with self.assertRaises(MoonshotParameterError) as cm:
+            MeanTargetML().walkforward("MS", model=NoPartialFitModel(), partial_fit=True)
+        self.assertIn("NoPartialFitModel has no partial_fit method", repr(cm.exception))
+
+    def test_complain_if_no_targets(self):
+        """
+        Tests error handling when prices_to_features doesn't return targets.
+        """
+        class NoTargetsML(MeanTargetML):
+
+            def prices_to_features(self, prices):
+                features, _ = super(NoTargetsML, self).prices_to_features(prices)
+                return features, None
+
+        with self.assertRaises(MoonshotError) as cm:
+            NoTargetsML().walkforward("MS", model=MeanModel(), end_date="2018-06-29")
+        self.assertIn("prices_to_features must return targets for walk-forward backtests", repr(cm.exception))
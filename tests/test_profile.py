@@ -0,0 +1,168 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+import numpy as np
+from moonshot import Moonshot
+from moonshot._profiler import _reset_peak_rss
+from ._helpers import mock_download_master_file, mock_get_prices
+
+class MovingAverageStrategy(Moonshot):
+
+    DB = "test-db"
+    MAVG_WINDOW = 5
+    DIRECTION = 1
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        signals = (closes > mavgs).astype(int) * self.DIRECTION
+        return signals
+
+    def target_weights_to_positions(self, weights, prices):
+        return weights.shift()
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        return closes.pct_change() * positions.shift()
+
+class BacktestProfileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+            patch("moonshot.strategies.base.get_prices", new=mock_get_prices),
+            patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_profile_stages(self):
+        """
+        Tests that profile=True records each stage with its depth and output
+        shape, and doesn't change the results.
+        """
+        strategy = MovingAverageStrategy()
+        self.assertIsNone(strategy.profile)
+
+        results = strategy.backtest(end_date="2018-06-29", no_cache=True, profile=True)
+        pd.testing.assert_frame_equal(
+            results, MovingAverageStrategy().backtest(end_date="2018-06-29", no_cache=True))
+
+        profile = strategy.profile
+        self.assertListEqual(
+            list(profile.columns),
+            ["Stage", "Depth", "Start", "WallTime", "CpuTime", "PeakMemoryDelta", "Shape"])
+        self.assertListEqual(
+            list(zip(profile.Stage, profile.Depth)),
+            [("backtest", 0),
+             ("get_prices", 1),
+             ("_load_master_file", 2),
+             ("_prices_to_signals", 1),
+             ("prices_to_signals", 2),
+             ("signals_to_target_weights", 1),
+             ("_constrain_weights", 1),
+             ("limit_position_sizes", 2),
+             ("target_weights_to_positions", 1),
+             ("positions_to_gross_returns", 1),
+             ("_positions_to_turnover", 1),
+             ("_get_commissions", 1),
+             ("_get_slippage", 1),
+             ("concat_results", 1)])
+
+        profile = profile.set_index("Stage")
+        self.assertListEqual(profile.loc["get_prices", "Shape"], [len(mock_get_prices()), 2])
+        self.assertListEqual(profile.loc["prices_to_signals", "Shape"], [len(mock_get_prices()), 2])
+        self.assertListEqual(profile.loc["concat_results", "Shape"], list(results.shape))
+        self.assertIsNone(profile.loc["_load_master_file", "Shape"])
+        self.assertTrue((profile.WallTime >= 0).all())
+        self.assertTrue((profile.CpuTime >= 0).all())
+        self.assertTrue((profile.PeakMemoryDelta >= 0).all())
+        self.assertGreaterEqual(
+            profile.loc["backtest", "WallTime"], profile.loc["get_prices", "WallTime"])
+
+        # the methods are no longer wrapped
+        for method_name in strategy._PROFILED_METHODS:
+            self.assertNotIn(method_name, strategy.__dict__)
+
+    def _assert_peak_memory_delta(self):
+        """
+        Asserts that a temporary allocation is included in the peak memory
+        delta of its stage and the enclosing stages.
+        """
+        class AllocatingStrategy(MovingAverageStrategy):
+
+            def prices_to_signals(self, prices):
+                tmp = np.ones(4 * 1024 * 1024) # 32 MB
+                del tmp
+                return super(AllocatingStrategy, self).prices_to_signals(prices)
+
+        strategy = AllocatingStrategy()
+        strategy.backtest(end_date="2018-06-29", no_cache=True, profile=True)
+        profile = strategy.profile.set_index("Stage")
+
+        for stage in ("prices_to_signals", "_prices_to_signals", "backtest"):
+            self.assertGreaterEqual(profile.loc[stage, "PeakMemoryDelta"], 30 * 1024 * 1024)
+        self.assertLess(profile.loc["signals_to_target_weights", "PeakMemoryDelta"], 30 * 1024 * 1024)
+
+    @unittest.skipUnless(_reset_peak_rss(), "peak RSS can't be reset on this platform")
+    def test_profile_peak_memory_delta_rss(self):
+        """
+        Tests the peak memory delta measured as RSS.
+        """
+        self._assert_peak_memory_delta()
+
+    def test_profile_peak_memory_delta_tracemalloc(self):
+        """
+        Tests the peak memory delta measured with tracemalloc, where peak RSS
+        can't be reset.
+        """
+        with patch("moonshot._profiler._reset_peak_rss", return_value=False):
+            self._assert_peak_memory_delta()
+
+    def test_profile_json_trace(self):
+        """
+        Tests that passing a path writes a JSON trace of the stages.
+        """
+        trace_path = os.path.join(self.tmpdir, "trace.json")
+        strategy = MovingAverageStrategy()
+        strategy.backtest(end_date="2018-06-29", no_cache=True, profile=trace_path)
+
+        with open(trace_path) as f:
+            trace = json.load(f)
+
+        events = trace["traceEvents"]
+        self.assertListEqual([event["name"] for event in events], strategy.profile.Stage.tolist())
+        for event in events:
+            self.assertEqual(event["ph"], "X")
+            self.assertGreaterEqual(event["dur"], 0)
+            self.assertIn("peak_memory_delta", event["args"])
+        self.assertEqual(events[0]["name"], "backtest")
+        self.assertListEqual(
+            events[-1]["args"]["shape"], strategy.profile.Shape.iloc[-1])
@@ -0,0 +1,195 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+import numpy as np
+from moonshot import Moonshot
+from moonshot.results import BacktestResults
+from ._helpers import mock_download_master_file, mock_get_prices
+
+class MovingAverageStrategy(Moonshot):
+
+    DB = "test-db"
+    MAVG_WINDOW = 5
+    DIRECTION = 1
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        signals = (closes > mavgs).astype(int) * self.DIRECTION
+        return signals
+
+    def target_weights_to_positions(self, weights, prices):
+        return weights.shift()
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        return closes.pct_change() * positions.shift()
+
+class LeanBacktestResultsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+            patch("moonshot.strategies.base.get_prices", new=mock_get_prices),
+            patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def test_lean_results_match_dataframe(self):
+        """
+        Tests that the lean results have the same fields and values as the
+        DataFrame of results, and that to_frame() returns the same DataFrame.
+        """
+        for kwargs in (
+            dict(),
+            dict(start_date="2018-03-01"),
+            dict(start_date="2018-03-01", label_sids=True)):
+
+            results = MovingAverageStrategy().backtest(
+                end_date="2018-06-29", no_cache=True, **kwargs)
+            lean_results = MovingAverageStrategy().backtest(
+                end_date="2018-06-29", no_cache=True, lean=True, **kwargs)
+
+            self.assertIsInstance(lean_results, BacktestResults)
+            self.assertListEqual(
+                lean_results.fields,
+                sorted(results.index.get_level_values("Field").unique()))
+            self.assertEqual(lean_results.values.shape, (10, len(results.loc["Return"]), 2))
+
+            pd.testing.assert_frame_equal(lean_results.to_frame(), results)
+            for field in lean_results.fields:
+                pd.testing.assert_frame_equal(lean_results.loc[field], results.loc[field])
+
+            if kwargs.get("label_sids"):
+                self.assertListEqual(
+                    list(lean_results.columns), ["ABC(FI12345)", "DEF(FI23456)"])
+
+    def test_loc_returns_views(self):
+        """
+        Tests that .loc[field] returns a view of the array and .loc[fields]
+        returns a (Field, Date) DataFrame of the fields.
+        """
+        results = MovingAverageStrategy().backtest(end_date="2018-06-29", lean=True)
+
+        returns = results.loc["Return"]
+        self.assertTrue(np.shares_memory(returns.values, results.values))
+        self.assertIn("Return", results)
+        self.assertNotIn("Benchmark", results)
+        with self.assertRaises(KeyError):
+            results.loc["Benchmark"]
+
+        returns_and_weights = results.loc[["Return", "Weight"]]
+        self.assertListEqual(returns_and_weights.index.names, ["Field", "Date"])
+        pd.testing.assert_frame_equal(
+            returns_and_weights, results.to_frame().loc[["Return", "Weight"]])
+
+    def test_custom_results_and_benchmark(self):
+        """
+        Tests that custom results and a benchmark which don't have the shape
+        of the other fields are kept as DataFrames.
+        """
+        class StrategyWithCustomResults(MovingAverageStrategy):
+            BENCHMARK = "FI23456"
+
+            def prices_to_signals(self, prices):
+                closes = prices.loc["Close"]
+                self.save_to_results("FirstClose", closes[["FI12345"]])
+                return super(StrategyWithCustomResults, self).prices_to_signals(prices)
+
+        results = StrategyWithCustomResults().backtest(end_date="2018-06-29")
+        lean_results = StrategyWithCustomResults().backtest(end_date="2018-06-29", lean=True)
+
+        self.assertEqual(lean_results.values.shape[0], 10)
+        self.assertListEqual(
+            list(lean_results.loc["FirstClose"].columns), ["FI12345"])
+        pd.testing.assert_frame_equal(lean_results.to_frame(), results)
+
+    def test_intraday_to_frame(self):
+        """
+        Tests that to_frame() of intraday results matches a concatenation of
+        the fields.
+        """
+        idx = pd.MultiIndex.from_product(
+            [pd.date_range("2018-01-01", periods=3, name="Date"), ["09:30:00", "09:31:00"]],
+            names=["Date", "Time"])
+        columns = pd.Index(["FI12345", "FI23456"], name="Sid")
+        frames = {
+            "Return": pd.DataFrame(np.random.rand(6, 2), index=idx, columns=columns),
+            "TotalHoldings": pd.DataFrame(np.ones((6, 2), dtype=int), index=idx, columns=columns),
+            "Weight": pd.DataFrame(np.random.rand(6, 2), index=idx, columns=columns),
+        }
+        expected = pd.concat(frames, keys=sorted(frames.keys()), names=["Field"])
+
+        results = BacktestResults.from_frames(dict(frames), idx, columns)
+        self.assertEqual(results.values.dtype, np.float64)
+        pd.testing.assert_frame_equal(results.to_frame(), expected)
+
+        results = results.truncate_before("2018-01-02")
+        self.assertEqual(results.values.shape, (3, 4, 2))
+        pd.testing.assert_frame_equal(
+            results.to_frame(),
+            expected.iloc[expected.index.get_level_values("Date") >= pd.Timestamp("2018-01-02")])
+
+    def test_concat(self):
+        """
+        Tests that concat appends the dates and fills sids missing from a
+        date range with NaN.
+        """
+        first = BacktestResults(
+            np.arange(8).reshape(2, 2, 2),
+            ["Return", "TotalHoldings"],
+            pd.DatetimeIndex(["2018-01-01", "2018-01-02"], name="Date"),
+            pd.Index(["FI12345", "FI23456"]),
+            other_fields={"Benchmark": pd.DataFrame(
+                {"FI12345": [1.0, 2.0]},
+                index=pd.DatetimeIndex(["2018-01-01", "2018-01-02"], name="Date"))})
+        second = BacktestResults(
+            np.arange(4).reshape(2, 1, 2),
+            ["Return", "TotalHoldings"],
+            pd.DatetimeIndex(["2018-01-03"], name="Date"),
+            pd.Index(["FI23456", "FI34567"]),
+            other_fields={"Benchmark": pd.DataFrame(
+                {"FI12345": [3.0]},
+                index=pd.DatetimeIndex(["2018-01-03"], name="Date"))})
+
+        results = BacktestResults.concat([first, second])
+
+        self.assertListEqual(results.fields, ["Benchmark", "Return", "TotalHoldings"])
+        self.assertListEqual(list(results.columns), ["FI12345", "FI23456", "FI34567"])
+        self.assertDictEqual(
+            results.loc["Return"].fillna("nan").to_dict(orient="list"),
+            {"FI12345": [0.0, 2.0, "nan"],
+             "FI23456": [1.0, 3.0, 0.0],
+             "FI34567": ["nan", "nan", 1.0]})
+        self.assertDictEqual(
+            results.loc["TotalHoldings"].fillna("nan").to_dict(orient="list"),
+            {"FI12345": [4.0, 6.0, "nan"],
+             "FI23456": [5.0, 7.0, 2.0],
+             "FI34567": ["nan", "nan", 3.0]})
+        self.assertListEqual(list(results.loc["Benchmark"].FI12345), [1.0, 2.0, 3.0])
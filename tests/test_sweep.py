@@ -0,0 +1,240 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import os
+import sys
+import pickle
+import time
+import shutil
+import tempfile
+import unittest
+import importlib.util
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from sklearn.tree import DecisionTreeClassifier
+from moonshot import Moonshot, MoonshotML
+from moonshot.exceptions import MoonshotParameterError
+from ._helpers import mock_get_prices, mock_download_master_file
+
+class MovingAverageStrategy(Moonshot):
+
+    DB = "test-db"
+    MAVG_WINDOW = 5
+    DIRECTION = 1
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        signals = (closes > mavgs).astype(int) * self.DIRECTION
+        return signals
+
+    def target_weights_to_positions(self, weights, prices):
+        return weights.shift()
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        return closes.pct_change() * positions.shift()
+
+class MovingAverageML(MoonshotML):
+
+    DB = "test-db"
+    MAVG_WINDOW = 5
+
+    def prices_to_features(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        features = {}
+        features["above_mavg"] = (closes > mavgs).astype(int)
+        features["rising"] = (closes > closes.shift()).astype(int)
+        return features, None
+
+    def predictions_to_signals(self, predictions, prices):
+        return predictions.astype(int)
+
+    def target_weights_to_positions(self, weights, prices):
+        return weights.shift()
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        return closes.pct_change() * positions.shift()
+
+class SweepTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.patchers = [
+            patch("moonshot.cache.TMP_DIR", new=self.tmpdir),
+            patch("moonshot.cache.MEMORY_CACHE_BYTES", new=0),
+            patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+        shutil.rmtree(self.tmpdir)
+
+    def _backtest(self, params, **kwargs):
+        strategy_class = type("MovingAverageStrategy", (MovingAverageStrategy,), params)
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            return strategy_class().backtest(no_cache=True, **kwargs)
+
+    def test_sweep_matches_individual_backtests(self):
+        """
+        Tests that a sweep loads the prices once and returns the same results
+        as backtesting each parameter combination on its own.
+        """
+        param_grid = {"MAVG_WINDOW": [5, 60], "DIRECTION": [1, -1]}
+
+        for n_jobs in (1, 2):
+            with patch("moonshot.strategies.base.get_prices", side_effect=mock_get_prices) as mock:
+                results = MovingAverageStrategy.sweep(
+                    param_grid, start_date="2018-05-01", end_date="2018-06-29",
+                    no_cache=True, n_jobs=n_jobs)
+
+            self.assertEqual(mock.call_count, 1)
+            # prices cover the longest lookback
+            self.assertEqual(
+                mock.call_args[1]["start_date"],
+                type("MovingAverageStrategy", (MovingAverageStrategy,), {"MAVG_WINDOW": 60}
+                     )._get_start_date_with_lookback("2018-05-01"))
+
+            self.assertListEqual(
+                list(results.index.names), ["MAVG_WINDOW", "DIRECTION", "Field", "Date"])
+            self.assertListEqual(
+                results.index.droplevel(["Field", "Date"]).unique().tolist(),
+                [(5, 1), (5, -1), (60, 1), (60, -1)])
+
+            for (window, direction), combination_results in results.groupby(
+                    level=["MAVG_WINDOW", "DIRECTION"]):
+                expected_results = self._backtest(
+                    {"MAVG_WINDOW": window, "DIRECTION": direction},
+                    start_date="2018-05-01", end_date="2018-06-29")
+                pd.testing.assert_frame_equal(
+                    combination_results.droplevel(["MAVG_WINDOW", "DIRECTION"]),
+                    expected_results)
+
+    def test_sweep_single_param(self):
+        """
+        Tests that a single param sweep is keyed by the param values.
+        """
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            results = MovingAverageStrategy.sweep(
+                {"MAVG_WINDOW": [5, 10]}, end_date="2018-06-29", no_cache=True)
+
+        self.assertListEqual(list(results.index.names), ["MAVG_WINDOW", "Field", "Date"])
+        pd.testing.assert_frame_equal(
+            results.loc[10], self._backtest({"MAVG_WINDOW": 10}, end_date="2018-06-29"))
+
+    def test_sweep_ml_strategy(self):
+        """
+        Tests that sweeping a MoonshotML strategy loads the model once and
+        gives it to each backtest.
+        """
+        model = DecisionTreeClassifier()
+        # predict 1 only when the price is above its moving average and rising
+        model.fit(np.array([[1, 1], [1, 0], [0, 1], [0, 0]]), np.array([1, 0, 0, 0]))
+        model_path = os.path.join(self.tmpdir, "decision_tree_model.pkl")
+        with open(model_path, "wb") as f:
+            pickle.dump(model, f)
+
+        strategy_class = type("MovingAverageML", (MovingAverageML,), {"MODEL": model_path})
+
+        for n_jobs in (1, 2):
+            with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+                with patch.object(
+                    MoonshotML, "_load_model", autospec=True,
+                    side_effect=MoonshotML._load_model) as mock_load_model:
+                    results = strategy_class.sweep(
+                        {"MAVG_WINDOW": [5, 10]}, end_date="2018-06-29",
+                        no_cache=True, n_jobs=n_jobs)
+
+            self.assertEqual(mock_load_model.call_count, 1)
+
+            for window in (5, 10):
+                with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+                    expected_results = type(
+                        "MovingAverageML", (strategy_class,), {"MAVG_WINDOW": window}
+                    )().backtest(end_date="2018-06-29", no_cache=True)
+                pd.testing.assert_frame_equal(results.loc[window], expected_results)
+
+    def test_cache_expires_when_strategy_file_modified(self):
+        """
+        Tests that objects cached by a sweep's strategies with
+        unless_file_modified=self expire when the strategy's own file (not
+        moonshot's) is modified.
+        """
+        filepath = os.path.join(self.tmpdir, "caching_strategy.py")
+        with open(filepath, "w") as f:
+            f.write("""
+from moonshot import Moonshot
+from moonshot.cache import Cache
+
+COMPUTED = []
+
+class CachingMovingAverageStrategy(Moonshot):
+
+    DB = "test-db"
+    MAVG_WINDOW = 5
+
+    def prices_to_signals(self, prices):
+        key = ("signals", self.MAVG_WINDOW)
+        signals = Cache.get(key, prefix="sweep_test", unless_file_modified=self)
+        if signals is None:
+            COMPUTED.append(self.MAVG_WINDOW)
+            closes = prices.loc["Close"]
+            signals = (closes > closes.rolling(self.MAVG_WINDOW).mean()).astype(int)
+            Cache.set(key, signals, prefix="sweep_test")
+        return signals
+""")
+        an_hour_ago = time.time() - 3600
+        os.utime(filepath, (an_hour_ago, an_hour_ago))
+
+        spec = importlib.util.spec_from_file_location("caching_strategy", filepath)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["caching_strategy"] = module
+        self.addCleanup(sys.modules.pop, "caching_strategy")
+        spec.loader.exec_module(module)
+
+        def sweep():
+            with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+                return module.CachingMovingAverageStrategy.sweep(
+                    {"MAVG_WINDOW": [5, 10]}, end_date="2018-06-29", no_cache=True)
+
+        results = sweep()
+        self.assertListEqual(module.COMPUTED, [5, 10])
+
+        pd.testing.assert_frame_equal(sweep(), results)
+        self.assertListEqual(module.COMPUTED, [5, 10])
+
+        os.utime(filepath)
+        pd.testing.assert_frame_equal(sweep(), results)
+        self.assertListEqual(module.COMPUTED, [5, 10, 5, 10])
+
+    def test_reject_invalid_params(self):
+        """
+        Tests that unknown params and params which change the prices query
+        are rejected.
+        """
+        with self.assertRaises(MoonshotParameterError) as cm:
+            MovingAverageStrategy.sweep({"MAVG_WINDOWS": [5, 10]})
+        self.assertIn("MovingAverageStrategy has no parameter MAVG_WINDOWS", repr(cm.exception))
+
+        with self.assertRaises(MoonshotParameterError) as cm:
+            MovingAverageStrategy.sweep({"DB_FIELDS": [["Close"], ["Open"]]})
+        self.assertIn("cannot sweep DB_FIELDS because it changes the prices query", repr(cm.exception))
@@ -2566,3 +2566,34 @@ class TradeTestCase(unittest.TestCase):
                 }
             ]
         )
+
+    def test_target_quantities_by_account_and_currency(self):
+        """
+        Tests that _get_target_quantities converts each account's NLV from
+        its base currency to each sid's trade currency, and returns 0 for
+        missing exchange rates and zero contract values.
+        """
+        weights = pd.Series(
+            {"FI1": 0.5, "FI2": -0.25, "FI3": 0.1, "FI4": 0.2})
+        allocations = pd.Series({"U1": 1.0, "U2": 0.5})
+        # FI2 is a combo with a negative price
+        contract_values = pd.Series(
+            {"FI1": 10.0, "FI2": -20.0, "FI3": 0.0, "FI4": 100.0})
+        currencies = pd.Series(
+            {"FI1": "USD", "FI2": "JPY", "FI3": "USD", "FI4": "GBP"})
+        balances = pd.DataFrame(
+            dict(NetLiquidation=[100000, 200000],
+                 Currency=["USD", "EUR"]),
+            index=pd.Index(["U1", "U2"], name="Account"))
+        exchange_rates = pd.DataFrame(
+            dict(BaseCurrency=["USD", "EUR", "EUR"],
+                 QuoteCurrency=["JPY", "USD", "JPY"],
+                 Rate=[110.0, 1.2, 130.0]))
+
+        target_quantities = Moonshot()._get_target_quantities(
+            weights, allocations, contract_values, currencies, balances, exchange_rates)
+
+        self.assertDictEqual(
+            target_quantities.to_dict(),
+            {"U1": {"FI1": 5000, "FI2": -137500, "FI3": 0, "FI4": 0},
+             "U2": {"FI1": 6000, "FI2": -162500, "FI3": 0, "FI4": 0}})
@@ -0,0 +1,172 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import json
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from moonshot import Moonshot
+from moonshot.exceptions import MoonshotParameterError
+from ._helpers import mock_download_master_file, mock_get_prices
+
+POSITIONS = [
+    dict(Sid="FI12345", Account="U123", OrderRef="mavg-long", Quantity=100),
+    dict(Sid="FI23456", Account="U123", OrderRef="mavg-short", Quantity=-50),
+]
+
+OPEN_ORDERS = [
+    dict(Sid="FI23456", Account="U123", OrderRef="mavg-long", Remaining=20, Action="BUY"),
+]
+
+def mock_download_account_balances(f, **kwargs):
+    balances = pd.DataFrame(dict(Account=["U123"],
+                                 NetLiquidation=[100000],
+                                 Currency=["USD"]))
+    balances.to_csv(f, index=False)
+    f.seek(0)
+
+def mock_download_exchange_rates(f, **kwargs):
+    rates = pd.DataFrame(dict(BaseCurrency=["USD"],
+                              QuoteCurrency=["USD"],
+                              Rate=[1.0]))
+    rates.to_csv(f, index=False)
+    f.seek(0)
+
+def mock_list_positions(order_refs=None, **kwargs):
+    return [position for position in POSITIONS if position["OrderRef"] in order_refs]
+
+def mock_download_order_statuses(f, order_refs=None, **kwargs):
+    orders = [order for order in OPEN_ORDERS if order["OrderRef"] in order_refs]
+    if orders:
+        json.dump(orders, f)
+        f.seek(0)
+
+class MovingAverageStrategy(Moonshot):
+
+    DB = "test-db"
+    MAVG_WINDOW = 5
+    DIRECTION = 1
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        signals = (closes > mavgs).astype(int) * self.DIRECTION
+        return signals
+
+    def target_weights_to_positions(self, weights, prices):
+        return weights.shift()
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        return closes.pct_change() * positions.shift()
+
+class LongMovingAverageStrategy(MovingAverageStrategy):
+    CODE = "mavg-long"
+
+class ShortMovingAverageStrategy(MovingAverageStrategy):
+    CODE = "mavg-short"
+    DIRECTION = -1
+
+class OtherDbMovingAverageStrategy(MovingAverageStrategy):
+    CODE = "mavg-other"
+    DB = "other-db"
+
+class TradeBatchTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.patchers = [
+            patch("moonshot.strategies.base.get_prices", side_effect=mock_get_prices),
+            patch("moonshot.strategies.base.download_master_file", side_effect=mock_download_master_file),
+            patch("moonshot.strategies.base.download_account_balances", side_effect=mock_download_account_balances),
+            patch("moonshot.strategies.base.download_exchange_rates", side_effect=mock_download_exchange_rates),
+            patch("moonshot.strategies.base.list_positions", side_effect=mock_list_positions),
+            patch("moonshot.strategies.base.download_order_statuses", side_effect=mock_download_order_statuses),
+        ]
+        self.mocks = {}
+        for patcher in self.patchers:
+            mock = patcher.start()
+            self.mocks[patcher.attribute] = mock
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def _reset_mocks(self):
+        for mock in self.mocks.values():
+            mock.reset_mock()
+
+    def test_trade_batch_matches_trade(self):
+        """
+        Tests that trade_batch returns the orders of each strategy traded on
+        its own, attributing positions and open orders by OrderRef.
+        """
+        expected_orders = pd.concat([
+            LongMovingAverageStrategy().trade({"U123": 1.0}, review_date="2018-06-29"),
+            ShortMovingAverageStrategy().trade({"U123": 0.5}, review_date="2018-06-29")],
+            ignore_index=True)
+
+        orders = Moonshot.trade_batch([
+            (LongMovingAverageStrategy, {"U123": 1.0}),
+            (ShortMovingAverageStrategy(), {"U123": 0.5})],
+            review_date="2018-06-29")
+
+        pd.testing.assert_frame_equal(orders, expected_orders)
+        self.assertListEqual(list(orders.OrderRef.unique()), ["mavg-long", "mavg-short"])
+
+    def test_trade_batch_shares_queries(self):
+        """
+        Tests that strategies with the same prices query share one prices
+        query, and that the master file, balances, exchange rates, positions
+        and orders are queried once for all strategies.
+        """
+        Moonshot.trade_batch([
+            (LongMovingAverageStrategy, {"U123": 1.0}),
+            (ShortMovingAverageStrategy, {"U123": 0.5})],
+            review_date="2018-06-29")
+
+        for name in (
+            "get_prices",
+            "download_master_file",
+            "download_account_balances",
+            "download_exchange_rates",
+            "list_positions",
+            "download_order_statuses"):
+            self.assertEqual(self.mocks[name].call_count, 1, name)
+
+        self.assertListEqual(
+            self.mocks["list_positions"].call_args[1]["order_refs"],
+            ["mavg-long", "mavg-short"])
+
+        self._reset_mocks()
+
+        Moonshot.trade_batch([
+            (LongMovingAverageStrategy, {"U123": 1.0}),
+            (OtherDbMovingAverageStrategy, {"U123": 0.5})],
+            review_date="2018-06-29")
+
+        self.assertListEqual(
+            [call[1]["codes"] for call in self.mocks["get_prices"].call_args_list],
+            [["test-db"], ["other-db"]])
+        self.assertEqual(self.mocks["download_master_file"].call_count, 1)
+
+    def test_complain_if_no_strategies(self):
+        """
+        Tests error handling when trade_batch is called without strategies.
+        """
+        with self.assertRaises(MoonshotParameterError) as cm:
+            Moonshot.trade_batch([])
+
+        self.assertIn("strategies must not be empty", repr(cm.exception))
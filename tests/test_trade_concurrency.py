@@ -0,0 +1,145 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import threading
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from moonshot import Moonshot
+from ._helpers import mock_download_master_file, mock_get_prices
+
+def mock_download_account_balances(f, **kwargs):
+    balances = pd.DataFrame(dict(Account=["U123"],
+                                 NetLiquidation=[100000],
+                                 Currency=["USD"]))
+    balances.to_csv(f, index=False)
+    f.seek(0)
+
+def mock_download_exchange_rates(f, **kwargs):
+    rates = pd.DataFrame(dict(BaseCurrency=["USD"],
+                              QuoteCurrency=["USD"],
+                              Rate=[1.0]))
+    rates.to_csv(f, index=False)
+    f.seek(0)
+
+def mock_list_positions(**kwargs):
+    return []
+
+def mock_download_order_statuses(f, **kwargs):
+    pass
+
+class MovingAverageStrategy(Moonshot):
+
+    DB = "test-db"
+    MAVG_WINDOW = 5
+    DIRECTION = 1
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        signals = (closes > mavgs).astype(int) * self.DIRECTION
+        return signals
+
+    def target_weights_to_positions(self, weights, prices):
+        return weights.shift()
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        return closes.pct_change() * positions.shift()
+
+class TradeMovingAverageStrategy(MovingAverageStrategy):
+    CODE = "mavg"
+
+class ConcurrentTradeQueriesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.patchers = [
+            patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file),
+            patch("moonshot.strategies.base.download_account_balances", new=mock_download_account_balances),
+            patch("moonshot.strategies.base.download_exchange_rates", new=mock_download_exchange_rates),
+            patch("moonshot.strategies.base.list_positions", new=mock_list_positions),
+            patch("moonshot.strategies.base.download_order_statuses", new=mock_download_order_statuses),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_queries_overlap_prices_and_signals(self):
+        """
+        Tests that the account balances are queried while the prices are
+        loading and the positions while the signals are computed.
+        """
+        balances_queried = threading.Event()
+        signals_started = threading.Event()
+        waits = {}
+
+        def _mock_download_account_balances(f, **kwargs):
+            balances_queried.set()
+            mock_download_account_balances(f, **kwargs)
+
+        def _mock_get_prices(*args, **kwargs):
+            # if the balances were queried after the prices, this would
+            # time out
+            waits["get_prices"] = balances_queried.wait(timeout=5)
+            return mock_get_prices(*args, **kwargs)
+
+        def _mock_list_positions(**kwargs):
+            waits["list_positions"] = signals_started.wait(timeout=5)
+            return []
+
+        class SignalingStrategy(TradeMovingAverageStrategy):
+
+            def prices_to_signals(self, prices):
+                signals_started.set()
+                return super(SignalingStrategy, self).prices_to_signals(prices)
+
+        with patch("moonshot.strategies.base.get_prices", new=_mock_get_prices):
+            with patch("moonshot.strategies.base.download_account_balances", new=_mock_download_account_balances):
+                with patch("moonshot.strategies.base.list_positions", new=_mock_list_positions):
+                    SignalingStrategy().trade({"U123": 1.0}, review_date="2018-06-29")
+
+        self.assertDictEqual(waits, {"get_prices": True, "list_positions": True})
+
+    def test_profile_trade_queries(self):
+        """
+        Tests that trade(profile=True) records the queries as stages nested
+        in the trade.
+        """
+        strategy = TradeMovingAverageStrategy()
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            orders = strategy.trade({"U123": 1.0}, review_date="2018-06-29", profile=True)
+
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            expected_orders = TradeMovingAverageStrategy().trade({"U123": 1.0}, review_date="2018-06-29")
+
+        pd.testing.assert_frame_equal(orders, expected_orders)
+
+        profile = strategy.profile.set_index("Stage")
+        for stage in (
+            "download_account_balances",
+            "download_exchange_rates",
+            "list_positions",
+            "download_order_statuses"):
+            self.assertIn(stage, profile.index)
+            self.assertGreaterEqual(profile.loc[stage, "WallTime"], 0)
+
+        self.assertEqual(profile.loc["trade", "Depth"], 0)
+        self.assertEqual(profile.loc["download_account_balances", "Depth"], 1)
+        self.assertEqual(profile.loc["_get_positions_and_orders", "Depth"], 1)
+        self.assertEqual(profile.loc["list_positions", "Depth"], 2)
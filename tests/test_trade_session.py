@@ -0,0 +1,285 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from moonshot import Moonshot, TradingSession
+from ._helpers import mock_download_master_file
+
+def mock_download_account_balances(f, **kwargs):
+    balances = pd.DataFrame(dict(Account=["U123"],
+                                 NetLiquidation=[100000],
+                                 Currency=["USD"]))
+    balances.to_csv(f, index=False)
+    f.seek(0)
+
+def mock_download_exchange_rates(f, **kwargs):
+    rates = pd.DataFrame(dict(BaseCurrency=["USD"],
+                              QuoteCurrency=["USD"],
+                              Rate=[1.0]))
+    rates.to_csv(f, index=False)
+    f.seek(0)
+
+def mock_list_positions(**kwargs):
+    return []
+
+def mock_download_order_statuses(f, **kwargs):
+    pass
+
+class TradeMovingAverageStrategy(Moonshot):
+
+    CODE = "mavg"
+    DB = "test-db"
+    MAVG_WINDOW = 5
+    DIRECTION = 1
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        signals = (closes > mavgs).astype(int) * self.DIRECTION
+        return signals
+
+    def target_weights_to_positions(self, weights, prices):
+        return weights.shift()
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        return closes.pct_change() * positions.shift()
+
+class MockPriceSource(object):
+    """
+    Mimics quantrocket.price.get_prices for an intraday db whose last date
+    is today and which gains a minute bar at each tick.
+    """
+    def __init__(self, n_dates=10, n_times=10):
+        self.dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=n_dates, name="Date")
+        self.times = ["09:{0:02d}:00".format(30 + i) for i in range(n_times + 20)]
+        self.n_times = n_times
+        self.n_today_times = n_times // 2
+
+    def tick(self):
+        self.n_today_times += 1
+
+    @property
+    def last_time(self):
+        return self.times[self.n_today_times - 1]
+
+    def get_prices(self, start_date=None, end_date=None, **kwargs):
+        idx = pd.MultiIndex.from_tuples(
+            [(date, time) for date in self.dates[:-1] for time in self.times[:self.n_times]]
+            + [(self.dates[-1], time) for time in self.times[:self.n_today_times]],
+            names=["Date", "Time"])
+        bar_numbers = np.arange(len(idx))
+        prices = pd.DataFrame(
+            {
+                "FI12345": 10 + np.sin(bar_numbers / 3),
+                "FI23456": 20 + np.cos(bar_numbers / 5),
+            },
+            index=idx)
+        prices.columns.name = "Sid"
+        dates = prices.index.get_level_values("Date")
+        if start_date:
+            prices = prices[dates >= pd.Timestamp(start_date)]
+            dates = prices.index.get_level_values("Date")
+        if end_date:
+            prices = prices[dates <= pd.Timestamp(end_date)]
+        return pd.concat({"Close": prices}, names=["Field"])
+
+class TradingSessionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.source = MockPriceSource()
+        self.patchers = [
+            patch("moonshot.strategies.base.get_prices", side_effect=self.source.get_prices),
+            patch("moonshot.strategies.base.download_master_file", side_effect=mock_download_master_file),
+            patch("moonshot.strategies.base.download_account_balances", new=mock_download_account_balances),
+            patch("moonshot.strategies.base.download_exchange_rates", new=mock_download_exchange_rates),
+            patch("moonshot.strategies.base.list_positions", new=mock_list_positions),
+            patch("moonshot.strategies.base.download_order_statuses", new=mock_download_order_statuses),
+        ]
+        self.mocks = {}
+        for patcher in self.patchers:
+            self.mocks[patcher.attribute] = patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def _review_date(self):
+        # just after the last bar of today
+        return "{0} {1}:30".format(self.source.dates[-1].date().isoformat(), self.source.last_time[:5])
+
+    def _wait_for(self, condition):
+        deadline = time.time() + 5
+        while not condition() and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertTrue(condition())
+
+    def test_session_matches_trade(self):
+        """
+        Tests that each trade of a session creates the same orders as a
+        trade from scratch, after the prices held are refreshed with only
+        the new bars.
+        """
+        prepared = []
+
+        class PreparingStrategy(TradeMovingAverageStrategy):
+
+            def _prepare_to_trade(self):
+                prepared.append(True)
+
+        session = TradingSession(PreparingStrategy, {"U123": 1.0})
+        self.assertEqual(self.mocks["get_prices"].call_count, 1)
+
+        for i in range(3):
+            self.source.tick()
+            review_date = self._review_date()
+
+            get_prices_calls = self.mocks["get_prices"].call_count
+            orders = session.trade(review_date=review_date)
+
+            # only today's bars were queried
+            self.assertEqual(self.mocks["get_prices"].call_count, get_prices_calls + 1)
+            self.assertEqual(
+                self.mocks["get_prices"].call_args[1]["start_date"],
+                self.source.dates[-1].date().isoformat())
+
+            expected_orders = TradeMovingAverageStrategy().trade({"U123": 1.0}, review_date=review_date)
+            pd.testing.assert_frame_equal(orders, expected_orders)
+            self.assertEqual(session.strategy._signal_time, self.source.last_time)
+
+        # the strategy was prepared and the master file queried once for the session
+        self.assertEqual(len(prepared), 1)
+        self.assertEqual(
+            self.mocks["download_master_file"].call_count,
+            1 + 3) # plus once for each trade from scratch
+
+    def test_strategy_modifying_prices_in_place(self):
+        """
+        Tests that a strategy which modifies its prices in place doesn't
+        change the prices held by the session for later trades.
+        """
+        class ModifyingStrategy(TradeMovingAverageStrategy):
+
+            # reach back into the previous day's bars, which the session
+            # doesn't query again
+            MAVG_WINDOW = 15
+
+            def prices_to_signals(self, prices):
+                signals = super(ModifyingStrategy, self).prices_to_signals(prices)
+                prices *= 2
+                return signals
+
+        session = TradingSession(ModifyingStrategy, {"U123": 1.0})
+
+        for i in range(2):
+            self.source.tick()
+            review_date = self._review_date()
+
+            orders = session.trade(review_date=review_date)
+            expected_orders = ModifyingStrategy().trade({"U123": 1.0}, review_date=review_date)
+            pd.testing.assert_frame_equal(orders, expected_orders)
+
+    def test_refresh_drops_dates_before_lookback(self):
+        """
+        Tests that refreshing drops the dates that have left the lookback
+        window.
+        """
+        session = TradingSession(TradeMovingAverageStrategy, {"U123": 1.0})
+        start_date = pd.Timestamp(
+            TradeMovingAverageStrategy._get_start_date_with_lookback(pd.Timestamp.today()))
+
+        # pretend an old date was held
+        old_date = pd.Timestamp("2010-01-04")
+        old_prices = session.prices.loc[["Close"]].xs(
+            session.prices.index.get_level_values("Date")[0], level="Date", drop_level=False)
+        old_prices = old_prices.rename(index={old_prices.index.get_level_values("Date")[0]: old_date}, level="Date")
+        session.prices = pd.concat([old_prices, session.prices])
+
+        session.refresh()
+        dates = session.prices.index.get_level_values("Date")
+        self.assertGreaterEqual(dates.min(), start_date)
+        self.assertNotIn(old_date, dates)
+
+    def test_background_refresh(self):
+        """
+        Tests that a started session with a refresh_interval refreshes the
+        prices in the background and that trades use them without querying
+        prices.
+        """
+        with TradingSession(TradeMovingAverageStrategy, {"U123": 1.0}, refresh_interval=0.01) as session:
+            self.source.tick()
+            last_date = self.source.dates[-1]
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                times = session.prices.xs(last_date, level="Date").index.get_level_values("Time")
+                if self.source.last_time in times:
+                    break
+                time.sleep(0.01)
+            self.assertIn(self.source.last_time, times)
+
+            review_date = self._review_date()
+            refresh = session.refresh
+            refresh_threads = []
+
+            def _refresh():
+                refresh_threads.append(threading.current_thread())
+                refresh()
+
+            with patch.object(session, "refresh", new=_refresh):
+                orders = session.trade(review_date=review_date)
+
+            # the trade didn't refresh the prices itself
+            self.assertNotIn(threading.current_thread(), refresh_threads)
+
+        self.assertIsNone(session._refresher)
+        expected_orders = TradeMovingAverageStrategy().trade({"U123": 1.0}, review_date=review_date)
+        pd.testing.assert_frame_equal(orders, expected_orders)
+
+    def test_background_refresh_error_raised_by_trade(self):
+        """
+        Tests that an error in the background refresh is raised by trades
+        until a later refresh succeeds, and that the session keeps
+        refreshing.
+        """
+        get_prices = self.mocks["get_prices"].side_effect
+
+        with TradingSession(TradeMovingAverageStrategy, {"U123": 1.0}, refresh_interval=0.01) as session:
+            self.mocks["get_prices"].side_effect = ValueError("db unavailable")
+            self._wait_for(lambda: session._refresh_error is not None)
+
+            with self.assertRaises(ValueError) as cm:
+                session.trade(review_date=self._review_date())
+            self.assertIn("db unavailable", repr(cm.exception))
+            self.assertTrue(session._refresher.is_alive())
+
+            self.mocks["get_prices"].side_effect = get_prices
+            self.source.tick()
+            last_date = self.source.dates[-1]
+            self._wait_for(
+                lambda: session._refresh_error is None
+                and self.source.last_time in session.prices.xs(
+                    last_date, level="Date").index.get_level_values("Time"))
+
+            review_date = self._review_date()
+            orders = session.trade(review_date=review_date)
+
+        expected_orders = TradeMovingAverageStrategy().trade({"U123": 1.0}, review_date=review_date)
+        pd.testing.assert_frame_equal(orders, expected_orders)
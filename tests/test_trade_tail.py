@@ -0,0 +1,150 @@
+# Copyright 2018 QuantRocket LLC - All Rights Reserved
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
+
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from moonshot import Moonshot
+from moonshot.exceptions import MoonshotError
+from ._helpers import mock_download_master_file, mock_get_prices
+
+def mock_download_account_balances(f, **kwargs):
+    balances = pd.DataFrame(dict(Account=["U123"],
+                                 NetLiquidation=[100000],
+                                 Currency=["USD"]))
+    balances.to_csv(f, index=False)
+    f.seek(0)
+
+def mock_download_exchange_rates(f, **kwargs):
+    rates = pd.DataFrame(dict(BaseCurrency=["USD"],
+                              QuoteCurrency=["USD"],
+                              Rate=[1.0]))
+    rates.to_csv(f, index=False)
+    f.seek(0)
+
+def mock_list_positions(**kwargs):
+    return []
+
+def mock_download_order_statuses(f, **kwargs):
+    pass
+
+class TradeMovingAverageStrategy(Moonshot):
+
+    CODE = "mavg"
+    DB = "test-db"
+    MAVG_WINDOW = 5
+    DIRECTION = 1
+
+    def prices_to_signals(self, prices):
+        closes = prices.loc["Close"]
+        mavgs = closes.rolling(self.MAVG_WINDOW).mean()
+        signals = (closes > mavgs).astype(int) * self.DIRECTION
+        return signals
+
+    def target_weights_to_positions(self, weights, prices):
+        return weights.shift()
+
+    def positions_to_gross_returns(self, positions, prices):
+        closes = prices.loc["Close"]
+        return closes.pct_change() * positions.shift()
+
+class TailTradeMovingAverageStrategy(TradeMovingAverageStrategy):
+    TRADE_TAIL_ONLY = True
+
+class TailOnlyTradeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.patchers = [
+            patch("moonshot.strategies.base.download_master_file", new=mock_download_master_file),
+            patch("moonshot.strategies.base.download_account_balances", new=mock_download_account_balances),
+            patch("moonshot.strategies.base.download_exchange_rates", new=mock_download_exchange_rates),
+            patch("moonshot.strategies.base.list_positions", new=mock_list_positions),
+            patch("moonshot.strategies.base.download_order_statuses", new=mock_download_order_statuses),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+
+    def tearDown(self):
+        for patcher in self.patchers:
+            patcher.stop()
+
+    def test_tail_only_trade_matches_trade(self):
+        """
+        Tests that TRADE_TAIL_ONLY queries prices from the tail start date
+        through the review date, runs the strategy on the signal date and the
+        LOOKBACK_WINDOW dates before it, and creates the same orders as a
+        full trade.
+        """
+        signal_prices = []
+
+        class RecordingStrategy(TailTradeMovingAverageStrategy):
+
+            def prices_to_signals(self, prices):
+                signal_prices.append(prices)
+                return super(RecordingStrategy, self).prices_to_signals(prices)
+
+        for review_date in ("2018-04-16", "2018-06-29"):
+            with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+                expected_orders = TradeMovingAverageStrategy().trade(
+                    {"U123": 1.0}, review_date=review_date)
+
+            with patch("moonshot.strategies.base.get_prices", side_effect=mock_get_prices) as mock:
+                orders = RecordingStrategy().trade({"U123": 1.0}, review_date=review_date)
+
+            self.assertIsNotNone(orders)
+            pd.testing.assert_frame_equal(orders, expected_orders)
+
+            get_prices_kwargs = mock.call_args[1]
+            self.assertEqual(
+                get_prices_kwargs["start_date"],
+                TailTradeMovingAverageStrategy._get_tail_start_date(review_date))
+            self.assertEqual(get_prices_kwargs["end_date"], review_date)
+
+            dates = signal_prices[-1].index.get_level_values("Date").unique()
+            self.assertEqual(len(dates), 6)
+            self.assertEqual(dates.max(), pd.Timestamp(review_date))
+
+    def test_tail_start_date(self):
+        """
+        Tests that the tail start date covers the lookback window, the signal
+        date and holidays in weekdays.
+        """
+        # 5 + 1 + 1 weekdays before Monday 2018-06-25
+        self.assertEqual(
+            TailTradeMovingAverageStrategy._get_tail_start_date("2018-06-25"),
+            "2018-06-14")
+
+        # a longer lookback allows for more holidays
+        class LongTailStrategy(TailTradeMovingAverageStrategy):
+            LOOKBACK_WINDOW = 52
+
+        self.assertEqual(
+            LongTailStrategy._get_tail_start_date("2018-06-25"),
+            (pd.Timestamp("2018-06-25") - pd.offsets.BDay(52 + 1 + 5)).date().isoformat())
+
+    def test_tail_only_trade_missing_signal_date(self):
+        """
+        Tests that a signal date missing from the prices is still reported
+        in tail-only trading.
+        """
+        with patch("moonshot.strategies.base.get_prices", new=mock_get_prices):
+            with self.assertRaises(MoonshotError) as cm:
+                TailTradeMovingAverageStrategy().trade({"U123": 1.0}, review_date="2018-07-03")
+
+        self.assertIn(
+            "expected signal date 2018-07-03 not found in target weights DataFrame, "
+            "is the underlying data up-to-date? (max date is 2018-06-29)",
+            repr(cm.exception))
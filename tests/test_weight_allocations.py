@@ -15,12 +15,20 @@
 # To run: python3 -m unittest discover -s tests/ -p test_*.py -t . -v
 
 import os
+import sys
+import subprocess
 import unittest
 from unittest.mock import patch
 import glob
 import pandas as pd
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None
 from moonshot import Moonshot
 from moonshot.cache import TMP_DIR
+from moonshot.exceptions import MoonshotParameterError
 
 class WeightAllocationsTestCase(unittest.TestCase):
 
@@ -137,3 +145,69 @@ class WeightAllocationsTestCase(unittest.TestCase):
              "FI23456": [0.0, -0.34, 0.17, 0.34, -0.0],
              "FI34567": [0.0, 0.17, -0.34, -0.34, -0.0]}
         )
+
+    def test_neutralize_weights_with_nans(self):
+        """
+        Tests that neutralize_weights reduces the overweight side and
+        returns 0 for NaNs.
+        """
+        weights = pd.DataFrame(
+            data={
+                "FI12345": [0.5, 0.2, None, 0.1],
+                "FI23456": [-0.25, -0.4, 0.3, None],
+                "FI34567": [0.25, None, -0.6, None]
+            }
+        )
+
+        target_weights = Moonshot().neutralize_weights(weights).round(7)
+
+        self.assertDictEqual(
+            target_weights.to_dict(orient="list"),
+            {"FI12345": [0.1666667, 0.2, 0.0, 0.0],
+             "FI23456": [-0.25, -0.2, 0.3, 0.0],
+             "FI34567": [0.0833333, 0.0, -0.3, 0.0]}
+        )
+
+    def test_complain_if_invalid_weight_kernels(self):
+        """
+        Tests error handling when WEIGHT_KERNELS is invalid.
+        """
+        class InvalidKernels(Moonshot):
+            WEIGHT_KERNELS = "cython"
+
+        weights = pd.DataFrame(data={"FI12345": [0.5], "FI23456": [-0.25]})
+
+        with self.assertRaises(MoonshotParameterError) as cm:
+            InvalidKernels().neutralize_weights(weights)
+
+        self.assertIn("WEIGHT_KERNELS must be 'numpy' or 'numba', not cython", repr(cm.exception))
+
+    @unittest.skipIf(numba is None, "numba not installed")
+    def test_numba_weight_kernels(self):
+        """
+        Tests that the numba kernels give the same weights as the NumPy
+        kernels, up to rounding (they sum in a different order).
+        """
+        class NumbaKernels(Moonshot):
+            WEIGHT_KERNELS = "numba"
+
+        rng = np.random.RandomState(0)
+        signals = pd.DataFrame(rng.choice([-1, 0, 1, np.nan], size=(50, 200)))
+
+        for neutralize_weights in (False, True):
+            pd.testing.assert_frame_equal(
+                NumbaKernels().allocate_market_neutral_fixed_weights_capped(
+                    signals, 0.02, cap=1.0, neutralize_weights=neutralize_weights),
+                Moonshot().allocate_market_neutral_fixed_weights_capped(
+                    signals, 0.02, cap=1.0, neutralize_weights=neutralize_weights),
+                check_exact=False, rtol=1e-12, atol=1e-15)
+
+    def test_import_does_not_load_numba(self):
+        """
+        Tests that numba is only imported when the numba kernels are
+        selected, not by `import moonshot`.
+        """
+        result = subprocess.run(
+            [sys.executable, "-c", "import sys, moonshot; print('numba' in sys.modules)"],
+            stdout=subprocess.PIPE, check=True, universal_newlines=True)
+        self.assertEqual(result.stdout.strip(), "False")